@@ -0,0 +1,231 @@
+"""Benchmarks for parsing, compiling, and rendering templates with each environment
+
+Usage:
+
+    python benchmarks/bench.py                        # run everything, print results
+    python benchmarks/bench.py -k size                # only workloads/envs matching "size"
+    python benchmarks/bench.py --save baseline.json   # store results as a baseline
+    python benchmarks/bench.py --compare baseline.json --threshold 0.15
+
+When comparing, any timing slower than its baseline by more than the threshold
+(a fraction — 0.15 means 15%) is flagged, and the process exits with status 1.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import jinja2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jinja_comprehensions import (  # noqa: E402
+    ComprehensionEnvironment,
+    NativeComprehensionEnvironment,
+    NoLiteralEvalComprehensionNativeEnvironment,
+)
+
+ENV_CLASSES: dict[str, type[jinja2.Environment]] = {
+    'vanilla': jinja2.Environment,
+    'normal': ComprehensionEnvironment,
+    'native': NativeComprehensionEnvironment,
+    'native-no_literal_eval': NoLiteralEvalComprehensionNativeEnvironment,
+}
+
+STAGES = ('parse', 'codegen', 'render')
+
+
+@dataclass
+class Workload:
+    name: str
+    #: Expression shared by the comprehension environments and plain Python
+    expr: str
+    context: dict[str, Any] = field(default_factory=dict)
+    #: Equivalent template for vanilla Jinja2, which doesn't support comprehensions
+    vanilla_source: str | None = None
+
+    @property
+    def source(self) -> str:
+        return '{{ %s }}' % self.expr
+
+
+def _join_loop(loop_header: str, element: str) -> str:
+    return (
+        '[{%% %s %%}{{ %s }}{%% if not loop.last %%}, {%% endif %%}{%% endfor %%}]'
+        % (loop_header, element)
+    )
+
+
+def iter_workloads() -> Iterator[Workload]:
+    # NOTE: iterables are passed through the context, so the comprehensions
+    #       can't be constant-folded away at compile time.
+    for size in (10, 100, 1_000, 10_000):
+        yield Workload(
+            name=f'size-{size}',
+            expr='[n * 2 for n in items if n % 3]',
+            context={'items': list(range(size))},
+            vanilla_source=_join_loop('for n in items if n % 3', 'n * 2'),
+        )
+
+    for depth in (1, 2, 3, 4):
+        targets = [f'a{i}' for i in range(depth)]
+        yield Workload(
+            name=f'depth-{depth}',
+            expr='[%s %s]' % (
+                ' + '.join(targets),
+                ' '.join(f'for {target} in items' for target in targets),
+            ),
+            context={'items': list(range(8))},
+        )
+
+    for spreads in (1, 4, 16):
+        names = [f's{i}' for i in range(spreads)]
+        yield Workload(
+            name=f'spreads-{spreads}',
+            expr='[%s]' % ', '.join(f'*{name}' for name in names),
+            context={name: list(range(50)) for name in names},
+        )
+
+
+def _time(func: Callable[[], Any], min_time: float, repeat: int) -> float:
+    """Return the best per-call time of func, in seconds"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def _time_async(func: Callable[[], Any], min_time: float, repeat: int) -> float:
+    loop = asyncio.new_event_loop()
+    try:
+        return _time(lambda: loop.run_until_complete(func()), min_time, repeat)
+    finally:
+        loop.close()
+
+
+def run(pattern: str | None, min_time: float, repeat: int) -> dict[str, float]:
+    results: dict[str, float] = {}
+
+    def wanted(key: str) -> bool:
+        return not pattern or pattern in key
+
+    def record(key: str, timer: Callable[[], float]) -> None:
+        if wanted(key):
+            results[key] = seconds = timer()
+            print(f'{key:<60} {seconds * 1e6:>12.2f} µs', flush=True)
+
+    for workload in iter_workloads():
+        code = compile(workload.expr, '<expr>', 'eval')
+        record(
+            f'{workload.name}/python/render',
+            lambda: _time(lambda: eval(code, dict(workload.context)), min_time, repeat),
+        )
+
+        for env_name, env_class in ENV_CLASSES.items():
+            source = workload.vanilla_source if env_class is jinja2.Environment else workload.source
+            if source is None:
+                continue
+
+            for is_async in (False, True):
+                mode = 'async' if is_async else 'sync'
+                prefix = f'{workload.name}/{env_name}/{mode}'
+                if not any(wanted(f'{prefix}/{stage}') for stage in STAGES):
+                    continue
+
+                env = env_class(enable_async=is_async)
+                node = env.parse(source)
+                template = env.from_string(source)
+
+                record(
+                    f'{prefix}/parse',
+                    lambda: _time(lambda: env.parse(source), min_time, repeat),
+                )
+                record(
+                    f'{prefix}/codegen',
+                    lambda: _time(lambda: env._generate(node, None, None), min_time, repeat),
+                )
+                if is_async:
+                    record(
+                        f'{prefix}/render',
+                        lambda: _time_async(
+                            lambda: template.render_async(workload.context), min_time, repeat
+                        ),
+                    )
+                else:
+                    record(
+                        f'{prefix}/render',
+                        lambda: _time(lambda: template.render(workload.context), min_time, repeat),
+                    )
+
+    return results
+
+
+def compare(
+    results: dict[str, float], baseline: dict[str, float], threshold: float
+) -> list[str]:
+    """Return descriptions of all results slower than their baseline by more than threshold"""
+    regressions = []
+    for key, seconds in results.items():
+        base = baseline.get(key)
+        if base is None or base <= 0:
+            continue
+
+        change = seconds / base - 1
+        if change > threshold:
+            regressions.append(
+                f'{key}: {base * 1e6:.2f} µs -> {seconds * 1e6:.2f} µs ({change:+.1%})'
+            )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-k', dest='pattern', help='only run timings whose key contains this')
+    parser.add_argument('--save', type=Path, help='write results to this JSON file')
+    parser.add_argument('--compare', type=Path, help='compare results to this baseline JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fractional slowdown at which a result is a regression')
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help='minimum seconds spent per timing run')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timing runs')
+    args = parser.parse_args(argv)
+
+    results = run(args.pattern, args.min_time, args.repeat)
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s) beyond {args.threshold:.0%}:')
+            for regression in regressions:
+                print(f'  {regression}')
+            return 1
+        print(f'\nNo regressions beyond {args.threshold:.0%}')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,56 @@
-from .environment import ComprehensionEnvironment
-from .nativetypes import (
-    NativeComprehensionEnvironment,
-    NoLiteralEvalComprehensionNativeEnvironment,
-    NoLiteralEvalNativeEnvironment,
-)
+from __future__ import annotations
+
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .batch import RenderResult, render_many
+    from .bccache import ComprehensionBytecodeCache
+    from .environment import ComprehensionEnvironment, ComprehensionExpression
+    from .nativetypes import (
+        NativeComprehensionEnvironment,
+        NoLiteralEvalComprehensionNativeEnvironment,
+        NoLiteralEvalNativeEnvironment,
+    )
+    from .parsecache import ParseTreeCache, shared_parse_tree_cache
+    from .profiling import CompileProfiler, ComprehensionProfiler
+    from .sandbox import SandboxedComprehensionEnvironment, SandboxedNativeComprehensionEnvironment
+    from .templatecache import SizedTemplateCache
+
+#: Submodule defining each public name. Submodules are only imported once one of
+#: their names is first accessed, so importing the package itself is cheap, and
+#: e.g. using only ComprehensionEnvironment never imports the native or sandboxed
+#: environments (nor jinja2.nativetypes, jinja2.sandbox, asyncio, etc.).
+_SUBMODULES = {
+    'RenderResult': 'batch',
+    'render_many': 'batch',
+    'ComprehensionBytecodeCache': 'bccache',
+    'ComprehensionEnvironment': 'environment',
+    'ComprehensionExpression': 'environment',
+    'NativeComprehensionEnvironment': 'nativetypes',
+    'NoLiteralEvalComprehensionNativeEnvironment': 'nativetypes',
+    'NoLiteralEvalNativeEnvironment': 'nativetypes',
+    'ParseTreeCache': 'parsecache',
+    'shared_parse_tree_cache': 'parsecache',
+    'CompileProfiler': 'profiling',
+    'ComprehensionProfiler': 'profiling',
+    'SandboxedComprehensionEnvironment': 'sandbox',
+    'SandboxedNativeComprehensionEnvironment': 'sandbox',
+    'SizedTemplateCache': 'templatecache',
+}
+
+__all__ = list(_SUBMODULES)
+
+
+def __getattr__(name: str) -> Any:
+    submodule = _SUBMODULES.get(name)
+    if submodule is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    value = getattr(importlib.import_module(f'.{submodule}', __name__), name)
+    globals()[name] = value  # Later lookups needn't go through __getattr__
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted({*globals(), *__all__})
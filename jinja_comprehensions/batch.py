@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import asyncio
+import marshal
+import os
+import pickle
+import traceback
+from collections import ChainMap, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Mapping, NamedTuple
+
+from jinja2.environment import Environment, Template, create_cache
+
+from jinja_comprehensions.templatecache import SizedTemplateCache
+
+__all__ = [
+    'RenderError',
+    'RenderResult',
+    'picklable_environment',
+    'render_many',
+]
+
+
+class RenderResult(NamedTuple):
+    #: Position of the context within the contexts passed to `render_many()`
+    index: int
+    #: The rendered (native) value, or None if rendering failed
+    value: Any
+    #: The exception raised while rendering, if any
+    error: BaseException | None = None
+    #: The formatted traceback of the exception, if any
+    traceback: str | None = None
+
+
+class RenderError(Exception):
+    """Stands in for an exception which couldn't be sent back from a worker process
+
+    Also used when a rendered value can't be sent back.
+    """
+
+
+def render_many(
+    template: Template,
+    contexts: Iterable[Mapping[str, Any]],
+    workers: int | None = None,
+    *,
+    source: str | None = None,
+    chunk_size: int = 64,
+    ordered: bool = True,
+    environment_factory: Callable[[], Environment] | None = None,
+    mp_context: Any = None,
+) -> Iterator[RenderResult]:
+    """Render a template against many contexts, in a pool of worker processes
+
+    The template is compiled once, and its code sent to each of `workers` processes
+    (by default, one per CPU) when it starts. Contexts are consumed lazily, and sent
+    to the workers in chunks of `chunk_size`; at most two chunks per worker are in
+    flight at once. Contexts, rendered values, and the template's globals must be
+    picklable.
+
+    A `RenderResult` is yielded per context — in the order of `contexts` if
+    `ordered`, otherwise as soon as its chunk completes. An exception raised while
+    rendering one context is reported in its result, and doesn't affect the others.
+
+    Workers need an environment equivalent to the template's. By default, a copy of
+    the template's environment, without its caches, is pickled (see
+    `picklable_environment()`), which requires its class to be importable, and its
+    filters, tests, globals, finalize function, loader, etc. to be picklable. If
+    they aren't, pass an `environment_factory`: a picklable callable (e.g. a
+    module-level function) creating the environment in each worker.
+
+    The template's source is recompiled into code shipped to workers. It's read
+    from the environment's loader, unless passed as `source` — which is required
+    for templates created with `from_string()`.
+    """
+    environment = template.environment
+    if source is None:
+        source = _get_source(template)
+    code = environment.compile(source, template.name, template.filename)
+
+    template_globals = template.globals
+    if isinstance(template_globals, ChainMap):
+        # The rest are the environment's globals, which workers have of their own
+        template_globals = template_globals.maps[0]
+
+    if environment_factory is None:
+        environment_payload = _dumps(
+            picklable_environment(environment),
+            'the environment can\'t be pickled; pass an environment_factory instead',
+        )
+    else:
+        environment_payload = _dumps(environment_factory, 'environment_factory must be picklable')
+
+    initargs = (
+        environment_factory is not None,
+        environment_payload,
+        marshal.dumps(code),
+        _dumps(type(template), 'the template class must be importable'),
+        _dumps(dict(template_globals), 'the template\'s globals must be picklable'),
+    )
+
+    max_in_flight = 2 * (workers or os.cpu_count() or 1)
+    chunks = _chunked(contexts, chunk_size)
+    pool = ProcessPoolExecutor(workers, mp_context, initializer=_init_worker, initargs=initargs)
+    try:
+        pending: deque[Future[bytes]] = deque()
+        for start, chunk in islice(chunks, max_in_flight):
+            pending.append(pool.submit(_render_chunk, start, chunk))
+
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                done = [future for future in pending if future in completed]
+                for future in done:
+                    pending.remove(future)
+
+            for future in done:
+                yield from pickle.loads(future.result())
+
+            for start, chunk in islice(chunks, len(done)):
+                pending.append(pool.submit(_render_chunk, start, chunk))
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def picklable_environment(environment: Environment) -> Environment:
+    """Return a copy of an environment which may be pickled, e.g. to send it to worker processes
+
+    The copy shares the environment's configuration (filters, tests, globals, etc.),
+    but not its caches of templates, expressions, or security checks, nor its
+    bytecode cache. The environment class must be importable by pickle — which
+    holds for template and code generator classes built by `util.add_template_class`
+    and `util.with_code_generator`, as long as the environment class is.
+    """
+    rv = object.__new__(type(environment))
+    rv.__dict__.update(environment.__dict__)
+    rv.linked_to = None
+    rv.bytecode_cache = None
+    rv.cache = _empty_cache(environment.cache)
+
+    if '_expression_cache' in rv.__dict__:
+        rv._expression_cache = _empty_cache(rv._expression_cache)
+    if '_safe_attributes' in rv.__dict__:
+        rv._safe_attributes = {}
+    if 'parse_tree_cache' in rv.__dict__:
+        rv.parse_tree_cache = None
+
+    rv.extensions = {}
+    for key, value in environment.extensions.items():
+        rv.extensions[key] = value.bind(rv)
+    return rv
+
+
+def _empty_cache(cache: Any) -> Any:
+    if cache is None:
+        return None
+    if isinstance(cache, SizedTemplateCache):
+        rv = cache.copy()
+        rv.clear()
+        return rv
+    return create_cache(getattr(cache, 'capacity', -1))
+
+
+def _get_source(template: Template) -> str:
+    loader = template.environment.loader
+    if loader is None or template.name is None:
+        raise TypeError(
+            'The template\'s source is unknown; pass it through source, '
+            'e.g. render_many(env.from_string(source), contexts, source=source)'
+        )
+    source, _, _ = loader.get_source(template.environment, template.name)
+    return source
+
+
+def _dumps(obj: Any, message: str) -> bytes:
+    try:
+        return pickle.dumps(obj)
+    except Exception as e:
+        raise TypeError(f'Unable to render in worker processes: {message} ({e})') from e
+
+
+def _chunked(
+    contexts: Iterable[Mapping[str, Any]], chunk_size: int
+) -> Iterator[tuple[int, list[Mapping[str, Any]]]]:
+    iterator = iter(contexts)
+    start = 0
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield start, chunk
+        start += len(chunk)
+
+
+###
+# Worker process side
+#
+
+_worker_template: Template | None = None
+
+
+def _init_worker(
+    is_factory: bool,
+    environment_payload: bytes,
+    code_payload: bytes,
+    template_class_payload: bytes,
+    globals_payload: bytes,
+) -> None:
+    global _worker_template
+
+    if is_factory:
+        environment = pickle.loads(environment_payload)()
+    else:
+        environment = pickle.loads(environment_payload)
+
+    template_class = pickle.loads(template_class_payload)
+    template_globals = environment.make_globals(pickle.loads(globals_payload))
+    _worker_template = template_class.from_code(
+        environment, marshal.loads(code_payload), template_globals, None
+    )
+
+
+def _render_chunk(start: int, contexts: list[Mapping[str, Any]]) -> bytes:
+    template = _worker_template
+    assert template is not None, 'worker was not initialized'
+
+    if template.environment.is_async:
+        results = asyncio.run(_render_chunk_async(template, start, contexts))
+    else:
+        results = []
+        for index, context in enumerate(contexts, start):
+            try:
+                value = template.render(context)
+            except Exception as e:
+                results.append(_failure(index, e))
+            else:
+                results.append(RenderResult(index, value))
+
+    try:
+        return pickle.dumps(results)
+    except Exception:
+        return pickle.dumps([_picklable_result(result) for result in results])
+
+
+async def _render_chunk_async(
+    template: Template, start: int, contexts: list[Mapping[str, Any]]
+) -> list[RenderResult]:
+    results = []
+    for index, context in enumerate(contexts, start):
+        try:
+            value = await template.render_async(context)
+        except Exception as e:
+            results.append(_failure(index, e))
+        else:
+            results.append(RenderResult(index, value))
+    return results
+
+
+def _failure(index: int, error: BaseException) -> RenderResult:
+    formatted = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+    try:
+        # Some exceptions pickle fine, but fail to unpickle (e.g. if their
+        # constructors take arguments other than their args)
+        pickle.loads(pickle.dumps(error))
+    except Exception:
+        error = RenderError(f'{type(error).__name__}: {error}')
+    return RenderResult(index, None, error, formatted)
+
+
+def _picklable_result(result: RenderResult) -> RenderResult:
+    try:
+        pickle.dumps(result)
+    except Exception as e:
+        error = RenderError(f'Unable to send back rendered value: {e}')
+        return RenderResult(result.index, None, error, None)
+    return result
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import fnmatch
+import os
+from hashlib import sha1
+from importlib import metadata
+from typing import Iterator
+
+import jinja2
+import jinja2.filters
+import jinja2.tests
+from jinja2.bccache import Bucket, FileSystemBytecodeCache
+
+__all__ = [
+    'ComprehensionBytecodeCache',
+    'get_environment_fingerprint',
+]
+
+try:
+    _PACKAGE_VERSION = metadata.version('jinja-comprehensions')
+except metadata.PackageNotFoundError:
+    _PACKAGE_VERSION = 'unknown'
+
+
+def get_environment_fingerprint(environment: jinja2.Environment, name: str | None = None) -> str:
+    """Return a string identifying everything about an environment which affects codegen
+
+    Two environments with the same fingerprint produce the same compiled code for
+    the same template source. This includes the environment class, the MRO of its
+    code generator class (which may be built dynamically by `util.with_code_generator`),
+    async mode, the optimizer, constant-folding, concurrency, and profiling settings, which
+    of Jinja's stock filters and tests have been replaced, and package versions.
+    """
+    env_class = type(environment)
+    code_generator_mro = [
+        f'{cls.__module__}.{cls.__qualname__}'
+        for cls in environment.code_generator_class.__mro__
+    ]
+
+    autoescape = environment.autoescape
+    if callable(autoescape):
+        autoescape = autoescape(name)
+
+    pure_globals = getattr(environment, 'const_fold_pure_globals', ())
+    foldable_globals = sorted(
+        global_name
+        for global_name, value in environment.globals.items()
+        if _is_member(value, pure_globals)
+    )
+
+    # The optimizer only treats Jinja's own filters and tests as free of side-effects
+    replaced_filters = sorted(
+        filter_name
+        for filter_name, func in jinja2.filters.FILTERS.items()
+        if environment.filters.get(filter_name) is not func
+    )
+    replaced_tests = sorted(
+        test_name
+        for test_name, func in jinja2.tests.TESTS.items()
+        if environment.tests.get(test_name) is not func
+    )
+
+    parts = [
+        f'{env_class.__module__}.{env_class.__qualname__}',
+        ','.join(code_generator_mro),
+        f'async={environment.is_async}',
+        f'optimized={environment.optimized}',
+        f'autoescape={bool(autoescape)}',
+        f'extensions={",".join(sorted(environment.extensions))}',
+        f'fold_limit={getattr(environment, "const_fold_max_iterations", None)}',
+        f'concurrent_comprehensions={getattr(environment, "concurrent_comprehensions", False)}',
+        f'concurrent_await={getattr(environment, "concurrent_await", False)}',
+        f'numpy_comprehensions={getattr(environment, "numpy_comprehensions", False)}',
+        f'hoist_invariant_lookups={getattr(environment, "hoist_invariant_lookups", False)}',
+        f'profiled={getattr(environment, "comprehension_profiler", None) is not None}',
+        f'foldable_globals={",".join(foldable_globals)}',
+        f'replaced_filters={",".join(replaced_filters)}',
+        f'replaced_tests={",".join(replaced_tests)}',
+        f'jinja_comprehensions={_PACKAGE_VERSION}',
+        f'jinja2={jinja2.__version__}',
+    ]
+    return '|'.join(parts)
+
+
+def _is_member(value: object, collection: frozenset) -> bool:
+    try:
+        return value in collection
+    except TypeError:
+        return False
+
+
+class ComprehensionBytecodeCache(FileSystemBytecodeCache):
+    """Filesystem bytecode cache which is safe to share between environment variants
+
+    Jinja's stock bytecode caches key templates by name and filename only, so
+    environments producing different code for the same source (e.g. string vs.
+    native environments, or sync vs. async) would load each other's bytecode.
+    This cache includes `get_environment_fingerprint()` in each key.
+
+    Writes are atomic. If `max_size` is given (in bytes), the least-recently
+    used cache files are evicted whenever the cache grows beyond it.
+
+    >>> bcc = ComprehensionBytecodeCache('/tmp/jinja_cache', max_size=64 * 1024 * 1024)
+    >>> env = NativeComprehensionEnvironment(bytecode_cache=bcc)
+    """
+
+    def __init__(
+        self,
+        directory: str | None = None,
+        pattern: str = '__jinja_comprehensions_%s.cache',
+        max_size: int | None = None,
+    ) -> None:
+        super().__init__(directory, pattern)
+        self.max_size = max_size
+        self._size: int | None = None
+
+    def get_bucket(
+        self,
+        environment: jinja2.Environment,
+        name: str,
+        filename: str | None,
+        source: str,
+    ) -> Bucket:
+        key = self.get_cache_key(name, filename)
+        fingerprint = get_environment_fingerprint(environment, name)
+        key = sha1(f'{key}|{fingerprint}'.encode()).hexdigest()
+
+        checksum = self.get_source_checksum(source)
+        bucket = Bucket(environment, key, checksum)
+        self.load_bytecode(bucket)
+        return bucket
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        super().load_bytecode(bucket)
+
+        if bucket.code is not None and self.max_size is not None:
+            # Mark the file as recently used, for eviction purposes
+            try:
+                os.utime(self._get_cache_filename(bucket))
+            except OSError:
+                pass
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        # An existing file of the same name (e.g. for outdated source) is replaced
+        # by Jinja's atomic write
+        name = self._get_cache_filename(bucket)
+        replaced_size = _file_size(name)
+        super().dump_bytecode(bucket)
+
+        if self.max_size is not None:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._iter_cache_files())
+            else:
+                self._size += _file_size(name) - replaced_size
+
+            if self._size > self.max_size:
+                self.evict()
+
+    def evict(self) -> None:
+        """Remove least-recently used cache files until the cache fits within max_size"""
+        files = sorted(self._iter_cache_files(), key=lambda file: file[2])
+        size = sum(size for _, size, _ in files)
+        for path, file_size, _ in files:
+            if self.max_size is None or size <= self.max_size:
+                break
+            if _remove_silent(path):
+                size -= file_size
+        self._size = size
+
+    def clear(self) -> None:
+        super().clear()
+        self._size = None
+
+    def _iter_cache_files(self) -> Iterator[tuple[str, int, float]]:
+        pattern = self.pattern % ('*',)
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+
+        for entry in entries:
+            if not fnmatch.fnmatch(entry.name, pattern) or entry.name.endswith('.tmp'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            yield entry.path, stat.st_size, stat.st_mtime
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _remove_silent(path: str) -> bool:
+    try:
+        os.remove(path)
+    except OSError:
+        # Another process may have removed it, or be holding it open (on Windows)
+        return False
+    return True
@@ -1,11 +1,19 @@
 from __future__ import annotations
 
-from typing import Callable
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from io import StringIO
+from time import perf_counter
+from typing import Any, Callable, Iterable, Iterator
 
-from jinja2.compiler import CodeGenerator, Frame, operators
-from jinja2.nodes import Template, Operand
+from jinja2 import nodes as jinja_nodes
+from jinja2.compiler import CodeGenerator, Frame, has_safe_repr, operators, optimizeconst
+from jinja2.nodes import EvalContext, get_eval_context
+from jinja2.nodes import Compare, Impossible, Template, Operand
+from jinja2.optimizer import Optimizer
+from jinja2.runtime import async_exported, exported
 
-from jinja_comprehensions import nodes
+from jinja_comprehensions import nodes, optimizer
 
 __all__ = [
     'AsyncOperandsCodeGenerator',
@@ -16,11 +24,35 @@ __all__ = [
 class AsyncOperandsCodeGenerator(CodeGenerator):
     def visit_Template(self, node: Template, frame: Frame | None = None) -> None:
         if self.environment.is_async:
-            self.writeline('from jinja_comprehensions.runtime import syncify_awaitable')
+            self.writeline('from jinja_comprehensions.runtime import async_contains, syncify_awaitable')
         super().visit_Template(node, frame)
 
+    @optimizeconst
+    def visit_Compare(self, node: Compare, frame: Frame) -> None:
+        # A lone membership test is handed to async_contains, which can stop
+        # consuming an async iterable as soon as a match is found. Membership
+        # tests within chained comparisons fall back to visit_Operand.
+        if (
+            self.environment.is_async
+            and len(node.ops) == 1
+            and node.ops[0].op in ('in', 'notin')
+            and not _is_literal_container(node.ops[0].expr)
+        ):
+            operand = node.ops[0]
+            self.write('(await async_contains(' if operand.op == 'in' else '(not await async_contains(')
+            self.visit(node.expr, frame)
+            self.write(', ')
+            self.visit(operand.expr, frame)
+            self.write('))')
+        else:
+            super().visit_Compare(node, frame)
+
     def visit_Operand(self, node: Operand, frame: Frame) -> None:
-        if self.environment.is_async and node.op == 'in':
+        if (
+            self.environment.is_async
+            and node.op in ('in', 'notin')
+            and not _is_literal_container(node.expr)
+        ):
             self.write(f' {operators[node.op]} ')
             self.write('(await syncify_awaitable(')
             self.visit(node.expr, frame)
@@ -30,7 +62,101 @@ class AsyncOperandsCodeGenerator(CodeGenerator):
 
 
 class ComprehensionCodeGenerator(CodeGenerator):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._hoist_scopes: list[_HoistScope] = []
+        self._profile_sites: list[tuple[str, str]] = []
+        #: The comprehension iterable being visited, if any
+        self._iterable: jinja_nodes.Node | None = None
+        #: Names of `runtime` helpers used by the generated code
+        self._runtime_names: set[str] = set()
+        if self.optimizer is not None:
+            self.optimizer = _GuardingOptimizer(self.environment)
+
+    def visit_Template(self, node: Template, frame: Frame | None = None) -> None:
+        self.assigned_names = _find_assigned_names(node)
+        if self.optimizer is not None:
+            node = self._optimize(node)
+        super().visit_Template(node, frame)
+        self._write_profile_sites()
+        self._write_runtime_imports()
+
+    def generate_expression(self, node: jinja_nodes.Expr) -> None:
+        """Generate a module defining `expression(context)`, which returns node's value
+
+        Unlike a template's root render function, the expression function is a plain
+        (or, in async environments, a coroutine) function returning its value
+        directly — no generator, output, or concat is involved.
+        """
+        if self.environment.is_async:
+            exported_names = sorted(exported + async_exported)
+        else:
+            exported_names = sorted(exported)
+        self.writeline('from jinja2.runtime import ' + ', '.join(exported_names))
+        if self.environment.is_async:
+            self.writeline('from jinja_comprehensions.runtime import async_contains, syncify_awaitable')
+
+        envenv = '' if self.defer_init else ', environment=environment'
+        self.writeline(f'{self.func("expression")}(context, missing=missing{envenv}):', extra=1)
+        self.indent()
+        self.writeline('resolve = context.resolve_or_missing')
+        self.writeline('undefined = environment.undefined')
+        self.writeline('cond_expr_undefined = Undefined')
+
+        self.assigned_names = _find_assigned_names(node)
+        if self.optimizer is not None:
+            node = self._optimize(node)
+        frame = Frame(EvalContext(self.environment, self.name))
+        frame.symbols.analyze_node(Template([jinja_nodes.Output([node])]))
+        frame.toplevel = frame.rootlevel = True
+        self.enter_frame(frame)
+        self.pull_dependencies([node])
+
+        if self.environment.is_async:
+            self.writeline('return await syncify_awaitable(')
+            self.visit(node, frame)
+            self.write(')')
+        else:
+            self.writeline('return ')
+            self.visit(node, frame)
+        self.outdent()
+        self._write_profile_sites()
+        self._write_runtime_imports()
+
+    def _optimize(self, node: jinja_nodes.Node) -> Any:
+        profiler = getattr(self.environment, 'compile_profiler', None)
+        if profiler is None:
+            return optimizer.optimize(node, self.environment, self.assigned_names)
+
+        start = perf_counter()
+        try:
+            return optimizer.optimize(node, self.environment, self.assigned_names)
+        finally:
+            profiler.add('optimize', perf_counter() - start)
+
+    def enter_frame(self, frame: Frame) -> None:
+        # Expose the template's assigned names to constant-folding, so calls to
+        # pure globals which are shadowed by the template are left alone.
+        frame.eval_ctx.assigned_names = self.assigned_names
+        super().enter_frame(frame)
+
+    def visit_Tuple(self, node: nodes.Tuple, frame: Frame) -> None:
+        if self._has_async_spreads(node):
+            self._async_spreads(node, frame, "spread_scalars", "tuple, ")
+        else:
+            super().visit_Tuple(node, frame)
+
+    def visit_List(self, node: nodes.List, frame: Frame) -> None:
+        if self._has_async_spreads(node):
+            self._async_spreads(node, frame, "spread_scalars", "list, ")
+        else:
+            super().visit_List(node, frame)
+
     def visit_Set(self, node: nodes.Set, frame: Frame) -> None:
+        if self._has_async_spreads(node):
+            self._async_spreads(node, frame, "spread_scalars", "set, ")
+            return
+
         self.write("{")
         for idx, item in enumerate(node.items):
             if idx:
@@ -39,10 +165,17 @@ class ComprehensionCodeGenerator(CodeGenerator):
         self.write(",}")
 
     def visit_SpreadScalars(self, node: nodes.SpreadScalars, frame: Frame) -> None:
-        self.write("*")
+        site = self._profile_site(node, 'spread', 1)
+        self.write("*" if site is None else f"*{site}.spread(")
         self.visit(node.node, frame)
+        if site is not None:
+            self.write(")")
 
     def visit_Dict(self, node: nodes.Dict, frame: Frame) -> None:
+        if self._has_async_spreads(node):
+            self._async_spreads(node, frame, "spread_pairs")
+            return
+
         self.write("{")
         for idx, item in enumerate(node.items):
             if idx:
@@ -56,29 +189,173 @@ class ComprehensionCodeGenerator(CodeGenerator):
         self.write("}")
 
     def visit_SpreadPairs(self, node: nodes.SpreadPairs, frame: Frame) -> None:
-        self.write("**")
+        site = self._profile_site(node, 'spread-pairs', 1)
+        self.write("**" if site is None else f"**{site}.spread_pairs(")
         self.visit(node.node, frame)
+        if site is not None:
+            self.write(")")
 
     def visit_Generator(self, node: nodes.Generator, frame: Frame) -> None:
+        if self.optimizer is not None and not frame.eval_ctx.volatile:
+            # Generators can't be stored as literals, but their elements can
+            with self.optimizer.guarding(frame.eval_ctx) as guards:
+                try:
+                    items = tuple(node.iter_const(frame.eval_ctx))
+                except Impossible:
+                    items = None
+            if items is not None and has_safe_repr(items):
+                if not guards:
+                    self.write(f"iter({items!r})")
+                    return
+                self.write(f"(iter({items!r}) if ")
+                self._write_guards(guards, frame)
+                self.write(" else ")
+                with self._unfolded():
+                    self._scalar_comprehension(node, frame, "(", ")")
+                self.write(")")
+                return
+
         self._scalar_comprehension(node, frame, "(", ")")
 
+    @optimizeconst
     def visit_ListComprehension(self, node: nodes.ListComprehension, frame: Frame) -> None:
-        self._scalar_comprehension(node, frame, "[", "]")
+        if self._is_concurrent(node):
+            gather = self._runtime("gather_elements")
+            self._scalar_comprehension(node, frame, f"(await {gather}([", f"], {_LIMIT}))")
+        elif not self._vectorized(node, frame, "list", self._scalar_comprehension, "[", "]"):
+            self._scalar_comprehension(node, frame, "[", "]")
 
+    @optimizeconst
     def visit_SetComprehension(self, node: nodes.SetComprehension, frame: Frame) -> None:
-        self._scalar_comprehension(node, frame, "{", "}")
+        if self._is_concurrent(node):
+            gather = self._runtime("gather_elements")
+            self._scalar_comprehension(node, frame, f"set(await {gather}([", f"], {_LIMIT}))")
+        elif not self._vectorized(node, frame, "set", self._scalar_comprehension, "{", "}"):
+            self._scalar_comprehension(node, frame, "{", "}")
 
+    @optimizeconst
     def visit_DictComprehension(self, node: nodes.DictComprehension, frame: Frame) -> None:
-        self.write("{")
+        if not self._vectorized(node, frame, "dict", self._dict_comprehension):
+            self._dict_comprehension(node, frame)
+
+    def _dict_comprehension(
+        self, node: nodes.DictComprehension, frame: Frame, first_iter: str | None = None
+    ) -> None:
+        concurrent = self._is_concurrent(node)
+        site = self._profile_site(node, 'dict', len(node.for_components))
+        if site is not None:
+            self.write(f"{site}.finish({site}.start(), ")
+        self.write(f"dict(await {self._runtime('gather_elements')}([" if concurrent else "{")
 
         def write_expr(expr_frame: Frame):
+            if concurrent:
+                self.write("(")
             self.visit(node.pair.key, expr_frame)
-            self.write(": ")
+            self.write(", " if concurrent else ": ")
             self.visit(node.pair.value, expr_frame)
+            if concurrent:
+                self.write(")")
 
-        self._comprehension_common(node, frame, write_expr)
+        self._comprehension_common(
+            node, frame, write_expr, concurrent=concurrent, site=site, first_iter=first_iter
+        )
 
-        self.write("}")
+        self.write(f"], {_LIMIT}))" if concurrent else "}")
+        if site is not None:
+            self.write(")")
+
+    def _vectorized(
+        self,
+        node: nodes.ListComprehension | nodes.SetComprehension | nodes.DictComprehension,
+        frame: Frame,
+        factory: str,
+        write_loop: Callable[..., None],
+        *loop_args: Any,
+    ) -> bool:
+        """Write a comprehension which is evaluated with NumPy array operations, if possible
+
+        In environments with `numpy_comprehensions` enabled, a comprehension with a
+        single for-clause binding a single name, whose element (and condition) only
+        apply arithmetic, comparison, and boolean operators to it, is handed to
+        `runtime.vectorize_comprehension` along with its iterable. If the iterable
+        turns out not to be a 1-D numeric array (or the variables used alongside the
+        target aren't numeric scalars), the loop written by write_loop is used on the
+        already-evaluated iterable, instead. Returns whether anything was written.
+        """
+        if not getattr(self.environment, 'numpy_comprehensions', False):
+            return False
+        if getattr(self.environment, 'comprehension_profiler', None) is not None:
+            return False  # Stats are per element
+        if self.environment.sandboxed and (
+            self.environment.intercepted_binops or self.environment.intercepted_unops
+        ):
+            return False
+        if len(node.for_components) != 1:
+            return False
+
+        component = node.for_components[0]
+        if not isinstance(component.target, jinja_nodes.Name):
+            return False
+
+        vectorizer = _Vectorizer(component.target.name, self.temporary_identifier)
+        if isinstance(node, nodes.DictComprehension):
+            key = vectorizer.translate(node.pair.key)
+            value = vectorizer.translate(node.pair.value)
+            element = None if key is None or value is None else f'({key}, {value})'
+        else:
+            element = vectorizer.translate(node.expr)
+        cond = None
+        if component.cond is not None:
+            cond = vectorizer.translate(component.cond, truth=True)
+            if cond is None:
+                return False
+        if element is None:
+            return False
+
+        variables = [
+            self._capture(lambda: self.visit(jinja_nodes.Name(name, 'load'), frame))
+            for name in vectorizer.params
+        ]
+        element_func = vectorizer.function(element)
+        cond_func = 'None' if cond is None else vectorizer.function(cond)
+        iter_code = self._capture(lambda: self._visit_iterable(component.iter, frame))
+
+        # The iterable is bound through a single-iteration comprehension, as
+        # assignment expressions can't be used within comprehension iterables.
+        # In async environments, it's an async comprehension, which (before Python
+        # 3.11) is required for the async loop to be nested within it.
+        iterable = self.temporary_identifier()
+        result = self.temporary_identifier()
+        self.write(f"[{result} if {result} is not None else ")
+        write_loop(node, frame, *loop_args, first_iter=iterable)
+        if self.environment.is_async:
+            chunk = self.temporary_identifier()
+            achunks = self._runtime('auto_achunks')
+            self.write(f" async for {chunk} in {achunks}(({iter_code},)) for {iterable} in {chunk}")
+        else:
+            self.write(f" for {iterable} in ({iter_code},)")
+        self.write(
+            f" for {result} in ({self._runtime('vectorize_comprehension')}({factory}, {iterable},"
+            f" ({''.join(f'{code}, ' for code in variables)}), {element_func}, {cond_func}),)][0]"
+        )
+        return True
+
+    def _is_concurrent(self, node: nodes._BaseComprehension) -> bool:
+        """Whether the elements of a list/set/dict comprehension are to be evaluated concurrently
+
+        This is the case in async environments with `concurrent_comprehensions`
+        enabled, for elements which call functions or filters — i.e. which may
+        await something worth overlapping.
+        """
+        if not self.environment.is_async:
+            return False
+        if not getattr(self.environment, 'concurrent_comprehensions', False):
+            return False
+        element = node.pair if isinstance(node, nodes.DictComprehension) else node.expr
+        return (
+            isinstance(element, _CONCURRENT_NODES)
+            or element.find(_CONCURRENT_NODES) is not None
+        )
 
     def _scalar_comprehension(
         self,
@@ -86,22 +363,50 @@ class ComprehensionCodeGenerator(CodeGenerator):
         frame: Frame,
         prefix: str,
         suffix: str,
+        first_iter: str | None = None,
     ) -> None:
+        site = self._profile_site(node, _PROFILE_KINDS[type(node)], len(node.for_components))
+        if site is None:
+            pass
+        elif isinstance(node, nodes.Generator):
+            self.write(f"{site}.generator(")
+        else:
+            self.write(f"{site}.finish({site}.start(), ")
         self.write(prefix)
 
         def write_expr(expr_frame: Frame):
             self.visit(node.expr, expr_frame)
 
-        self._comprehension_common(node, frame, write_expr)
+        concurrent = not isinstance(node, nodes.Generator) and self._is_concurrent(node)
+        self._comprehension_common(
+            node, frame, write_expr, concurrent=concurrent, site=site, first_iter=first_iter
+        )
 
         self.write(suffix)
+        if site is not None:
+            self.write(")")
 
     def _comprehension_common(
         self,
         node: nodes.Generator | nodes.ListComprehension | nodes.DictComprehension,
         outer_frame: Frame,
         write_expr: Callable[[Frame], None],
+        concurrent: bool = False,
+        site: str | None = None,
+        first_iter: str | None = None,
     ) -> None:
+        """Write the element expression and for-clauses of a comprehension
+
+        If concurrent, each element is instead written as a not-yet-started async
+        generator expression yielding the element, for `runtime.gather_elements`
+        to evaluate. The generator's sole (eagerly evaluated) iterable rebinds the
+        comprehension's targets and hoisted values, so each element sees those of
+        its own iteration, rather than the last.
+
+        If site names a `profiling.ComprehensionSite`, each clause's elements and
+        rejections are counted through it. If first_iter is given, it's the code of
+        the first clause's iterable, which has been evaluated already.
+        """
         frames = []
         iter_frame = outer_frame
         for i in range(len(node.for_components)):
@@ -109,17 +414,814 @@ class ComprehensionCodeGenerator(CodeGenerator):
             frames.insert(0, (iter_frame, loop_frame))
             iter_frame = loop_frame
 
-        expr_frame = frames[0][1]
-        write_expr(expr_frame)
+        # Every part of the comprehension is generated up-front, so we learn of
+        # any hoisted expressions before writing out the clauses.
+        scope = _HoistScope(
+            [nodes.target_names(component.target) for component in node.for_components],
+            pure=not optimizer.may_have_side_effects(node, self.environment),
+        )
+        self._hoist_scopes.append(scope)
+        try:
+            expr_frame = frames[0][1]
+            scope.max_level = len(node.for_components) - 1
+            expr_code = self._capture(lambda: write_expr(expr_frame))
+
+            clauses = []
+            for idx, (component, (iter_frame, loop_frame)) in enumerate(
+                zip(node.for_components, frames)
+            ):
+                # An iterable is evaluated once per iteration of the enclosing clause,
+                # and a condition once per iteration of its own clause.
+                scope.max_level = idx - 1
+                if idx == 0 and first_iter is not None:
+                    iter_code = first_iter
+                else:
+                    iter_code = self._capture(lambda: self._visit_iterable(component.iter, iter_frame))
+                target_code = self._capture(lambda: self.visit(component.target, loop_frame))
+                cond_code = None
+                if component.cond:
+                    scope.max_level = idx
+                    cond_code = self._capture(lambda: self.visit(component.cond, loop_frame))
+                    if idx and scope.pure and self.optimizer is not None:
+                        iter_code = self._hash_join(node, idx, loop_frame, iter_code) or iter_code
+                clauses.append([target_code, iter_code, cond_code])
+        finally:
+            self._hoist_scopes.pop()
+
+        if concurrent:
+            bindings = [target_code for target_code, _, _ in clauses]
+            bindings.extend(name for entries in scope.entries for name, _ in entries)
+            bound = ", ".join(bindings)
+            expr_code = f"({expr_code} for ({bound},) in (({bound},),))"
+
+        self.write(expr_code)
+
+        if scope.entries[0]:
+            # Expressions hoisted out of every clause are bound alongside the first
+            # iterable (which is always evaluated eagerly, in the enclosing scope),
+            # through a single-iteration leading clause.
+            first_iter = self.temporary_identifier()
+            names = ", ".join(name for name, _ in scope.entries[0])
+            values = ", ".join(code for _, code in scope.entries[0])
+            self.write(f" for ({names}, {first_iter}) in (({values}, {clauses[0][1]}),)")
+            clauses[0][1] = first_iter
+
+        for idx, (component, (target_code, iter_code, cond_code)) in enumerate(
+            zip(node.for_components, clauses)
+        ):
+            if idx and scope.entries[idx]:
+                names = ", ".join(name for name, _ in scope.entries[idx])
+                values = ", ".join(code for _, code in scope.entries[idx])
+                self.write(f" for ({names},) in (({values},),)")
+
+            # List and tuple literals are always sync iterables
+            if self.environment.is_async and not isinstance(component.iter, _SEQUENCE_LITERALS):
+                # Rather than stepping through every element asynchronously, sync
+                # iterables are handed over in one chunk, to a plain for-loop.
+                chunk = self.temporary_identifier()
+                self.write(f" async for {chunk} in {self._runtime('auto_achunks')}({iter_code})")
+                iter_code = chunk
+
+            if site is not None:
+                iter_code = f"{site}.iterate({idx}, {iter_code})"
+            self.write(f" for {target_code} in {iter_code}")
+
+            if cond_code is not None:
+                if site is not None:
+                    cond_code = f"{site}.test({idx}, {cond_code})"
+                self.write(f" if {cond_code}")
+
+    def _has_async_spreads(self, node: nodes.Tuple | nodes.List | nodes.Set | nodes.Dict) -> bool:
+        return self.environment.is_async and any(
+            isinstance(item, (nodes.SpreadScalars, nodes.SpreadPairs)) for item in node.items
+        )
+
+    def _async_spreads(
+        self,
+        node: nodes.Tuple | nodes.List | nodes.Set | nodes.Dict,
+        frame: Frame,
+        helper: str,
+        args: str = "",
+    ) -> None:
+        """Write a literal with spreads as a call to `runtime.spread_scalars` or `runtime.spread_pairs`
+
+        Plain `*x` / `**x` can't spread awaitables or async iterables, and resolving
+        each by hand would await them one after the other. Instead, the literal's
+        items (and spread operands) are evaluated in order, then handed to the
+        runtime, which resolves all async operands concurrently before building the
+        literal — keeping the order of its elements, and which keys override which.
+        Spread calls and filters aren't awaited as they're evaluated, so that their
+        results may be resolved concurrently, too.
+        """
+        spreads = []
+        wrappers = []
+        self.write(f"(await {self._runtime(helper)}({args}(")
+        for idx, item in enumerate(node.items):
+            if isinstance(item, (nodes.SpreadScalars, nodes.SpreadPairs)):
+                spreads.append(idx)
+                if isinstance(item, nodes.SpreadScalars):
+                    site = self._profile_site(item, 'spread', 1)
+                    wrapper = f"{site}.spread"
+                else:
+                    site = self._profile_site(item, 'spread-pairs', 1)
+                    wrapper = f"{site}.spread_pairs"
+                if site is not None:
+                    wrappers.append(wrapper)
+
+                # Calls and filters would otherwise await their results one by
+                # one, as they're evaluated. Their awaitables are instead passed
+                # on as-is, to be awaited alongside the others.
+                operand = self._capture(lambda: self.visit(item.node, frame))
+                prefix, suffix = _AUTO_AWAIT
+                if (
+                    isinstance(item.node, _CONCURRENT_NODES)
+                    and operand.startswith(prefix)
+                    and operand.endswith(suffix)
+                ):
+                    operand = operand[len(prefix):-len(suffix)]
+                self.write(operand)
+            elif isinstance(node, nodes.Dict):
+                self.write("(")
+                self.visit(item.key, frame)
+                self.write(", ")
+                self.visit(item.value, frame)
+                self.write(")")
+            else:
+                self.visit(item, frame)
+            self.write(", ")
+        self.write(f"), {tuple(spreads)!r}")
+        if wrappers:
+            self.write(f", ({', '.join(wrappers)},)")
+        self.write("))")
+
+    def _profile_site(self, node: jinja_nodes.Node, kind: str, clauses: int) -> str | None:
+        """Return the name of the `profiling.ComprehensionSite` node is to report to, if profiling
+
+        Sites are bound at the end of the module, by `_write_profile_sites()`.
+        """
+        if getattr(self.environment, 'comprehension_profiler', None) is None or self.defer_init:
+            return None
+        name = self.temporary_identifier()
+        ordinal = len(self._profile_sites)
+        self._profile_sites.append(
+            (name, f'site({self.name!r}, {node.lineno!r}, {kind!r}, {ordinal}, {clauses})')
+        )
+        return name
+
+    def _runtime(self, name: str) -> str:
+        """Return the name of a `runtime` helper for the generated code to use
+
+        Helpers are imported at the end of the module, by `_write_runtime_imports()`,
+        so only those used are imported. The module is always run in full before
+        any of its functions are called.
+        """
+        self._runtime_names.add(name)
+        return name
+
+    def _write_runtime_imports(self) -> None:
+        if self._runtime_names:
+            names = ', '.join(sorted(self._runtime_names))
+            self.writeline(f'from jinja_comprehensions.runtime import {names}')
+
+    def _write_profile_sites(self) -> None:
+        for name, call in self._profile_sites:
+            self.writeline(f'{name} = environment.comprehension_profiler.{call}')
+
+    def _hash_join(
+        self,
+        node: nodes._BaseComprehension,
+        idx: int,
+        loop_frame: Frame,
+        iter_code: str,
+    ) -> str | None:
+        """Return code iterating over only the elements of the idx-th iterable its equality condition may match
+
+        Applies to clauses like `for c in customers if o.customer_id == c.id`, whose
+        condition requires (among others) a key of the clause's own target to equal
+        a key of outer targets, and whose iterable doesn't depend on outer targets.
+        The iterable is indexed by key once per comprehension evaluation, through a
+        `runtime.HashJoin`. None is returned if the clause isn't suited to this.
+        """
+        component = node.for_components[idx]
+        level_targets = [nodes.target_names(c.target) for c in node.for_components]
+        inner_names = level_targets[idx]
+        outer_names = set().union(*level_targets[:idx])
+        other_names = set().union(*level_targets[idx + 1:])
+        if inner_names & (outer_names | other_names):
+            return None
+        if _referenced_names(component.iter) & (outer_names | inner_names | other_names):
+            return None
+
+        for inner_key, outer_key in _equality_keys(component.cond):
+            inner_refs = _referenced_names(inner_key)
+            outer_refs = _referenced_names(outer_key)
+            if (
+                inner_refs & inner_names
+                and not inner_refs & (outer_names | other_names)
+                and not outer_refs & (inner_names | other_names)
+            ):
+                break
+        else:
+            return None
+
+        # Keys are evaluated within lambdas, which may not refer to values hoisted
+        # into the comprehension
+        scopes, self._hoist_scopes = self._hoist_scopes, []
+        try:
+            target_code = self._capture(lambda: self.visit(component.target, loop_frame))
+            inner_code = self._capture(lambda: self._write_join_key(inner_key, loop_frame))
+            outer_code = self._capture(lambda: self._write_join_key(outer_key, loop_frame))
+        finally:
+            self._hoist_scopes = scopes
+
+        if isinstance(component.target, jinja_nodes.Name):
+            key_func = f'lambda {target_code}: {inner_code}'
+        else:
+            item = self.temporary_identifier()
+            key_func = f'lambda {item}: next({inner_code} for {target_code} in ({item},))'
+
+        join = self.temporary_identifier()
+        scopes[-1].entries[0].append((join, f'{self._runtime("HashJoin")}({key_func})'))
+        return f'{join}.lookup({iter_code}, lambda: {outer_code})'
+
+    def _write_join_key(self, node: jinja_nodes.Expr, frame: Frame) -> None:
+        """Write a hash join key, without awaiting attributes or items, even in async environments
+
+        Lambdas can't await, so awaitable keys are instead left to `HashJoin`, which
+        falls back to a nested loop upon encountering them.
+        """
+        if isinstance(node, jinja_nodes.Getattr):
+            self.write('environment.getattr(')
+            self._write_join_key(node.node, frame)
+            self.write(f', {node.attr!r})')
+        elif isinstance(node, jinja_nodes.Getitem):
+            self.write('environment.getitem(')
+            self._write_join_key(node.node, frame)
+            self.write(', ')
+            self._write_join_key(node.arg, frame)
+            self.write(')')
+        elif isinstance(node, (jinja_nodes.Tuple, nodes.Tuple)):
+            self.write('(')
+            for item in node.items:
+                self._write_join_key(item, frame)
+                self.write(', ')
+            self.write(')')
+        else:
+            self.visit(node, frame)
+
+    def _capture(self, func: Callable[[], None]) -> str:
+        """Return the code written by func, rather than writing it to the stream"""
+        stream = self.stream
+        self.stream = StringIO()
+        try:
+            func()
+            return self.stream.getvalue()
+        finally:
+            self.stream = stream
+
+    def visit(self, node: jinja_nodes.Node, *args: Any, **kwargs: Any) -> Any:
+        if (
+            args
+            and self._hoist_scopes
+            and self.optimizer is not None
+            and isinstance(node, _HOISTABLE_NODES)
+        ):
+            frame = args[0]
+            if isinstance(node, nodes.HashedContainer) and node.literal_values() is not None:
+                if self._write_literal_container(node):
+                    return None
+            elif self._write_invariant(node, frame):
+                return None
+        return super().visit(node, *args, **kwargs)
+
+    def visit_HashedContainer(self, node: nodes.HashedContainer, frame: Frame) -> None:
+        # Only reached if the container isn't loop-invariant
+        self.visit(node.node, frame)
+
+    def visit_GuardedConst(self, node: nodes.GuardedConst, frame: Frame) -> None:
+        if not self.optimizer.fold_pure_calls:
+            # Within the unfolded expression of an enclosing GuardedConst
+            self.visit(node.node, frame)
+            return
+
+        self.write("(")
+        self.visit(node.const, frame)
+        self.write(" if ")
+        self._write_guards(node.names, frame)
+        self.write(" else ")
+        with self._unfolded():
+            self.visit(node.node, frame)
+        self.write(")")
+
+    def _write_guards(self, names: Iterable[str], frame: Frame) -> None:
+        """Write a test of whether each name still resolves to the environment's global"""
+        for idx, name in enumerate(sorted(names)):
+            if idx:
+                self.write(" and ")
+            self.write("(")
+            self.visit(jinja_nodes.Name(name, "load"), frame)
+            self.write(f" is environment.globals.get({name!r}))")
+
+    @contextmanager
+    def _unfolded(self) -> Iterator[None]:
+        """Write expressions without folding calls to pure globals, within the block"""
+        self.optimizer.fold_pure_calls = False
+        try:
+            yield
+        finally:
+            self.optimizer.fold_pure_calls = True
+
+    def visit_SinglePassArgument(self, node: nodes.SinglePassArgument, frame: Frame) -> None:
+        self.write(f'{self._runtime("single_pass_argument")}(')
+        self.visit(node.callee, frame)
+        self.write(f', {node.callee.name!r}, ')
+        self.visit(node.node, frame)
+        self.write(')')
+
+    def _write_invariant(self, node: jinja_nodes.Expr, frame: Frame) -> bool:
+        """Write node as a loop-invariant value, if it is one
+
+        The value is memoized in an `Invariant`, created at the outermost level
+        of the outermost comprehension it's independent of.
+        """
+        try:
+            node.as_const(frame.eval_ctx)
+        except Exception:
+            pass
+        else:
+            return False  # Constants are written as literals
+
+        if optimizer.may_have_side_effects(node, self.environment):
+            return False
+        # Attributes and items may be computed on each access (e.g. properties)
+        if not getattr(self.environment, 'hoist_invariant_lookups', False) and _has_lookups(node):
+            return False
+
+        # A hoisted value is shared by every element, so it mustn't be (or hold) a
+        # fresh mutable object which may become part of an element. Membership
+        # containers never do, nor do iterables — though the items they yield may.
+        # One-shot iterables (like those of `select` or `reverse`) would be
+        # exhausted by their first use, so iterables are collected into a list.
+        iterated = node is self._iterable
+        if isinstance(node, nodes.HashedContainer):
+            pass
+        elif not (_items_shareable(node) if iterated else _is_shareable(node)):
+            return False
+        iterated = iterated or isinstance(node, nodes.HashedContainer)
+
+        placement = self._find_placement(_referenced_names(node))
+        if placement is None:
+            return False
+
+        scope, level = placement
+        memo = self.temporary_identifier()
+        scope.entries[level].append((memo, f'{self._runtime("Invariant")}()'))
+
+        # Parts of the value are never hoisted on their own
+        scopes, self._hoist_scopes = self._hoist_scopes, []
+        try:
+            wrappers = []
+            if isinstance(node, nodes.HashedContainer):
+                wrappers.append(self._runtime('hashed_container'))
+                node = node.node
+            if iterated and self.environment.is_async:
+                # Async filters return async generators, which are collected, too
+                wrappers.append(f'await {self._runtime("materialize_async")}')
+            elif iterated and not wrappers:
+                # hashed_container() collects one-shot iterators itself
+                wrappers.append(self._runtime('materialize'))
+
+            self.write(f'({memo}.value if {memo}.ready else {memo}.set(')
+            self.write(''.join(f'{wrapper}(' for wrapper in wrappers))
+            super().visit(node, frame)
+            self.write(')' * len(wrappers) + '))')
+        finally:
+            self._hoist_scopes = scopes
+        return True
+
+    def _visit_iterable(self, node: jinja_nodes.Expr, frame: Frame) -> None:
+        """Visit a comprehension's iterable, which may be hoisted even if it's a one-shot iterator"""
+        iterable, self._iterable = self._iterable, node
+        try:
+            self.visit(node, frame)
+        finally:
+            self._iterable = iterable
+
+    def _write_literal_container(self, node: nodes.HashedContainer) -> bool:
+        """Write a literal membership container as a set, built once"""
+        values = node.literal_values()
+        if values is None or not has_safe_repr(values):
+            return False
+
+        placement = self._find_placement(set(), ignore_side_effects=True)
+        if placement is None:
+            return False
+
+        scope, level = placement
+        name = self.temporary_identifier()
+        scope.entries[level].append((name, f'{self._runtime("HashedMembership")}({values!r})'))
+        self.write(name)
+        return True
+
+    def _find_placement(
+        self, names: set[str], ignore_side_effects: bool = False
+    ) -> tuple[_HoistScope, int] | None:
+        """Return the outermost (comprehension scope, level) at which a value using names may be hoisted
+
+        Level k places the value just before the comprehension's k-th for-clause.
+        None is returned if hoisting would gain nothing.
+        """
+        placement = None
+        for scope in reversed(self._hoist_scopes):
+            if not scope.pure and not ignore_side_effects:
+                break
+
+            level = scope.level_for(names)
+            if level <= scope.max_level:
+                placement = scope, level
+            if level > 0:
+                break
+        return placement
+
+    def _hoist(self, code: str) -> str:
+        """Evaluate code once per innermost comprehension, returning the name it's bound to"""
+        name = self.temporary_identifier()
+        self._hoist_scopes[-1].entries[0].append((name, code))
+        return name
+
+
+#: Nodes which are worth evaluating only once, if they're loop-invariant
+_HOISTABLE_NODES = (
+    jinja_nodes.Getattr,
+    jinja_nodes.Getitem,
+    jinja_nodes.Filter,
+    jinja_nodes.Test,
+    jinja_nodes.Concat,
+    jinja_nodes.List,
+    jinja_nodes.Tuple,
+    jinja_nodes.Dict,
+    nodes.List,
+    nodes.Tuple,
+    nodes.Set,
+    nodes.Dict,
+    nodes.ListComprehension,
+    nodes.SetComprehension,
+    nodes.DictComprehension,
+    nodes.HashedContainer,
+)
+
+#: Stock filters returning strings, numbers, or bools
+_SCALAR_FILTERS = frozenset({
+    'abs', 'capitalize', 'center', 'count', 'e', 'escape', 'filesizeformat', 'float',
+    'forceescape', 'format', 'indent', 'int', 'join', 'length', 'lower', 'pprint', 'replace',
+    'round', 'safe', 'string', 'striptags', 'title', 'tojson', 'trim', 'truncate', 'upper',
+    'urlencode', 'urlize', 'wordcount', 'wordwrap', 'xmlattr',
+})
+
+#: Stock filters returning an element (or attribute) of their input
+_ELEMENT_FILTERS = frozenset({'attr', 'first', 'last', 'max', 'min'})
+
+#: Stock filters whose results yield the elements of their input (or, for
+#: `dictsort` and `items`, tuples of its keys and values)
+_ITEM_FILTERS = frozenset({
+    'dictsort', 'items', 'list', 'reject', 'rejectattr', 'reverse', 'select', 'selectattr',
+    'sort', 'unique',
+})
+
+#: Stock filters which look up attributes or items of their input's elements
+#: (along with any given an `attribute` argument, like `map` or `sort`)
+_LOOKUP_FILTERS = frozenset({'attr', 'rejectattr', 'selectattr'})
+
+#: Nodes whose presence in an element expression makes it worth evaluating concurrently
+_CONCURRENT_NODES = (jinja_nodes.Call, jinja_nodes.Filter)
+
+#: Names of comprehension kinds, as reported by the profiler
+_PROFILE_KINDS = {
+    nodes.Generator: 'generator',
+    nodes.ListComprehension: 'list',
+    nodes.SetComprehension: 'set',
+}
+
+#: Code reading the max number of elements evaluated at once
+_LIMIT = 'environment.concurrent_comprehension_limit'
+
+#: Wrapping with which calls and filters await their results, in async environments
+_AUTO_AWAIT = ('(await auto_await(', '))')
+
+_SEQUENCE_LITERALS = (nodes.List, nodes.Tuple, jinja_nodes.List, jinja_nodes.Tuple)
+
+
+class _GuardingOptimizer(Optimizer):
+    """Jinja's constant-folding optimizer, which also folds calls to pure globals
+
+    Folds relying on such calls become GuardedConst nodes, keeping the expression
+    they were folded from. While `fold_pure_calls` is off — as when writing those
+    expressions — no such calls are folded.
+    """
+
+    def __init__(self, environment: Any) -> None:
+        super().__init__(environment)
+        self.fold_pure_calls = True
+
+    @contextmanager
+    def guarding(self, eval_ctx: EvalContext) -> Iterator[set[str]]:
+        """Collect the names of the pure globals called by folds within the block"""
+        guards: set[str] = set()
+        if not self.fold_pure_calls:
+            yield guards
+            return
+
+        eval_ctx.const_fold_guards = guards
+        try:
+            yield guards
+        finally:
+            del eval_ctx.const_fold_guards
+
+    def generic_visit(self, node: jinja_nodes.Node, *args: Any, **kwargs: Any) -> jinja_nodes.Node:
+        node = super(Optimizer, self).generic_visit(node, *args, **kwargs)
+        if not isinstance(node, jinja_nodes.Expr) or isinstance(node, nodes.GuardedConst):
+            return node
+
+        eval_ctx = get_eval_context(node, args[0] if args else None)
+        with self.guarding(eval_ctx) as guards:
+            try:
+                const = jinja_nodes.Const.from_untrusted(
+                    node.as_const(eval_ctx), lineno=node.lineno, environment=self.environment
+                )
+            except Impossible:
+                return node
+        if guards:
+            return nodes.GuardedConst(const, sorted(guards), node, lineno=node.lineno)
+        return const
+
+
+@dataclass
+class _HoistScope:
+    #: Names bound by each of the comprehension's for-clauses
+    level_targets: list[set[str]]
+    #: Whether the comprehension is free of side-effects, so its invariants stay invariant
+    pure: bool = True
+    #: Deepest level at which values used by the code being generated may be hoisted
+    max_level: int = -1
+    #: Hoisted (name, code) pairs, per level
+    entries: list[list[tuple[str, str]]] = field(default_factory=list)
+
+    def __post_init__(self) -> None:
+        self.entries = [[] for _ in self.level_targets]
+
+    def level_for(self, names: set[str]) -> int:
+        """Return the outermost level at which all names are bound"""
+        for level in reversed(range(len(self.level_targets))):
+            if self.level_targets[level] & names:
+                return level + 1
+        return 0
+
+
+class _Vectorizer:
+    """Translates comprehension elements and conditions into NumPy array expressions
+
+    Only arithmetic, comparisons, and (within conditions) boolean operators are
+    supported, applied to the comprehension's target, numeric constants, and other
+    variables — which are passed in as parameters, so their values can be checked
+    to be numeric scalars at runtime. Each translation is the body of a function
+    taking the numpy module, the (filtered) array of targets, then the variables.
+    """
+
+    def __init__(self, target: str, new_name: Callable[[], str]) -> None:
+        self.target = target
+        self.new_name = new_name
+        self.numpy = new_name()
+        self.array = new_name()
+        #: Parameter name of each referenced variable
+        self.params: dict[str, str] = {}
+
+    def translate(self, node: jinja_nodes.Expr, truth: bool = False) -> str | None:
+        """Return code evaluating node over the whole array at once, or None if unsupported
+
+        If truth, node is a condition, so only the truthiness of its result matters.
+        """
+        names = [node, *node.find_all(jinja_nodes.Name)]
+        if not any(self._is_target(name) for name in names):
+            return None  # Results independent of the target would need broadcasting
+        return self._translate(node, truth)
+
+    def function(self, code: str) -> str:
+        params = ', '.join([self.numpy, self.array, *self.params.values()])
+        return f'lambda {params}: {code}'
+
+    def _is_target(self, node: jinja_nodes.Node) -> bool:
+        return isinstance(node, jinja_nodes.Name) and node.name == self.target
+
+    def _translate(self, node: jinja_nodes.Expr, truth: bool) -> str | None:
+        if self._is_target(node):
+            return self.array
+
+        if isinstance(node, jinja_nodes.Name):
+            if node.ctx != 'load':
+                return None
+            if node.name not in self.params:
+                self.params[node.name] = self.new_name()
+            return self.params[node.name]
+
+        if isinstance(node, jinja_nodes.Const):
+            if type(node.value) not in (int, float, bool):
+                return None
+            return repr(node.value)
+
+        if isinstance(node, (jinja_nodes.And, jinja_nodes.Or)):
+            # Outside conditions, these return one of their operands — not a bool
+            if not truth:
+                return None
+            left = self._translate(node.left, truth)
+            right = self._translate(node.right, truth)
+            if left is None or right is None:
+                return None
+            func = 'logical_and' if isinstance(node, jinja_nodes.And) else 'logical_or'
+            return f'{self.numpy}.{func}({left}, {right})'
+
+        if isinstance(node, jinja_nodes.Not):
+            # Outside conditions, this returns a bool, rather than a numpy bool
+            operand = self._translate(node.node, truth) if truth else None
+            return None if operand is None else f'{self.numpy}.logical_not({operand})'
+
+        if isinstance(node, _VECTOR_BINEXPRS):
+            left = self._translate(node.left, False)
+            right = self._translate(node.right, False)
+            if left is None or right is None:
+                return None
+            return f'({left} {node.operator} {right})'
+
+        if isinstance(node, (jinja_nodes.Neg, jinja_nodes.Pos)):
+            operand = self._translate(node.node, False)
+            return None if operand is None else f'({node.operator}{operand})'
+
+        if isinstance(node, jinja_nodes.Compare):
+            # Chained comparisons hold where each of their links do
+            links = []
+            left = self._translate(node.expr, False)
+            for operand in node.ops:
+                right = self._translate(operand.expr, False)
+                if left is None or right is None or operand.op not in _VECTOR_COMPARISONS:
+                    return None
+                links.append(f'({left} {operators[operand.op]} {right})')
+                left = right
+            code = links[0]
+            for link in links[1:]:
+                code = f'{self.numpy}.logical_and({code}, {link})'
+            return code
+
+        return None
+
+
+#: Arithmetic operators applied element-wise to arrays, just as to numpy scalars
+_VECTOR_BINEXPRS = (
+    jinja_nodes.Add,
+    jinja_nodes.Sub,
+    jinja_nodes.Mul,
+    jinja_nodes.Div,
+    jinja_nodes.FloorDiv,
+    jinja_nodes.Mod,
+    jinja_nodes.Pow,
+)
+
+_VECTOR_COMPARISONS = frozenset({'eq', 'ne', 'gt', 'gteq', 'lt', 'lteq'})
+
+
+#: Nodes which may make up the keys of a hash join, none of which have side-effects
+_JOIN_KEY_NODES = (
+    jinja_nodes.Name,
+    jinja_nodes.Const,
+    jinja_nodes.Getattr,
+    jinja_nodes.Getitem,
+    jinja_nodes.Tuple,
+    nodes.Tuple,
+)
+
+
+def _equality_keys(cond: jinja_nodes.Node) -> Iterator[tuple[jinja_nodes.Expr, jinja_nodes.Expr]]:
+    """Yield (a, b) and (b, a) for each `a == b` which a condition requires to hold"""
+    if isinstance(cond, jinja_nodes.And):
+        yield from _equality_keys(cond.left)
+        yield from _equality_keys(cond.right)
+    elif (
+        isinstance(cond, Compare)
+        and len(cond.ops) == 1
+        and cond.ops[0].op == 'eq'
+        and _is_join_key(cond.expr)
+        and _is_join_key(cond.ops[0].expr)
+    ):
+        yield cond.expr, cond.ops[0].expr
+        yield cond.ops[0].expr, cond.expr
+
+
+def _is_join_key(node: jinja_nodes.Node) -> bool:
+    return all(
+        isinstance(child, _JOIN_KEY_NODES)
+        for child in (node, *node.find_all(jinja_nodes.Node))
+    )
+
+
+def _is_literal_container(node: jinja_nodes.Node) -> bool:
+    # Literal containers are never awaitable, nor async iterables
+    return isinstance(node, nodes.HashedContainer) and node.literal_values() is not None
+
+
+def _referenced_names(node: jinja_nodes.Node) -> set[str]:
+    names = {name.name for name in node.find_all(jinja_nodes.Name)}
+    if isinstance(node, jinja_nodes.Name):
+        names.add(node.name)
+    return names
+
+
+def _has_lookups(node: jinja_nodes.Node) -> bool:
+    """Whether evaluating node looks up attributes or items of any object"""
+    for child in (node, *node.find_all((jinja_nodes.Getattr, jinja_nodes.Getitem, jinja_nodes.Filter))):
+        if isinstance(child, (jinja_nodes.Getattr, jinja_nodes.Getitem)):
+            return True
+        if isinstance(child, jinja_nodes.Filter) and (
+            child.name in _LOOKUP_FILTERS or any(kwarg.key == 'attribute' for kwarg in child.kwargs)
+        ):
+            return True
+    return False
+
+
+def _is_shareable(node: jinja_nodes.Node) -> bool:
+    """Whether node's value may be reused by every element of a comprehension
+
+    That's the case if it's immutable, or an existing object (e.g. a variable, or
+    an element of one) — rather than a fresh mutable object, like a list literal
+    or the result of `sort`, or a one-shot iterator.
+    """
+    if isinstance(node, jinja_nodes.Const):
+        try:
+            hash(node.value)
+        except TypeError:
+            return False
+        return True
+    if isinstance(node, (jinja_nodes.Name, jinja_nodes.Test, jinja_nodes.Concat)):
+        return True
+    if isinstance(node, (jinja_nodes.Tuple, nodes.Tuple)):
+        return all(
+            _items_shareable(item.node) if isinstance(item, nodes.SpreadScalars) else _is_shareable(item)
+            for item in node.items
+        )
+    if isinstance(node, (jinja_nodes.Getattr, jinja_nodes.Getitem)):
+        return _items_shareable(node.node)
+    if isinstance(node, jinja_nodes.Filter):
+        if node.name in _SCALAR_FILTERS:
+            return True
+        return node.name in _ELEMENT_FILTERS and node.node is not None and _items_shareable(node.node)
+    if isinstance(node, jinja_nodes.CondExpr):
+        return _is_shareable(node.expr1) and (node.expr2 is None or _is_shareable(node.expr2))
+    return False
+
+
+def _items_shareable(node: jinja_nodes.Node) -> bool:
+    """Whether the items of node's value (yielded by iterating, or looked up) may be reused by every element"""
+    if isinstance(node, (jinja_nodes.Name, jinja_nodes.Getattr, jinja_nodes.Getitem)):
+        # An item of an existing object is itself existing
+        return isinstance(node, jinja_nodes.Name) or _items_shareable(node.node)
+    if isinstance(node, jinja_nodes.Const):
+        if isinstance(node.value, (list, tuple)):
+            return all(_is_shareable(jinja_nodes.Const(item)) for item in node.value)
+        return _is_shareable(node)
+    if isinstance(node, (jinja_nodes.List, jinja_nodes.Tuple, nodes.List, nodes.Tuple, nodes.Set)):
+        return _is_shareable(nodes.Tuple(list(node.items), 'load'))
+    if isinstance(node, (jinja_nodes.Dict, nodes.Dict)):
+        return all(
+            _items_shareable(item.node) if isinstance(item, nodes.SpreadPairs) else _is_shareable(item.value)
+            for item in node.items
+        )
+    if isinstance(node, (nodes.ListComprehension, nodes.SetComprehension, nodes.Generator)):
+        return _is_shareable(node.expr)
+    if isinstance(node, nodes.DictComprehension):
+        return _is_shareable(node.pair.value)
+    if isinstance(node, jinja_nodes.Filter) and node.node is not None:
+        if node.name == 'map':
+            if any(kwarg.key == 'attribute' for kwarg in node.kwargs):
+                return _items_shareable(node.node)
+            return bool(node.args) and _const_str(node.args[0]) in _SCALAR_FILTERS
+        return node.name in _ITEM_FILTERS and _items_shareable(node.node)
+    return False
+
+
+def _const_str(node: jinja_nodes.Node) -> str | None:
+    if isinstance(node, jinja_nodes.Const) and isinstance(node.value, str):
+        return node.value
+    return None
 
-        for component, (iter_frame, loop_frame) in zip(node.for_components, frames):
-            self.write(self.choose_async(" async for ", " for "))
-            self.visit(component.target, loop_frame)
-            self.write(" in ")
-            self.write(self.choose_async("auto_aiter(", ""))
-            self.visit(component.iter, iter_frame)
-            self.write(self.choose_async(")", ""))
 
-            if component.cond:
-                self.write(" if ")
-                self.visit(component.cond, loop_frame)
+def _find_assigned_names(node: jinja_nodes.Node) -> set[str]:
+    """Return all names the template may assign to, through any means"""
+    names = set()
+    for name_node in node.find_all(jinja_nodes.Name):
+        if name_node.ctx != 'load':
+            names.add(name_node.name)
+    for import_node in node.find_all(jinja_nodes.Import):
+        names.add(import_node.target)
+    for from_import_node in node.find_all(jinja_nodes.FromImport):
+        for name in from_import_node.names:
+            names.add(name[1] if isinstance(name, tuple) else name)
+    for macro_node in node.find_all(jinja_nodes.Macro):
+        names.add(macro_node.name)
+    return names
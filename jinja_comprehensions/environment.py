@@ -1,17 +1,285 @@
 from __future__ import annotations
 
+from time import perf_counter
+from types import CodeType
+from typing import Any, Awaitable, Callable, Mapping
+
 from jinja2 import nodes
-from jinja2.environment import Environment
+from jinja2.environment import Environment, create_cache
+from jinja2.exceptions import TemplateSyntaxError
+from jinja2.lexer import TokenStream
+from jinja2.runtime import Context, Undefined
 
 from jinja_comprehensions import compiler, parser
+from jinja_comprehensions.parsecache import ParseTreeCache
+from jinja_comprehensions.profiling import CompileProfiler, ComprehensionProfiler
+from jinja_comprehensions.templatecache import SizedTemplateCache
+from jinja_comprehensions.util import new_layered_context
 
-__all__ = ['ComprehensionEnvironment']
+__all__ = [
+    'ComprehensionEnvironment',
+    'ComprehensionExpression',
+]
 
 
 class ComprehensionEnvironment(Environment):
     code_generator_class = compiler.ComprehensionCodeGenerator
 
+    #: Globals which may be called at compile time, when constant-folding comprehensions.
+    #: These must be free of side-effects, and their results must depend only on their
+    #: arguments. A call is only folded if the global is still bound to the very same
+    #: object, and its name is not assigned anywhere in the template. The folded value
+    #: is only used if, at render time, the name still resolves to the global (rather
+    #: than a variable of the render context).
+    const_fold_pure_globals: frozenset[Any] = frozenset({
+        abs, bool, dict, enumerate, float, frozenset, int, len, list, max, min,
+        range, reversed, round, set, sorted, str, sum, tuple, zip,
+    })
+
+    #: Maximum number of loop iterations performed when constant-folding a single
+    #: comprehension (including any nested within it), where the sizes of the values
+    #: returned by calls and filters count as iterations, too. Comprehensions requiring
+    #: more work are left to be evaluated at render time.
+    const_fold_max_iterations: int = 10_000
+
+    #: Let loop-invariant attribute and item lookups (e.g. `config.allowed`) within
+    #: comprehensions be evaluated once per comprehension, like other loop-invariant
+    #: expressions, rather than once per element. Only enable this if every attribute
+    #: and item reachable from templates returns the same value on each access —
+    #: a property computing a fresh value (or counting its reads) would otherwise
+    #: be evaluated just once.
+    hoist_invariant_lookups: bool = False
+
+    #: In async environments, evaluate the elements of list, set, and dict comprehensions
+    #: concurrently, if they call functions or filters. Conditions and iterables are
+    #: still evaluated in order, and results keep their order. Elements must therefore
+    #: not depend on one another's side-effects.
+    concurrent_comprehensions: bool = False
+
+    #: Max number of comprehension elements evaluated at once, when
+    #: `concurrent_comprehensions` is enabled. None means no limit.
+    concurrent_comprehension_limit: int | None = None
+
+    #: Evaluate list, set, and dict comprehensions over 1-D NumPy arrays with array
+    #: operations, rather than element by element. Applies to comprehensions with a
+    #: single for-clause binding a single name, whose element and condition only
+    #: apply arithmetic, comparison, and boolean operators to it, to numeric
+    #: constants, and to variables holding numeric scalars. Anything else — including
+    #: any other iterable — is evaluated as usual. NumPy is never imported by this.
+    numpy_comprehensions: bool = False
+
+    #: Profiler collecting runtime stats of each comprehension, generator expression,
+    #: and spread in templates compiled while it's set. When None (the default), no
+    #: instrumentation is compiled in. Templates compiled (or cached) beforehand are
+    #: not instrumented.
+    comprehension_profiler: ComprehensionProfiler | None = None
+
+    #: Profiler timing each stage of compiling templates (lex, parse, optimize,
+    #: codegen, and compile). None (the default) disables timing.
+    compile_profiler: CompileProfiler | None = None
+
+    #: Number of compiled expressions kept by `compile_expression()`, keyed by
+    #: source. 0 disables caching, and a negative number caches without bound.
+    expression_cache_size: int = 400
+
+    #: Cache of parsed templates, possibly shared with other environments — e.g.
+    #: `parsecache.shared_parse_tree_cache`. None disables caching.
+    parse_tree_cache: ParseTreeCache | None = None
+
+    #: When set, loaded templates are cached in a `SizedTemplateCache` bounded to
+    #: this many bytes of compiled code and constants, rather than to `cache_size`
+    #: templates.
+    template_cache_max_size: int | None = None
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._expression_cache = create_cache(self.expression_cache_size)
+        if self.template_cache_max_size is not None:
+            self.cache = SizedTemplateCache(self.template_cache_max_size)
+
+    def overlay(self, *args: Any, **kwargs: Any) -> Environment:
+        rv = super().overlay(*args, **kwargs)
+        rv._expression_cache = create_cache(self.expression_cache_size)
+        if isinstance(self.cache, SizedTemplateCache) and 'cache_size' not in kwargs:
+            # Jinja would otherwise swap in an unbounded dict
+            rv.cache = self.cache.copy()
+            rv.cache.clear()
+        return rv
+
+    def compile(
+        self,
+        source: str | nodes.Template,
+        name: str | None = None,
+        filename: str | None = None,
+        raw: bool = False,
+        defer_init: bool = False,
+    ) -> Any:
+        if self.compile_profiler is None:
+            return super().compile(source, name, filename, raw, defer_init)
+        with self.compile_profiler.record(name):
+            return super().compile(source, name, filename, raw, defer_init)
+
+    def compile_expression(
+        self, source: str, undefined_to_none: bool = True
+    ) -> ComprehensionExpression:
+        """Compile source into a callable returning the value of the expression
+
+        In contrast to `Environment.compile_expression()`, comprehensions, spreads,
+        and set literals are supported, and the returned callable evaluates the
+        expression directly — without creating a template, rendering its output,
+        or copying its variables.
+
+        >>> env = ComprehensionEnvironment()
+        >>> expr = env.compile_expression('[n * 2 for n in items if n != skip]')
+        >>> expr({'items': [1, 2, 3], 'skip': 2})
+        [2, 6]
+
+        Compiled expressions are cached by source (see `expression_cache_size`).
+        """
+        cache_key = (source, undefined_to_none)
+        if self._expression_cache is not None:
+            expression = self._expression_cache.get(cache_key)
+            if expression is not None:
+                return expression
+
+        expr_parser = parser.ComprehensionParser(self, source, state='variable')
+        try:
+            expr = expr_parser.parse_expression()
+            if not expr_parser.stream.eos:
+                raise TemplateSyntaxError(
+                    'chunk after expression', expr_parser.stream.current.lineno, None, None
+                )
+            expr.set_environment(self)
+        except TemplateSyntaxError:
+            self.handle_exception(source=source)
+
+        generator = self.code_generator_class(self, None, None, optimized=self.optimized)
+        generator.generate_expression(expr)
+        code = self._compile(generator.stream.getvalue(), '<expression>')
+
+        namespace = {'environment': self, '__file__': code.co_filename}
+        exec(code, namespace)
+        expression = ComprehensionExpression(self, namespace['expression'], undefined_to_none)
+
+        if self._expression_cache is not None:
+            self._expression_cache[cache_key] = expression
+        return expression
+
     def _parse(
         self, source: str, name: str | None, filename: str | None
     ) -> nodes.Template:
+        profiler = self.compile_profiler
+        if profiler is not None and profiler.current is not None:
+            # Parse time excludes lexing, which _tokenize() records on its own
+            lex_before = profiler.current.stages['lex']
+            start = perf_counter()
+            try:
+                return self._parse_tree(source, name, filename)
+            finally:
+                lexing = profiler.current.stages['lex'] - lex_before
+                profiler.add('parse', perf_counter() - start - lexing)
+        return self._parse_tree(source, name, filename)
+
+    def _parse_tree(
+        self, source: str, name: str | None, filename: str | None
+    ) -> nodes.Template:
+        if self.parse_tree_cache is not None:
+            return self.parse_tree_cache.parse(
+                self, source, name, filename, parser.ComprehensionParser
+            )
         return parser.ComprehensionParser(self, source, name, filename).parse()
+
+    def _tokenize(
+        self,
+        source: str,
+        name: str | None,
+        filename: str | None = None,
+        state: str | None = None,
+    ) -> TokenStream:
+        profiler = self.compile_profiler
+        if profiler is None or profiler.current is None:
+            return super()._tokenize(source, name, filename, state)
+
+        # Tokens are normally produced lazily, as the parser consumes them. To time
+        # lexing on its own, they're all produced up-front.
+        start = perf_counter()
+        try:
+            tokens = list(super()._tokenize(source, name, filename, state))
+        finally:
+            profiler.add('lex', perf_counter() - start)
+        return TokenStream(iter(tokens), name, filename)
+
+    def _generate(
+        self,
+        source: nodes.Template,
+        name: str | None,
+        filename: str | None,
+        defer_init: bool = False,
+    ) -> str:
+        profiler = self.compile_profiler
+        if profiler is None or profiler.current is None:
+            return super()._generate(source, name, filename, defer_init)
+
+        # Optimization happens within code generation, and records its own time
+        optimize_before = profiler.current.stages['optimize']
+        start = perf_counter()
+        try:
+            code = super()._generate(source, name, filename, defer_init)
+        finally:
+            optimizing = profiler.current.stages['optimize'] - optimize_before
+            profiler.add('codegen', perf_counter() - start - optimizing)
+        profiler.current.source_size = len(code)
+        return code
+
+    def _compile(self, source: str, filename: str) -> CodeType:
+        profiler = self.compile_profiler
+        if profiler is None or profiler.current is None:
+            return super()._compile(source, filename)
+
+        start = perf_counter()
+        try:
+            return super()._compile(source, filename)
+        finally:
+            profiler.add('compile', perf_counter() - start)
+
+
+class ComprehensionExpression:
+    """Callable returned by `ComprehensionEnvironment.compile_expression()`
+
+    Variables may be passed as a single mapping (which is used as-is, not copied),
+    as keyword arguments, or both.
+
+    >>> expr = ComprehensionEnvironment().compile_expression('a + b')
+    >>> expr({'a': 1, 'b': 2}), expr(a=1, b=2)
+    (3, 3)
+    """
+
+    def __init__(
+        self,
+        environment: Environment,
+        func: Callable[[Context], Any],
+        undefined_to_none: bool,
+    ) -> None:
+        self.environment = environment
+        self._func = func
+        self._undefined_to_none = undefined_to_none
+
+    def __call__(self, *args: Mapping[str, Any], **kwargs: Any) -> Any:
+        if self.environment.is_async:
+            import asyncio
+            return asyncio.run(self.call_async(*args, **kwargs))
+        return self._finish(self._func(self._new_context(args, kwargs)))
+
+    async def call_async(self, *args: Mapping[str, Any], **kwargs: Any) -> Any:
+        if not self.environment.is_async:
+            raise RuntimeError('The environment was not created with async mode enabled.')
+        result: Awaitable[Any] = self._func(self._new_context(args, kwargs))
+        return self._finish(await result)
+
+    def _new_context(self, args: tuple[Mapping[str, Any], ...], kwargs: dict[str, Any]) -> Context:
+        return new_layered_context(self.environment, self.environment.globals, None, args, kwargs)
+
+    def _finish(self, rv: Any) -> Any:
+        if self._undefined_to_none and isinstance(rv, Undefined):
+            return None
+        return rv
@@ -1,18 +1,26 @@
 from __future__ import annotations
 
+import inspect
+from io import StringIO
 from itertools import chain, islice
 from types import GeneratorType
-from typing import Any, Iterable
+from typing import Any, AsyncIterator, Callable, Iterable, Mapping, MutableMapping, TextIO
 
+from jinja2 import nodes
+from jinja2.compiler import Frame, find_undeclared
+from jinja2.environment import Environment
 from jinja2.nativetypes import NativeCodeGenerator, NativeEnvironment, NativeTemplate
+from jinja2.nodes import EvalContext
+from jinja2.runtime import Context
 
-from jinja_comprehensions.compiler import AsyncOperandsCodeGenerator, ComprehensionCodeGenerator
+from jinja_comprehensions.compiler import _AUTO_AWAIT, AsyncOperandsCodeGenerator, ComprehensionCodeGenerator
 from jinja_comprehensions.environment import ComprehensionEnvironment
-from jinja_comprehensions.runtime import syncify_awaitable
-from jinja_comprehensions.util import add_template_class, with_code_generator
+from jinja_comprehensions.runtime import syncify_awaitable, syncify_awaitables_concurrently
+from jinja_comprehensions.util import add_template_class, new_layered_context, with_code_generator
 
 __all__ = [
     'NativeComprehensionEnvironment',
+    'NativeRenderOptions',
     'NoLiteralEvalNativeEnvironment',
     'NoLiteralEvalComprehensionNativeEnvironment',
 ]
@@ -44,6 +52,99 @@ def no_literal_eval_native_concat(values: Iterable[Any]) -> Any | None:
         return "".join([str(v) for v in values])
 
 
+def stream_native_concat(
+    values: Iterable[Any], write: Callable[[str], Any], batch_size: int = 8192
+) -> Any | None:
+    """Write the output values of a rendered template to a sink, rather than concatenating
+
+    As with `no_literal_eval_native_concat`, a single value is passed through as-is —
+    if it's not a string, it's returned, and nothing is written. Otherwise, all values
+    are stringified and passed to `write` in batches of at least `batch_size` chars
+    (save for the last), and None is returned.
+    """
+    values = iter(values)
+    head = list(islice(values, 2))
+
+    if len(head) == 1 and not isinstance(head[0], str):
+        return head[0]
+
+    batch: list[str] = []
+    batch_len = 0
+    for value in chain(head, values):
+        chunk = str(value)
+        batch.append(chunk)
+        batch_len += len(chunk)
+        if batch_len >= batch_size:
+            write("".join(batch))
+            batch.clear()
+            batch_len = 0
+
+    if batch:
+        write("".join(batch))
+
+    return None
+
+
+async def stream_native_concat_async(
+    values: AsyncIterator[Any], write: Callable[[str], Any], batch_size: int = 8192
+) -> Any | None:
+    """Async version of `stream_native_concat`, sync-flattening values as they arrive
+
+    `write` may be a sync or async callable.
+    """
+
+    async def _write(text: str) -> None:
+        result = write(text)
+        if inspect.isawaitable(result):
+            await result
+
+    head = []
+    async for value in values:
+        head.append(await syncify_awaitable(value))
+        if len(head) == 2:
+            break
+
+    if len(head) == 1 and not isinstance(head[0], str):
+        return head[0]
+
+    batch: list[str] = [str(value) for value in head]
+    batch_len = sum(map(len, batch))
+    async for value in values:
+        chunk = str(await syncify_awaitable(value))
+        batch.append(chunk)
+        batch_len += len(chunk)
+        if batch_len >= batch_size:
+            await _write("".join(batch))
+            batch.clear()
+            batch_len = 0
+
+    if batch:
+        await _write("".join(batch))
+
+    return None
+
+
+class NativeRenderOptions:
+    """Environment attributes tuning how `NoAsyncConcatNativeTemplate` renders"""
+
+    #: In async renders, await all awaitable output values concurrently, rather than
+    #: one after another. Output order is retained. Calls and filters output directly
+    #: (e.g. `{{ fetch(x) }}`) aren't awaited as they're evaluated, so their results
+    #: are awaited concurrently, too. Must be set before templates are compiled.
+    concurrent_await: bool = False
+
+    #: Max number of output values awaited at once, when `concurrent_await` is
+    #: enabled. None means no limit.
+    concurrent_await_limit: int | None = None
+
+    #: Number of seconds after which an async render is cancelled, raising
+    #: asyncio.TimeoutError. None means no timeout.
+    render_timeout: float | None = None
+
+    #: Min number of chars passed to each write by `render_to` and `render_to_async`
+    render_batch_size: int = 8192
+
+
 class NoAsyncConcatNativeTemplate(NativeTemplate):
     """NativeTemplate that awaits values in render_async before passing them to environment.concat
 
@@ -51,36 +152,291 @@ class NoAsyncConcatNativeTemplate(NativeTemplate):
     directly to the environment's concat function. Even though these output values are
     sourced from an `async for`, the values themselves may be async, and the synchronous
     concat() cannot handle them. Thus, we must sync-flatten them all by awaiting them first.
+
+    How this is done is tuned by the environment's `NativeRenderOptions` attributes.
     """
 
-    async def render_async(self, *args: Any, **kwargs: Any) -> Any:
+    def render_to(self, fileobj: TextIO, *args: Any, **kwargs: Any) -> Any | None:
+        """Render the template, writing its output to a text file object incrementally
+
+        Output follows the same concat rules as `render()`: if the template renders a
+        single non-string value, it's returned as-is, and nothing is written.
+        Environments using `no_literal_eval_native_concat` never hold the full output
+        in memory. Others (e.g. `NativeComprehensionEnvironment`) literal_eval the
+        output as a whole, so it's rendered in full first — then written, if the
+        result is a string, or returned otherwise.
+        """
+        if self.environment.is_async:
+            import asyncio
+            return asyncio.run(self.render_to_async(fileobj, *args, **kwargs))
+
+        if not self._streams_output():
+            value = self.render(*args, **kwargs)
+            if not isinstance(value, str):
+                return value
+            if value:
+                fileobj.write(value)
+            return None
+
+        ctx = self.new_context(dict(*args, **kwargs))
+
+        try:
+            return stream_native_concat(
+                self.root_render_func(ctx),  # type: ignore
+                fileobj.write,
+                getattr(self.environment, 'render_batch_size', 8192),
+            )
+        except Exception:
+            return self.environment.handle_exception()
+
+    async def render_to_async(self, writer: Any, *args: Any, **kwargs: Any) -> Any | None:
+        """Async version of `render_to`
+
+        `writer.write()` may return an awaitable, which will be awaited. If the writer
+        has a `drain()` coroutine method (e.g. asyncio.StreamWriter), it's awaited after
+        each write.
+        """
         if not self.environment.is_async:
             raise RuntimeError(
                 "The environment was not created with async mode enabled."
             )
 
+        drain = getattr(writer, 'drain', None)
+        if drain is None:
+            write = writer.write
+        else:
+            async def write(text: str) -> None:
+                result = writer.write(text)
+                if inspect.isawaitable(result):
+                    await result
+                await drain()
+
+        if not self._streams_output():
+            value = await self.render_async(*args, **kwargs)
+            if not isinstance(value, str):
+                return value
+            if value:
+                result = write(value)
+                if inspect.isawaitable(result):
+                    await result
+            return None
+
         ctx = self.new_context(dict(*args, **kwargs))
 
+        import asyncio
+
+        try:
+            return await asyncio.wait_for(
+                stream_native_concat_async(
+                    self.root_render_func(ctx),  # type: ignore
+                    write,
+                    getattr(self.environment, 'render_batch_size', 8192),
+                ),
+                getattr(self.environment, 'render_timeout', None),
+            )
+        except Exception:
+            return self.environment.handle_exception()
+
+    def _streams_output(self) -> bool:
+        # Only output which isn't literal_eval'd as a whole can be written piecemeal
+        return self.environment_class.concat is no_literal_eval_native_concat
+
+    #: For templates consisting of a single output expression, a function returning
+    #: the expression's value (see `SingleOutputCodeGenerator`)
+    render_value_func: Callable[[Context], Any] | None = None
+
+    @classmethod
+    def _from_namespace(
+        cls,
+        environment: Environment,
+        namespace: MutableMapping[str, Any],
+        globals: MutableMapping[str, Any],
+    ) -> NativeTemplate:
+        t = super()._from_namespace(environment, namespace, globals)
+        t.render_value_func = namespace.get('render_value')
+        return t
+
+    def render(self, *args: Any, **kwargs: Any) -> Any:
+        if self.render_value_func is None or self.environment.is_async:
+            return super().render(*args, **kwargs)
+
+        ctx = self._new_value_context(args, kwargs)
+
+        try:
+            return self._concat_value(self.render_value_func(ctx))
+        except Exception:
+            return self.environment.handle_exception()
+
+    async def render_async(self, *args: Any, **kwargs: Any) -> Any:
+        if not self.environment.is_async:
+            raise RuntimeError(
+                "The environment was not created with async mode enabled."
+            )
+
+        if self.render_value_func is not None:
+            ctx = self._new_value_context(args, kwargs)
+            render = self._render_value_async(ctx)
+        else:
+            ctx = self.new_context(dict(*args, **kwargs))
+            render = self._render_values_async(ctx)
+
+        import asyncio
+
         try:
+            return await asyncio.wait_for(
+                render,
+                getattr(self.environment, 'render_timeout', None),
+            )
+        except Exception:
+            return self.environment.handle_exception()
+
+    def _new_value_context(self, args: tuple[Mapping[str, Any], ...], kwargs: dict[str, Any]) -> Context:
+        # Single-output templates never assign to the context, nor export from it
+        return new_layered_context(self.environment, self.globals, self.name, args, kwargs)
+
+    def _concat_value(self, value: Any) -> Any:
+        concat = self.environment_class.concat
+        if concat is no_literal_eval_native_concat:
+            # A single value is passed through as-is
+            return value
+        return concat((value,))
+
+    async def _render_value_async(self, ctx: Context) -> Any:
+        return self._concat_value(await self.render_value_func(ctx))  # type: ignore[misc]
+
+    async def _render_values_async(self, ctx: Context) -> Any:
+        values = self.root_render_func(ctx)  # type: ignore
+        if getattr(self.environment, 'concurrent_await', False):
+            limit = getattr(self.environment, 'concurrent_await_limit', None)
+            return self.environment_class.concat(
+                await syncify_awaitables_concurrently(values, limit)
+            )
+        else:
             return self.environment_class.concat([
                 await syncify_awaitable(n)
-                async for n in self.root_render_func(ctx)  # type: ignore
+                async for n in values
             ])
-        except Exception:
-            return self.environment.handle_exception()
 
 
-class NativeComprehensionCodeGenerator(ComprehensionCodeGenerator, NativeCodeGenerator):
+class SingleOutputCodeGenerator(NativeCodeGenerator):
+    """Native code generator emitting a direct function for single-expression templates
+
+    A template whose body is exactly one `{{ expr }}` gets a module-level
+    `render_value(context)` function alongside its usual root render function,
+    which returns the (finalized) value of the expression — or, in async
+    environments, a coroutine returning its sync-flattened value. Templates of
+    `NoAsyncConcatNativeTemplate` call it directly when rendering, skipping the
+    render generator and output concatenation.
+
+    With the environment's `concurrent_await` enabled, async templates output the
+    results of calls and filters without awaiting them, so the template can await
+    them all concurrently.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        #: The stream written to before an unawaited output value was captured
+        self._output_stream: Any | None = None
+
+    def _yields_unawaited(self, node: nodes.Expr, frame: Frame, finalize: Any) -> bool:
+        return (
+            self.environment.is_async
+            and getattr(self.environment, 'concurrent_await', False)
+            and frame.buffer is None
+            and finalize.src is None
+            and isinstance(node, (nodes.Call, nodes.Filter))
+        )
+
+    def _output_child_pre(self, node: nodes.Expr, frame: Frame, finalize: Any) -> None:
+        super()._output_child_pre(node, frame, finalize)
+        if self._yields_unawaited(node, frame, finalize):
+            self.write('')  # Flush any pending newline before capturing the output value
+            self._output_stream, self.stream = self.stream, StringIO()
+
+    def _output_child_post(self, node: nodes.Expr, frame: Frame, finalize: Any) -> None:
+        if self._output_stream is not None:
+            code = self.stream.getvalue()
+            self.stream, self._output_stream = self._output_stream, None
+            prefix, suffix = _AUTO_AWAIT
+            if code.startswith(prefix) and code.endswith(suffix):
+                code = code[len(prefix):-len(suffix)]
+            self.write(code)
+        super()._output_child_post(node, frame, finalize)
+
+    def visit_Template(self, node: nodes.Template, frame: Frame | None = None) -> None:
+        super().visit_Template(node, frame)
+
+        output = _single_output(node)
+        if output is not None:
+            self._write_render_value(node, output)
+
+    def _write_render_value(self, node: nodes.Template, output: nodes.Expr) -> None:
+        if self.environment.is_async:
+            self.writeline('from jinja_comprehensions.runtime import syncify_awaitable')
+
+        envenv = '' if self.defer_init else ', environment=environment'
+        self.writeline(f'{self.func("render_value")}(context, missing=missing{envenv}):', extra=1)
+        self.indent()
+        self.writeline('resolve = context.resolve_or_missing')
+        self.writeline('undefined = environment.undefined')
+        self.writeline('cond_expr_undefined = Undefined')
+
+        frame = Frame(EvalContext(self.environment, self.name))
+        frame.symbols.analyze_node(node)
+        frame.toplevel = frame.rootlevel = True
+        self.enter_frame(frame)
+        self.pull_dependencies(node.body)
+
+        # The expression was already marked, while generating the root function
+        self._last_line = 0
+
+        # Constants are evaluated at compile time exactly as visit_Output would
+        finalize = self._make_finalize()
+        try:
+            if not finalize.const:
+                raise nodes.Impossible()
+            const = self._output_child_to_const(output, frame, finalize)
+        except (nodes.Impossible, Exception):
+            self.writeline('return ', output)
+            if self.environment.is_async:
+                self.write('await syncify_awaitable(')
+            self._output_child_pre(output, frame, finalize)
+            self.visit(output, frame)
+            self._output_child_post(output, frame, finalize)
+            if self.environment.is_async:
+                self.write(')')
+        else:
+            self.writeline('return ' + self._output_const_repr([const]), output)
+        self.outdent()
+
+        # Cover render_value's lines, too
+        debug_kv_str = '&'.join(f'{k}={v}' for k, v in self.debug_info)
+        self.writeline(f'debug_info = {debug_kv_str!r}')
+
+
+def _single_output(node: nodes.Template) -> nodes.Expr | None:
+    """Return the expression of a template consisting only of `{{ expr }}`, if it is one"""
+    if len(node.body) != 1 or not isinstance(node.body[0], nodes.Output):
+        return None
+    output_nodes = node.body[0].nodes
+    if len(output_nodes) != 1 or isinstance(output_nodes[0], nodes.TemplateData):
+        return None
+    if 'self' in find_undeclared(node.body, ('self',)):
+        return None
+    return output_nodes[0]
+
+
+class NativeComprehensionCodeGenerator(ComprehensionCodeGenerator, SingleOutputCodeGenerator):
     pass
 
 
 @add_template_class
-class NativeComprehensionEnvironment(ComprehensionEnvironment, NativeEnvironment):
+class NativeComprehensionEnvironment(NativeRenderOptions, ComprehensionEnvironment, NativeEnvironment):
     code_generator_class = NativeComprehensionCodeGenerator
     template_class = NoAsyncConcatNativeTemplate
 
 
-class NoLiteralEvalNativeCodeGenerator(NativeCodeGenerator):
+class NoLiteralEvalNativeCodeGenerator(SingleOutputCodeGenerator):
     def _output_const_repr(self, group: Iterable[Any]) -> str:
         """Return the equivalent Python expression for a group of values
 
@@ -101,7 +457,7 @@ class NoLiteralEvalNativeCodeGenerator(NativeCodeGenerator):
 
 
 @add_template_class
-class NoLiteralEvalNativeEnvironment(NativeEnvironment):
+class NoLiteralEvalNativeEnvironment(NativeRenderOptions, NativeEnvironment):
     """NativeEnvironment that treats TemplateData nodes as strings and Expr nodes as native
 
     >>> native = NativeEnvironment()
@@ -1,12 +1,19 @@
 from __future__ import annotations
 
-from typing import Any
+import copy
+from typing import Any, Callable, Iterator
 
 from jinja2.nodes import (
+    Call,
+    Const,
     EvalContext,
     Expr,
+    Filter,
     get_eval_context,
+    Impossible,
+    Keyword,
     Literal,
+    Name,
     NodeType, Helper, Pair, Node,
 )
 
@@ -29,9 +36,22 @@ class CustomNodeType(NodeType):
             assert len(storage) == len(set(storage)), "layout conflict"
             d[attr] = tuple(storage)
         d.setdefault("abstract", False)
+
+        # Fields and attributes are stored in slots. Jinja's own node classes still
+        # give each node a __dict__, but it's never populated — which, on most
+        # Python versions, spares the memory a per-instance dict would take.
+        slotted = _slot_names(bases[0]) if bases else set()
+        d.setdefault(
+            "__slots__",
+            tuple(name for name in d["fields"] + d["attributes"] if name not in slotted),
+        )
         return type.__new__(mcs, name, bases, d)
 
 
+def _slot_names(cls: type) -> set[str]:
+    return {name for klass in cls.__mro__ for name in klass.__dict__.get("__slots__", ())}
+
+
 class Tuple(Literal, metaclass=CustomNodeType):
     """For loop unpacking and some other things like multiple arguments
     for subscripts.  Like for :class:`Name` `ctx` specifies if the tuple
@@ -104,6 +124,41 @@ class SpreadScalars(Helper, metaclass=CustomNodeType):
         return self.node.as_const(eval_ctx)
 
 
+class HashedContainer(Expr, metaclass=CustomNodeType):
+    """The container of a membership test within a comprehension
+
+    If the container is loop-invariant, the code generator evaluates it once,
+    converting sequences of hashable elements into sets.
+    """
+
+    fields = ("node",)
+    node: Expr
+
+    # NOTE: as_const() is left raising Impossible, so the container isn't folded
+    #       away before the code generator sees it. Constant containers are
+    #       picked up by literal_values(), instead.
+
+    def literal_values(self) -> tuple[Any, ...] | None:
+        """Return the container's elements, if it's a literal of hashable constants"""
+        node = self.node
+        if isinstance(node, Const):
+            values = node.value
+            if not isinstance(values, (list, tuple, set, frozenset)):
+                return None
+        elif isinstance(node, (List, Tuple, Set)):
+            if not all(isinstance(item, Const) for item in node.items):
+                return None
+            values = [item.value for item in node.items]
+        else:
+            return None
+
+        try:
+            frozenset(values)
+        except TypeError:
+            return None
+        return tuple(values)
+
+
 class Dict(Literal, metaclass=CustomNodeType):
     """Any dict literal such as ``{1: 2, 3: 4, **base, **other, 5: 6}``.
 
@@ -159,22 +214,348 @@ class _BaseComprehension(Expr, metaclass=CustomNodeType):
     # This error disappeared when for_components changed from a list of tuples to a list of Nodes.
     #
 
+    def iter_const(self, eval_ctx: EvalContext | None = None) -> Iterator[Any]:
+        """Yield the comprehension's elements, evaluated at compile time
 
-class Generator(_BaseComprehension, metaclass=CustomNodeType):
+        Raises Impossible if any iterable, condition, or element expression is
+        not constant — where calls to the environment's `const_fold_pure_globals`
+        are considered constant, if their arguments are — or if the environment
+        has its optimizer disabled.
+        """
+        eval_ctx = get_eval_context(self, eval_ctx)
+        if eval_ctx.volatile or not eval_ctx.environment.optimized:
+            raise Impossible()
+
+        scope: dict[str, Any] = {}
+        bound_names: set[str] = set()
+        components = []
+        for component in self.for_components:
+            iter_node = _bind_names(component.iter, bound_names, scope)
+            bound_names |= target_names(component.target)
+            cond = _bind_names(component.cond, bound_names, scope)
+            components.append((component.target, iter_node, cond))
+
+        produce = self._bind_element(bound_names, scope)
+
+        # The iteration budget is shared with any comprehensions nested within us,
+        # so the total work done at compile time remains bounded.
+        owns_budget = not hasattr(eval_ctx, 'const_fold_budget')
+        if owns_budget:
+            limit = getattr(eval_ctx.environment, 'const_fold_max_iterations', 0)
+            eval_ctx.const_fold_budget = [limit]
+        budget = eval_ctx.const_fold_budget
+
+        def _walk(depth: int) -> Iterator[Any]:
+            if depth == len(components):
+                yield produce(eval_ctx)
+                return
+
+            target, iter_node, cond = components[depth]
+            try:
+                values = iter(iter_node.as_const(eval_ctx))
+            except TypeError as e:
+                raise Impossible() from e
+
+            for value in values:
+                budget[0] -= 1
+                if budget[0] < 0:
+                    raise Impossible()
+
+                _assign_target(target, value, scope)
+                if cond is None or cond.as_const(eval_ctx):
+                    yield from _walk(depth + 1)
+
+        try:
+            yield from _walk(0)
+        except Impossible:
+            raise
+        except Exception as e:
+            raise Impossible() from e
+        finally:
+            if owns_budget:
+                del eval_ctx.const_fold_budget
+            # _walk refers to itself through its closure; break the cycle, so the
+            # nodes it holds are freed right away, rather than by the garbage collector
+            _walk = None  # type: ignore[assignment]
+
+    def _bind_element(self, names: set[str], scope: dict[str, Any]) -> Callable[[EvalContext], Any]:
+        """Return a function evaluating one element at compile time, from the targets bound in `scope`
+
+        The element is the comprehension's sole field besides its for-clauses —
+        `expr`, or the key/value `pair` of dict comprehensions.
+        """
+        element, = (getattr(self, field) for field in self.fields if field != 'for_components')
+        return _bind_names(element, names, scope).as_const
+
+    def _bind_names(self, names: set[str], scope: dict[str, Any]) -> _BaseComprehension:
+        """Return a copy of this comprehension with loads of outer `names` bound to `scope`
+
+        Names rebound by our own targets shadow the outer names, as in Python.
+        """
+        clone = copy.copy(self)
+        names = set(names)
+        clone.for_components = []
+        for component in self.for_components:
+            component = copy.copy(component)
+            component.iter = _bind_names(component.iter, names, scope)
+            names -= target_names(component.target)
+            component.cond = _bind_names(component.cond, names, scope)
+            clone.for_components.append(component)
+
+        for field in self.fields:
+            if field != 'for_components':
+                setattr(clone, field, _bind_names(getattr(self, field), names, scope))
+        return clone
+
+
+class _ScalarComprehension(_BaseComprehension, metaclass=CustomNodeType):
     fields = ('expr',)
     expr: Expr
 
 
-class ListComprehension(_BaseComprehension, metaclass=CustomNodeType):
-    fields = ('expr',)
-    expr: Expr
+class Generator(_ScalarComprehension, metaclass=CustomNodeType):
+    def as_const(self, eval_ctx: EvalContext | None = None) -> Any:
+        # A generator is single-use, so it can never be stored as a literal.
+        # The code generator may still fold its elements with iter_const().
+        raise Impossible()
 
 
-class SetComprehension(_BaseComprehension, metaclass=CustomNodeType):
-    fields = ('expr',)
-    expr: Expr
+class ListComprehension(_ScalarComprehension, metaclass=CustomNodeType):
+    def as_const(self, eval_ctx: EvalContext | None = None) -> list[Any]:
+        return list(self.iter_const(eval_ctx))
+
+
+class SetComprehension(_ScalarComprehension, metaclass=CustomNodeType):
+    def as_const(self, eval_ctx: EvalContext | None = None) -> set[Any]:
+        return set(self.iter_const(eval_ctx))
 
 
 class DictComprehension(_BaseComprehension, metaclass=CustomNodeType):
     fields = ('pair',)
     pair: Pair
+
+    def as_const(self, eval_ctx: EvalContext | None = None) -> dict[Any, Any]:
+        return dict(self.iter_const(eval_ctx))
+
+
+class SinglePassArgument(Expr, metaclass=CustomNodeType):
+    """A list comprehension passed to a builtin which consumes it in a single pass
+
+    The comprehension is demoted to a generator expression, which is passed on
+    as-is if the callee turns out to be the builtin at render time — or collected
+    into a list, like the original comprehension, if the name was bound to
+    anything else (e.g. by the render context).
+    """
+
+    fields = ('node', 'callee')
+    node: Generator
+    callee: Name
+
+
+class Binding(Expr, metaclass=CustomNodeType):
+    """A name bound by an enclosing comprehension, while it's being constant-folded
+
+    These nodes only exist in the throwaway copies of comprehension bodies made
+    by `_BaseComprehension.iter_const`, and never reach the code generator.
+    """
+
+    fields = ('name', 'scope')
+    name: str
+    scope: dict[str, Any]
+
+    def as_const(self, eval_ctx: EvalContext | None = None) -> Any:
+        try:
+            return self.scope[self.name]
+        except KeyError:
+            raise Impossible()
+
+
+class PureCall(Expr, metaclass=CustomNodeType):
+    """A call to a global, which is evaluated at compile time if the global is pure
+
+    A global is considered pure if it's a member of the environment's
+    `const_fold_pure_globals`, and the template never assigns to its name.
+    Like Binding, these only exist while constant-folding comprehensions.
+
+    As the render context may still shadow the global, calls are only folded
+    where the folded value can be guarded (see GuardedConst): the names of the
+    globals called are collected into the `const_fold_guards` set of the eval
+    context, and calls are left alone if it has none.
+    """
+
+    fields = ('name', 'args', 'kwargs')
+    name: str
+    args: list[Expr]
+    kwargs: list[Keyword]
+
+    def as_const(self, eval_ctx: EvalContext | None = None) -> Any:
+        eval_ctx = get_eval_context(self, eval_ctx)
+        guards = getattr(eval_ctx, 'const_fold_guards', None)
+        if guards is None or self.name in getattr(eval_ctx, 'assigned_names', ()):
+            raise Impossible()
+
+        environment = eval_ctx.environment
+        func = environment.globals.get(self.name)
+        try:
+            is_pure = func in getattr(environment, 'const_fold_pure_globals', ())
+        except TypeError:
+            is_pure = False
+        if not is_pure:
+            raise Impossible()
+
+        args = [arg.as_const(eval_ctx) for arg in self.args]
+        kwargs = dict(kwarg.as_const(eval_ctx) for kwarg in self.kwargs)
+        try:
+            value = func(*args, **kwargs)
+        except Exception as e:
+            raise Impossible() from e
+        _charge_size(value, eval_ctx)
+        guards.add(self.name)
+        return value
+
+
+class ChargedFilter(Expr, metaclass=CustomNodeType):
+    """A filter applied while constant-folding comprehensions
+
+    Its result counts against the folding budget, by size, so e.g. the list built
+    by `range(n) | list` is only built once. Like Binding, these only exist while
+    constant-folding comprehensions.
+    """
+
+    fields = ('node',)
+    node: Filter
+
+    def as_const(self, eval_ctx: EvalContext | None = None) -> Any:
+        eval_ctx = get_eval_context(self, eval_ctx)
+        value = self.node.as_const(eval_ctx)
+        _charge_size(value, eval_ctx)
+        return value
+
+
+class GuardedConst(Expr, metaclass=CustomNodeType):
+    """A constant folded from calls to pure globals, along with the expression it was folded from
+
+    At render time, the constant is only used if each of the globals' `names`
+    still resolves to the environment's global — rather than, say, a variable of
+    the render context. The expression is evaluated otherwise.
+    """
+
+    fields = ('const', 'names', 'node')
+    const: Const
+    names: list[str]
+    node: Expr
+
+    def as_const(self, eval_ctx: EvalContext | None = None) -> Any:
+        eval_ctx = get_eval_context(self, eval_ctx)
+        guards = getattr(eval_ctx, 'const_fold_guards', None)
+        if guards is None:
+            raise Impossible()
+        guards.update(self.names)
+        return self.const.value
+
+
+def _charge_size(value: Any, eval_ctx: EvalContext) -> None:
+    """Count the size of a value computed while constant-folding against the folding budget
+
+    Raises Impossible once the budget is exhausted — so folding work is bounded
+    even where it's done by calls and filters, rather than the comprehension's loops.
+    """
+    try:
+        size = len(value)
+    except TypeError:
+        return
+    except OverflowError:
+        raise Impossible()
+
+    budget = eval_ctx.const_fold_budget
+    budget[0] -= size
+    if budget[0] < 0:
+        raise Impossible()
+
+
+def _bind_names(node: Any, names: set[str], scope: dict[str, Any]) -> Any:
+    """Copy an expression for constant-folding, binding loads of `names` to `scope`"""
+    if isinstance(node, Name):
+        if node.ctx == 'load' and node.name in names:
+            return Binding(node.name, scope, lineno=node.lineno)
+        return node
+
+    if isinstance(node, _BaseComprehension):
+        return node._bind_names(names, scope)
+
+    if (
+        isinstance(node, Call)
+        and isinstance(node.node, Name)
+        and node.node.name not in names
+        and node.dyn_args is None
+        and node.dyn_kwargs is None
+    ):
+        return PureCall(
+            node.node.name,
+            [_bind_names(arg, names, scope) for arg in node.args],
+            [_bind_names(kwarg, names, scope) for kwarg in node.kwargs],
+            lineno=node.lineno,
+        )
+
+    if not isinstance(node, Node):
+        return node
+
+    clone = copy.copy(node)
+    for field, value in node.iter_fields():
+        if isinstance(value, Node):
+            setattr(clone, field, _bind_names(value, names, scope))
+        elif isinstance(value, list):
+            setattr(clone, field, [_bind_names(item, names, scope) for item in value])
+    if isinstance(node, Filter):
+        return ChargedFilter(clone, lineno=node.lineno)
+    return clone
+
+
+def target_names(target: Node) -> set[str]:
+    """Return the names bound by an assignment target"""
+    if isinstance(target, Name):
+        return {target.name}
+    return {name.name for name in target.find_all(Name)}
+
+
+def _assign_target(target: Node, value: Any, scope: dict[str, Any]) -> None:
+    """Unpack a value into a comprehension target, as a Python for-loop would"""
+    if isinstance(target, Name):
+        scope[target.name] = value
+    elif isinstance(target, Tuple):
+        try:
+            values = tuple(value)
+        except Exception as e:
+            raise Impossible() from e
+        if len(values) != len(target.items):
+            raise Impossible()
+        for item, item_value in zip(target.items, values):
+            _assign_target(item, item_value, scope)
+    else:
+        raise Impossible()
+
+
+def clone_tree(node: Node, environment: Any) -> Node:
+    """Return a deep copy of a node tree, with every node bound to environment
+
+    This is much cheaper than `copy.deepcopy()`, as only nodes and the lists and
+    tuples holding them are copied — all other field values are shared.
+    """
+    clone = object.__new__(type(node))
+    for field in node.fields:
+        setattr(clone, field, _clone_value(getattr(node, field, None), environment))
+    for attr in node.attributes:
+        if attr != 'environment':
+            setattr(clone, attr, getattr(node, attr, None))
+    clone.environment = environment
+    return clone
+
+
+def _clone_value(value: Any, environment: Any) -> Any:
+    if isinstance(value, Node):
+        return clone_tree(value, environment)
+    elif isinstance(value, list):
+        return [_clone_value(item, environment) for item in value]
+    elif isinstance(value, tuple):
+        return tuple(_clone_value(item, environment) for item in value)
+    return value
@@ -0,0 +1,443 @@
+from __future__ import annotations
+
+import copy
+from typing import AbstractSet, Any
+
+import jinja2.filters
+import jinja2.tests
+from jinja2 import nodes as jinja_nodes
+from jinja2.environment import Environment
+from jinja2.visitor import NodeTransformer
+
+from jinja_comprehensions import nodes
+
+__all__ = [
+    'ComprehensionOptimizer',
+    'may_have_side_effects',
+    'optimize',
+]
+
+#: Filters which transform or filter each element, and which may be folded into
+#: the element expression and conditions of a comprehension
+_FUSABLE_FILTERS = frozenset({'select', 'reject', 'selectattr', 'rejectattr', 'map'})
+
+#: Filters which consume an iterable in a single pass, in order
+_CONSUMING_FILTERS = frozenset({
+    'list', 'sum', 'join', 'first', 'length', 'count', 'max', 'min',
+})
+
+#: Filters without async variants, which can't consume the async generators
+#: comprehensions become in async environments
+_SYNC_ONLY_FILTERS = frozenset({'max', 'min', 'unique'})
+
+#: Builtins which consume their first argument in a single pass, in order,
+#: without calling back into the template (unless given keyword arguments,
+#: like `key`)
+_CONSUMING_BUILTINS = frozenset({
+    'all', 'any', 'dict', 'frozenset', 'list', 'max', 'min', 'set', 'sorted', 'sum', 'tuple',
+})
+
+#: Stock filters whose results differ between calls with the same arguments
+_NONDETERMINISTIC_FILTERS = frozenset({'random'})
+
+#: Stock filters applying another filter or test to each element, by the index of
+#: the argument naming it
+_MAPPED_FILTER_ARGS = {'map': 0}
+_MAPPED_TEST_ARGS = {'select': 0, 'reject': 0, 'selectattr': 1, 'rejectattr': 1}
+
+#: Nodes whose evaluation may have arbitrary side-effects
+_IMPURE_NODES = (
+    jinja_nodes.Call,
+    jinja_nodes.ExprStmt,
+    jinja_nodes.NSRef,
+    jinja_nodes.CallBlock,
+    jinja_nodes.Block,
+    jinja_nodes.Include,
+    jinja_nodes.Import,
+    jinja_nodes.FromImport,
+    jinja_nodes.Extends,
+)
+
+
+def optimize(
+    node: jinja_nodes.Node,
+    environment: Environment,
+    assigned_names: AbstractSet[str] = frozenset(),
+) -> jinja_nodes.Node:
+    """Apply the comprehension optimizations to a template or expression
+
+    assigned_names are the names the template may assign to, which therefore
+    can't be assumed to refer to the environment's globals.
+    """
+    return ComprehensionOptimizer(environment, assigned_names).visit(node)
+
+
+class ComprehensionOptimizer(NodeTransformer):
+    """Rewrite comprehensions into cheaper, equivalent forms
+
+    Filter fusion: a list comprehension or generator expression passed through a
+    chain of Jinja's stock `select`, `reject`, `selectattr`, `rejectattr`, and
+    `map` filters — and finally consumed by `list`, `sum`, `join`, `first`, or
+    `length` — is rewritten into a single comprehension, with the filters' tests
+    folded into its conditions and mapped filters into its element expression.
+
+        {{ [x.price for x in items if x.active] | select('gt', 0) | map('round') | list }}
+
+    becomes the equivalent of
+
+        {{ [p | round for x in items if x.active for p in [x.price] if p is gt(0)] }}
+
+    The rewritten comprehension is only ever consumed within the same expression,
+    so making it lazy (where the original materialized a list) can't change which
+    variable bindings it observes.
+
+    List demotion: a list comprehension which is only iterated once, then
+    discarded, is emitted as a generator expression instead. This applies to
+    list comprehensions passed to consuming filters (as above, plus `max` and
+    `min`), to consuming builtins (`any`, `all`, `sum`, `max`, `min`, `sorted`,
+    etc. — in sync environments, and only if the name still refers to the
+    builtin at render time, rather than e.g. a variable of the context), used as
+    the iterable of another comprehension, or looped over by `{% for %}`. As the
+    generator is consumed lazily, demotion is skipped if anything evaluated
+    alongside it (e.g. the loop body) may have side-effects, as far as the
+    template shows: calls, namespace assignments, custom filters or tests, etc.
+
+    Membership containers: the right-hand side of `in` / `not in` tests within
+    comprehensions is marked with a `HashedContainer` node, which the code
+    generator evaluates once if it's loop-invariant, as a set where possible.
+    """
+
+    def __init__(
+        self, environment: Environment, assigned_names: AbstractSet[str] = frozenset()
+    ) -> None:
+        self.environment = environment
+        self.assigned_names = assigned_names
+        self._fresh_names = 0
+        self._comprehension_depth = 0
+
+    def visit_Filter(self, node: jinja_nodes.Filter) -> jinja_nodes.Node:
+        node = self.generic_visit(node)
+        return self._fuse_filters(node) or node
+
+    def visit_Call(self, node: jinja_nodes.Call) -> jinja_nodes.Node:
+        node = self.generic_visit(node)
+        if (
+            self.environment.is_async
+            or len(node.args) != 1
+            or not isinstance(node.args[0], nodes.ListComprehension)
+            or node.kwargs
+            or node.dyn_args is not None
+            or node.dyn_kwargs is not None
+            or not self._is_builtin_name(node.node, _CONSUMING_BUILTINS)
+        ):
+            return node
+
+        # The global (or a variable of the render context) may turn out to be
+        # anything else, so the builtin is only passed a generator if it's still
+        # bound to its name at render time.
+        node = copy.copy(node)
+        node.args = [nodes.SinglePassArgument(_demote(node.args[0]), node.node, lineno=node.lineno)]
+        return node
+
+    def visit_For(self, node: jinja_nodes.For) -> jinja_nodes.Node:
+        node = self.generic_visit(node)
+        if (
+            isinstance(node.iter, nodes.ListComprehension)
+            and not node.recursive
+            and not self._may_have_side_effects(node)
+        ):
+            node = copy.copy(node)
+            node.iter = _demote(node.iter)
+        return node
+
+    def visit_Compare(self, node: jinja_nodes.Compare) -> jinja_nodes.Node:
+        node = self.generic_visit(node)
+        if (
+            self._comprehension_depth
+            and len(node.ops) == 1
+            and node.ops[0].op in ('in', 'notin')
+            and not isinstance(node.ops[0].expr, nodes.HashedContainer)
+        ):
+            operand = node.ops[0]
+            container = nodes.HashedContainer(operand.expr, lineno=operand.lineno)
+            node = jinja_nodes.Compare(
+                node.expr,
+                [jinja_nodes.Operand(operand.op, container, lineno=operand.lineno)],
+                lineno=node.lineno,
+            )
+        return node
+
+    def _visit_comprehension(self, node: nodes._BaseComprehension) -> jinja_nodes.Node:
+        self._comprehension_depth += 1
+        try:
+            node = self.generic_visit(node)
+        finally:
+            self._comprehension_depth -= 1
+
+        if not any(
+            isinstance(component.iter, nodes.ListComprehension)
+            for component in node.for_components
+        ) or self._may_have_side_effects(node):
+            return node
+
+        node = copy.copy(node)
+        node.for_components = [
+            nodes.ComprehensionComponent(
+                component.target,
+                _demote(component.iter),
+                component.cond,
+                lineno=component.lineno,
+            )
+            if isinstance(component.iter, nodes.ListComprehension)
+            else component
+            for component in node.for_components
+        ]
+        return node
+
+    visit_Generator = _visit_comprehension
+    visit_ListComprehension = _visit_comprehension
+    visit_SetComprehension = _visit_comprehension
+    visit_DictComprehension = _visit_comprehension
+
+    def _fuse_filters(self, node: jinja_nodes.Filter) -> jinja_nodes.Expr | None:
+        if node.name not in _CONSUMING_FILTERS or not self._is_plain_stock_filter(node):
+            return None
+        if self.environment.is_async and node.name in _SYNC_ONLY_FILTERS:
+            return None
+
+        inner = node.node
+        unique = None
+        if isinstance(inner, jinja_nodes.Filter) and inner.name == 'unique':
+            if self.environment.is_async or not self._is_plain_stock_filter(inner):
+                return None
+            unique, inner = inner, inner.node
+
+        chain = []
+        while isinstance(inner, jinja_nodes.Filter) and inner.name in _FUSABLE_FILTERS:
+            if not self._is_plain_stock_filter(inner):
+                return None
+            chain.append(inner)
+            inner = inner.node
+
+        if not isinstance(inner, (nodes.ListComprehension, nodes.Generator)):
+            return None
+        # Fused filters are applied to each element as it's produced, rather than
+        # after the whole list was built, and the demoted comprehension may not be
+        # consumed in full (e.g. by `first`) — changing which side-effects occur,
+        # and in what order
+        if self._may_have_side_effects(node):
+            return None
+
+        chain.reverse()
+        expr, components = inner.expr, list(inner.for_components)
+        while chain:
+            fused = self._fuse_filter(chain[0], expr, components)
+            if fused is None:
+                break
+            expr, components = fused
+            chain.pop(0)
+
+        lineno = node.lineno
+        if node.name == 'list' and not chain and unique is None:
+            return nodes.ListComprehension(components, expr, lineno=lineno)
+
+        if node.name in ('length', 'count'):
+            if chain or unique is not None or not self._is_stock_filter('sum'):
+                return None
+            # Count the elements, rather than collecting them
+            if not isinstance(expr, (jinja_nodes.Name, jinja_nodes.Const)):
+                expr, components = self._bind_element(expr, components)
+            counter = nodes.Generator(components, jinja_nodes.Const(1), lineno=lineno)
+            return jinja_nodes.Filter(counter, 'sum', [], [], None, None, lineno=lineno)
+
+        iterable: jinja_nodes.Expr = nodes.Generator(components, expr, lineno=lineno)
+        for filter_node in (*chain, unique, node):
+            if filter_node is not None:
+                filter_node = copy.copy(filter_node)
+                filter_node.node = iterable
+                iterable = filter_node
+        return iterable
+
+    def _fuse_filter(
+        self,
+        node: jinja_nodes.Filter,
+        expr: jinja_nodes.Expr,
+        components: list[nodes.ComprehensionComponent],
+    ) -> tuple[jinja_nodes.Expr, list[nodes.ComprehensionComponent]] | None:
+        """Fold a single filter into a comprehension's element expression and conditions
+
+        Returns None if the filter's arguments aren't suited to fusion.
+        """
+        args = list(node.args)
+        lineno = node.lineno
+
+        if node.name == 'map':
+            if args:
+                name = _const_str(args[0])
+                if name is None or name not in self.environment.filters:
+                    return None
+                return jinja_nodes.Filter(
+                    expr, name, args[1:], node.kwargs, None, None, lineno=lineno,
+                ), components
+
+            if [kwarg.key for kwarg in node.kwargs] != ['attribute']:
+                return None
+            getter = self._attribute_getter(expr, node.kwargs[0].value)
+            if getter is None:
+                return None
+            return getter, components
+
+        expr_binding = expr
+        if not isinstance(expr, (jinja_nodes.Name, jinja_nodes.Const)):
+            expr_binding, components = self._bind_element(expr, components)
+
+        subject = expr_binding
+        if node.name in ('selectattr', 'rejectattr'):
+            if not args:
+                return None
+            subject = self._attribute_getter(expr_binding, args.pop(0))
+            if subject is None:
+                return None
+
+        if args:
+            test_name = _const_str(args[0])
+            if test_name is None or test_name not in self.environment.tests:
+                return None
+            cond = jinja_nodes.Test(
+                subject, test_name, args[1:], node.kwargs, None, None, lineno=lineno,
+            )
+        elif node.kwargs:
+            return None
+        else:
+            cond = subject
+
+        if node.name in ('reject', 'rejectattr'):
+            cond = jinja_nodes.Not(cond, lineno=lineno)
+
+        last = components[-1]
+        if last.cond is not None:
+            cond = jinja_nodes.And(last.cond, cond, lineno=lineno)
+        components = components[:-1] + [
+            nodes.ComprehensionComponent(last.target, last.iter, cond, lineno=last.lineno),
+        ]
+        return expr_binding, components
+
+    def _bind_element(
+        self,
+        expr: jinja_nodes.Expr,
+        components: list[nodes.ComprehensionComponent],
+    ) -> tuple[jinja_nodes.Name, list[nodes.ComprehensionComponent]]:
+        """Bind a comprehension's element to a fresh name, so it's evaluated only once"""
+        self._fresh_names += 1
+        name = f'__fused{self._fresh_names}'
+        binding = nodes.ComprehensionComponent(
+            jinja_nodes.Name(name, 'store', lineno=expr.lineno),
+            nodes.List([expr], lineno=expr.lineno),
+            None,
+            lineno=expr.lineno,
+        )
+        return jinja_nodes.Name(name, 'load', lineno=expr.lineno), [*components, binding]
+
+    @staticmethod
+    def _attribute_getter(
+        expr: jinja_nodes.Expr, attribute: jinja_nodes.Expr
+    ) -> jinja_nodes.Expr | None:
+        """Return the equivalent of Jinja's `make_attrgetter()` applied to expr"""
+        if not isinstance(attribute, jinja_nodes.Const):
+            return None
+        if not isinstance(attribute.value, (str, int)) or isinstance(attribute.value, bool):
+            return None
+
+        for part in jinja2.filters._prepare_attribute_parts(attribute.value):
+            expr = jinja_nodes.Getitem(expr, jinja_nodes.Const(part), 'load', lineno=expr.lineno)
+        return expr
+
+    def _is_plain_stock_filter(self, node: jinja_nodes.Filter) -> bool:
+        return (
+            node.node is not None
+            and node.dyn_args is None
+            and node.dyn_kwargs is None
+            and self._is_stock_filter(node.name)
+        )
+
+    def _is_stock_filter(self, name: str) -> bool:
+        return _is_stock_filter(self.environment, name)
+
+    def _is_builtin_name(self, node: jinja_nodes.Node, names: AbstractSet[str]) -> bool:
+        """Whether node loads one of the names, which the template never assigns to
+
+        Whether it refers to the builtin of the same name is only known at render time.
+        """
+        return (
+            isinstance(node, jinja_nodes.Name)
+            and node.ctx == 'load'
+            and node.name in names
+            and node.name not in self.assigned_names
+        )
+
+    def _may_have_side_effects(self, node: jinja_nodes.Node) -> bool:
+        return may_have_side_effects(node, self.environment)
+
+
+def may_have_side_effects(node: jinja_nodes.Node, environment: Environment) -> bool:
+    """Whether evaluating node might have side-effects, as far as the template shows
+
+    Non-deterministic stock filters (i.e. `random`) count as having side-effects,
+    as evaluating them once in place of many would change the result. So do
+    filters and tests applied by `map`, `select`, etc. which aren't Jinja's own,
+    or aren't named by a constant.
+    """
+    for child in (node, *node.find_all(jinja_nodes.Node)):
+        if isinstance(child, _IMPURE_NODES):
+            return True
+        if isinstance(child, jinja_nodes.Filter):
+            if child.name in _NONDETERMINISTIC_FILTERS or not _is_stock_filter(environment, child.name):
+                return True
+            if child.name in _MAPPED_FILTER_ARGS:
+                name = _mapped_name(child, _MAPPED_FILTER_ARGS[child.name])
+                if name is not False and (
+                    name is None
+                    or name in _NONDETERMINISTIC_FILTERS
+                    or not _is_stock_filter(environment, name)
+                ):
+                    return True
+            if child.name in _MAPPED_TEST_ARGS:
+                name = _mapped_name(child, _MAPPED_TEST_ARGS[child.name])
+                if name is not False and (name is None or not _is_stock_test(environment, name)):
+                    return True
+        if isinstance(child, jinja_nodes.Test) and not _is_stock_test(environment, child.name):
+            return True
+    return False
+
+
+def _mapped_name(node: jinja_nodes.Filter, index: int) -> str | None | bool:
+    """Return the name of the filter or test applied by `map`, `select`, etc.
+
+    Returns None if it's not named by a constant, or False if none is (e.g. for
+    `map(attribute=...)`, or `select` testing truthiness).
+    """
+    if node.dyn_args is not None:
+        return None
+    if len(node.args) <= index:
+        return False
+    return _const_str(node.args[index])
+
+
+def _is_stock_filter(environment: Environment, name: str) -> bool:
+    stock = jinja2.filters.FILTERS.get(name)
+    return stock is not None and environment.filters.get(name) is stock
+
+
+def _is_stock_test(environment: Environment, name: str) -> bool:
+    stock = jinja2.tests.TESTS.get(name)
+    return stock is not None and environment.tests.get(name) is stock
+
+
+def _demote(node: nodes.ListComprehension) -> nodes.Generator:
+    return nodes.Generator(node.for_components, node.expr, lineno=node.lineno)
+
+
+def _const_str(node: Any) -> str | None:
+    if isinstance(node, jinja_nodes.Const) and isinstance(node.value, str):
+        return node.value
+    return None
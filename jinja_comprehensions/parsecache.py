@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+from hashlib import sha1
+from typing import Hashable, Type
+
+import jinja2
+from jinja2.parser import Parser
+from jinja2.utils import LRUCache
+
+from jinja_comprehensions.nodes import clone_tree
+
+__all__ = [
+    'ParseTreeCache',
+    'get_lexer_config',
+    'shared_parse_tree_cache',
+]
+
+
+def get_lexer_config(environment: jinja2.Environment) -> tuple[Hashable, ...]:
+    """Return everything about an environment which affects how its templates parse
+
+    This mirrors the key of Jinja's own lexer cache, plus the loaded extensions
+    (which may add tags, and preprocess or filter the token stream).
+    """
+    return (
+        environment.block_start_string,
+        environment.block_end_string,
+        environment.variable_start_string,
+        environment.variable_end_string,
+        environment.comment_start_string,
+        environment.comment_end_string,
+        environment.line_statement_prefix,
+        environment.line_comment_prefix,
+        environment.trim_blocks,
+        environment.lstrip_blocks,
+        environment.newline_sequence,
+        environment.keep_trailing_newline,
+        tuple(sorted(environment.extensions)),
+    )
+
+
+class ParseTreeCache:
+    """Bounded cache of parsed templates, which may be shared between environments
+
+    Trees are keyed by (source hash, lexer config, parser class), so environments
+    which parse identically — e.g. string and native variants, sync and async —
+    share a single parse of each source. Every environment receives its own copy
+    of the cached tree, which it's free to optimize and compile.
+
+    Environments opt in through their `parse_tree_cache` attribute:
+
+    >>> env = NativeComprehensionEnvironment()
+    >>> env.parse_tree_cache = shared_parse_tree_cache
+    """
+
+    def __init__(self, capacity: int = 1000) -> None:
+        self._trees = LRUCache(capacity)
+        self.hits = 0
+        self.misses = 0
+
+    def parse(
+        self,
+        environment: jinja2.Environment,
+        source: str,
+        name: str | None,
+        filename: str | None,
+        parser_class: Type[Parser],
+    ) -> jinja2.nodes.Template:
+        """Return the tree for source, parsing it with parser_class on a miss"""
+        key = (
+            sha1(source.encode('utf-8')).digest(),
+            get_lexer_config(environment),
+            parser_class,
+        )
+
+        tree = self._trees.get(key)
+        if tree is None:
+            self.misses += 1
+            tree = parser_class(environment, source, name, filename).parse()
+            # Cached trees mustn't keep their environment alive
+            self._trees[key] = clone_tree(tree, None)
+            return tree
+
+        self.hits += 1
+        return clone_tree(tree, environment)
+
+    def clear(self) -> None:
+        self._trees.clear()
+        self.hits = self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._trees)
+
+    def __repr__(self) -> str:
+        return f'<{type(self).__name__} {len(self)} trees, {self.hits} hits, {self.misses} misses>'
+
+
+#: Process-wide cache, for environments to opt into sharing parse trees
+shared_parse_tree_cache = ParseTreeCache()
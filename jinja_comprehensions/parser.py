@@ -112,9 +112,11 @@ class ComprehensionParser(Parser):
 
             if (is_set is None or is_set is False) and self.stream.skip_if("pow"):
                 items.append(nodes.SpreadPairs(self.parse_expression(), lineno=token.lineno))
+                is_set = False
                 continue
             elif (is_set is None or is_set is True) and self.stream.current.type == "mul":
                 items.append(self._parse_spread_scalars())
+                is_set = True
                 continue
 
             key = self.parse_expression()
@@ -156,7 +158,7 @@ class ComprehensionParser(Parser):
             cond = None
             if self.stream.skip_if('name:if'):
                 cond = self.parse_expression()
-            for_components.append(nodes.ComprehensionComponent(target, iter, cond))
+            for_components.append(nodes.ComprehensionComponent(target, iter, cond, lineno=target.lineno))
 
             if not self.stream.skip_if('name:for'):
                 break
@@ -164,7 +166,7 @@ class ComprehensionParser(Parser):
         if eat_end:
             self.stream.expect(end_type)
 
-        return node_cls(for_components, iterand)
+        return node_cls(for_components, iterand, lineno=iterand.lineno)
 
     def parse_call_args(self) -> t.Tuple:
         token = self.stream.expect("lparen")
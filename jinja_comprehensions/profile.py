@@ -0,0 +1,146 @@
+"""Time each stage of compiling templates with a comprehension environment
+
+Usage:
+
+    python -m jinja_comprehensions.profile templates/                  # every file beneath templates/
+    python -m jinja_comprehensions.profile -e native --async a.j2 b.j2
+    python -m jinja_comprehensions.profile --glob '*.j2' --top 20 templates/
+    python -m jinja_comprehensions.profile --emit-source build/py templates/
+
+Prints the time spent lexing, parsing, optimizing, generating code, and compiling
+Python, in total and for the heaviest templates. With --emit-source, the generated
+Python source of each template is written to a directory (as <template>.py), or to
+stdout if the directory is "-".
+
+Exits with status 1 if any template failed to compile.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+import sys
+from pathlib import Path
+from typing import Iterator, Sequence
+
+import jinja2
+
+from jinja_comprehensions.environment import ComprehensionEnvironment
+from jinja_comprehensions.nativetypes import (
+    NativeComprehensionEnvironment,
+    NoLiteralEvalComprehensionNativeEnvironment,
+)
+from jinja_comprehensions.profiling import CompileProfiler
+from jinja_comprehensions.sandbox import (
+    SandboxedComprehensionEnvironment,
+    SandboxedNativeComprehensionEnvironment,
+)
+
+__all__ = ['main']
+
+ENV_CLASSES: dict[str, type[ComprehensionEnvironment]] = {
+    'normal': ComprehensionEnvironment,
+    'native': NativeComprehensionEnvironment,
+    'native-no_literal_eval': NoLiteralEvalComprehensionNativeEnvironment,
+    'sandboxed': SandboxedComprehensionEnvironment,
+    'sandboxed-native': SandboxedNativeComprehensionEnvironment,
+}
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m jinja_comprehensions.profile',
+        description='Time each stage of compiling templates',
+    )
+    parser.add_argument('paths', nargs='+', type=Path, help='template files, or directories to search')
+    parser.add_argument(
+        '-e', '--env', default='normal',
+        help=f'environment class: one of {", ".join(ENV_CLASSES)}, or an import path '
+             f'like "package.module:ClassName" (default: normal)',
+    )
+    parser.add_argument('--async', dest='is_async', action='store_true', help='enable async mode')
+    parser.add_argument('--glob', default='*', help='pattern of template files within directories (default: *)')
+    parser.add_argument('-n', '--top', type=int, default=10, help='number of heaviest templates to list')
+    parser.add_argument(
+        '--emit-source', metavar='DIR',
+        help='write the generated Python source of each template to DIR, or to stdout if "-"',
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        env_class = _resolve_env_class(args.env)
+    except (ImportError, AttributeError, ValueError) as e:
+        parser.error(f'unknown environment class {args.env!r}: {e}')
+
+    environment = env_class(enable_async=args.is_async)
+    profiler = environment.compile_profiler = CompileProfiler()
+
+    failed = 0
+    for name, path in _find_templates(args.paths, args.glob):
+        try:
+            source = path.read_text(encoding='utf-8')
+            environment.compile(source, name, str(path))
+        except (OSError, UnicodeDecodeError, jinja2.TemplateSyntaxError) as e:
+            failed += 1
+            print(f'{name}: {type(e).__name__}: {e}', file=sys.stderr)
+            continue
+
+        if args.emit_source is not None:
+            _emit_source(environment, source, name, str(path), args.emit_source)
+
+    print(f'Environment: {env_class.__module__}.{env_class.__qualname__}'
+          f'{" (async)" if args.is_async else ""}')
+    print(profiler.report(args.top))
+    if failed:
+        print(f'\n{failed} templates failed to compile', file=sys.stderr)
+    return 1 if failed else 0
+
+
+def _resolve_env_class(name: str) -> type[ComprehensionEnvironment]:
+    if name in ENV_CLASSES:
+        return ENV_CLASSES[name]
+
+    module_name, sep, qualname = name.partition(':')
+    if not sep:
+        module_name, _, qualname = name.rpartition('.')
+    if not module_name or not qualname:
+        raise ValueError(f'expected one of {", ".join(ENV_CLASSES)}, or an import path')
+
+    obj = importlib.import_module(module_name)
+    for attr in qualname.split('.'):
+        obj = getattr(obj, attr)
+    if not (isinstance(obj, type) and issubclass(obj, ComprehensionEnvironment)):
+        raise ValueError('not a ComprehensionEnvironment subclass')
+    return obj
+
+
+def _find_templates(paths: Sequence[Path], pattern: str) -> Iterator[tuple[str, Path]]:
+    """Yield (template name, path) of each file, and each file matching pattern beneath each directory"""
+    for path in paths:
+        if path.is_dir():
+            for child in sorted(path.rglob(pattern)):
+                if child.is_file():
+                    yield child.relative_to(path).as_posix(), child
+        else:
+            yield path.as_posix(), path
+
+
+def _emit_source(
+    environment: ComprehensionEnvironment, source: str, name: str, filename: str, directory: str
+) -> None:
+    # Compiling again, just for the source, mustn't skew the timings
+    profiler, environment.compile_profiler = environment.compile_profiler, None
+    try:
+        code = environment.compile(source, name, filename, raw=True)
+    finally:
+        environment.compile_profiler = profiler
+
+    if directory == '-':
+        print(f'# {name}\n{code}\n')
+    else:
+        out_path = Path(directory, f'{name}.py')
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        out_path.write_text(code, encoding='utf-8')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
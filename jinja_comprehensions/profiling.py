@@ -0,0 +1,327 @@
+from __future__ import annotations
+
+import sys
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Any, AsyncIterator, Iterable, Iterator, Mapping, TextIO
+
+__all__ = [
+    'CompileProfiler',
+    'ComprehensionProfiler',
+    'ComprehensionSite',
+    'TemplateCompileStats',
+]
+
+
+class ComprehensionSite:
+    """Runtime stats of a single comprehension, generator expression, or spread in a template
+
+    Instrumented templates call into the site as they run:
+
+     - `calls`: number of times the comprehension was evaluated
+     - `iterated`: number of elements iterated, per for-clause
+     - `filtered`: number of elements rejected by the condition, per for-clause
+     - `time`: cumulative seconds spent evaluating it — for generator expressions,
+       only the time spent producing elements (not that of their consumers), and
+       for spreads, the time spent iterating the spread value.
+    """
+    __slots__ = ('template', 'lineno', 'kind', 'ordinal', 'calls', 'iterated', 'filtered', 'time')
+
+    def __init__(self, template: str | None, lineno: int, kind: str, ordinal: int, clauses: int) -> None:
+        self.template = template
+        self.lineno = lineno
+        self.kind = kind
+        self.ordinal = ordinal
+        self.calls = 0
+        self.iterated = [0] * clauses
+        self.filtered = [0] * clauses
+        self.time = 0.0
+
+    def __repr__(self) -> str:
+        return f'<{type(self).__name__} {self.location} {self.kind}>'
+
+    @property
+    def location(self) -> str:
+        return f'{self.template or "<template>"}:{self.lineno}'
+
+    def reset(self) -> None:
+        self.calls = 0
+        self.iterated = [0] * len(self.iterated)
+        self.filtered = [0] * len(self.filtered)
+        self.time = 0.0
+
+    ###
+    # Instrumentation hooks, called by compiled templates
+    #
+
+    def start(self) -> float:
+        self.calls += 1
+        return perf_counter()
+
+    def finish(self, start: float, value: Any) -> Any:
+        self.time += perf_counter() - start
+        return value
+
+    def iterate(self, clause: int, iterable: Iterable[Any]) -> Iterator[Any]:
+        iterated = self.iterated
+        for value in iterable:
+            iterated[clause] += 1
+            yield value
+
+    def test(self, clause: int, value: Any) -> bool:
+        if value:
+            return True
+        self.filtered[clause] += 1
+        return False
+
+    def generator(self, generator: Any) -> Any:
+        self.calls += 1
+        if hasattr(generator, '__anext__'):
+            return self._time_async_generator(generator)
+        return self._time_generator(generator)
+
+    def _time_generator(self, generator: Iterator[Any]) -> Iterator[Any]:
+        while True:
+            start = perf_counter()
+            try:
+                value = next(generator)
+            except StopIteration:
+                return
+            finally:
+                self.time += perf_counter() - start
+            yield value
+
+    async def _time_async_generator(self, generator: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        while True:
+            start = perf_counter()
+            try:
+                value = await generator.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                self.time += perf_counter() - start
+            yield value
+
+    def spread(self, iterable: Iterable[Any]) -> list[Any]:
+        start = self.start()
+        values = list(iterable)
+        self.iterated[0] += len(values)
+        return self.finish(start, values)
+
+    def spread_pairs(self, mapping: Mapping[Any, Any]) -> Mapping[Any, Any]:
+        self.calls += 1
+        try:
+            self.iterated[0] += len(mapping)
+        except TypeError:
+            pass
+        return mapping
+
+
+class ComprehensionProfiler:
+    """Collects per-comprehension stats from templates compiled with it
+
+    Assign a profiler to an environment's `comprehension_profiler` attribute to
+    have the templates it compiles from then on instrumented. Templates compiled
+    without one carry no instrumentation at all.
+
+    >>> env = ComprehensionEnvironment()
+    >>> env.comprehension_profiler = profiler = ComprehensionProfiler()
+    >>> env.from_string('{{ [n for n in range(k) if n % 2] }}').render(k=10)
+    '[1, 3, 5, 7, 9]'
+    >>> print(profiler.report())  # doctest: +SKIP
+    """
+
+    #: Keys by which `get_stats()` and `report()` may sort sites, in descending order
+    SORT_KEYS = ('time', 'calls', 'iterated', 'filtered')
+
+    def __init__(self) -> None:
+        self._sites: dict[tuple[str | None, int, str, int], ComprehensionSite] = {}
+
+    def site(self, template: str | None, lineno: int, kind: str, ordinal: int, clauses: int) -> ComprehensionSite:
+        """Return the stats of a comprehension site, creating them if needed
+
+        Called once per site when an instrumented template is loaded. Sites are
+        keyed by template name, line, kind, and ordinal (the number of sites
+        preceding it in the template), so recompiling a template accumulates into
+        the same stats.
+        """
+        key = (template, lineno, kind, ordinal)
+        site = self._sites.get(key)
+        if site is None:
+            site = self._sites[key] = ComprehensionSite(template, lineno, kind, ordinal, clauses)
+        return site
+
+    def get_stats(self, sort: str = 'time') -> list[ComprehensionSite]:
+        """Return the stats of every site which has been evaluated, the heaviest first"""
+        if sort not in self.SORT_KEYS:
+            raise ValueError(f'sort must be one of {", ".join(self.SORT_KEYS)}')
+
+        def sort_key(site: ComprehensionSite) -> Any:
+            value = getattr(site, sort)
+            return sum(value) if isinstance(value, list) else value
+
+        sites = [site for site in self._sites.values() if site.calls]
+        return sorted(sites, key=sort_key, reverse=True)
+
+    def reset(self) -> None:
+        for site in self._sites.values():
+            site.reset()
+
+    def report(self, sort: str = 'time', limit: int | None = None) -> str:
+        """Return a table of stats per site, sorted by the given key (descending)
+
+        Iterated and filtered counts are listed per for-clause, separated by `/`.
+        """
+        rows = [('calls', 'time (s)', 'iterated', 'filtered', 'site')]
+        for site in self.get_stats(sort)[:limit]:
+            rows.append((
+                str(site.calls),
+                f'{site.time:.6f}',
+                '/'.join(map(str, site.iterated)),
+                '/'.join(map(str, site.filtered)) if site.kind not in _SPREADS else '-',
+                f'{site.location} {site.kind}',
+            ))
+        return _format_table(rows, left_columns=0)
+
+    def dump(self, file: TextIO | None = None, sort: str = 'time', limit: int | None = None) -> None:
+        """Write `report()` to a file (stdout, by default)"""
+        print(self.report(sort, limit), file=file or sys.stdout)
+
+
+_SPREADS = ('spread', 'spread-pairs')
+
+
+class TemplateCompileStats:
+    """Seconds spent in each stage of compiling a single template"""
+    __slots__ = ('name', 'stages', 'source_size')
+
+    def __init__(self, name: str | None) -> None:
+        self.name = name
+        self.stages = dict.fromkeys(CompileProfiler.STAGES, 0.0)
+        #: Length of the generated Python source
+        self.source_size = 0
+
+    def __repr__(self) -> str:
+        return f'<{type(self).__name__} {self.name or "<template>"} {self.total:.6f}s>'
+
+    @property
+    def total(self) -> float:
+        return sum(self.stages.values())
+
+
+class CompileProfiler:
+    """Times each stage of compiling templates, per template
+
+    Assign a profiler to a comprehension environment's `compile_profiler` attribute
+    to have every `compile()` from then on (including those of `get_template()`
+    and `from_string()`) recorded as a `TemplateCompileStats`. Stages are:
+
+     - `lex`: tokenizing the source (including preprocessing and extension stream filters)
+     - `parse`: building the parse tree from tokens
+     - `optimize`: rewriting the tree (constant-folding, filter fusion, etc.)
+     - `codegen`: generating Python source, through the environment's code generator
+     - `compile`: compiling the Python source with `compile()`
+
+    While profiling, tokens are collected before parsing begins, rather than as the
+    parser consumes them, so lexing and parsing may be timed apart.
+
+    Templates loaded from a bytecode cache, or fetched from a parse tree cache, skip
+    some stages, which are recorded as taking no time.
+    """
+
+    STAGES = ('lex', 'parse', 'optimize', 'codegen', 'compile')
+
+    def __init__(self) -> None:
+        self.records: list[TemplateCompileStats] = []
+        self._local = threading.local()
+
+    @contextmanager
+    def record(self, name: str | None) -> Iterator[TemplateCompileStats]:
+        """Attribute the stages timed within the block to a new record of the named template"""
+        record = TemplateCompileStats(name)
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(record)
+        try:
+            yield record
+        finally:
+            stack.pop()
+        self.records.append(record)
+
+    @property
+    def current(self) -> TemplateCompileStats | None:
+        """The record of the template being compiled in this thread, if any"""
+        stack = self._local.__dict__.get('stack')
+        return stack[-1] if stack else None
+
+    def add(self, stage: str, seconds: float) -> None:
+        record = self.current
+        if record is not None:
+            record.stages[stage] += seconds
+
+    def reset(self) -> None:
+        self.records.clear()
+
+    def totals(self) -> dict[str, float]:
+        """Return the seconds spent in each stage, across all templates"""
+        totals = dict.fromkeys(self.STAGES, 0.0)
+        for record in self.records:
+            for stage, seconds in record.stages.items():
+                totals[stage] += seconds
+        return totals
+
+    def heaviest(self, limit: int | None = None) -> list[TemplateCompileStats]:
+        """Return the records taking the longest to compile, the heaviest first"""
+        return sorted(self.records, key=lambda record: record.total, reverse=True)[:limit]
+
+    def report(self, limit: int | None = 10) -> str:
+        """Return tables of time per stage, and of the `limit` heaviest templates"""
+        totals = self.totals()
+        grand_total = sum(totals.values())
+        count = len(self.records)
+        source_size = sum(record.source_size for record in self.records)
+
+        stage_rows = [('stage', 'total (s)', 'mean (ms)', 'share')]
+        for stage, seconds in totals.items():
+            stage_rows.append((
+                stage,
+                f'{seconds:.6f}',
+                f'{seconds / count * 1000:.3f}' if count else '-',
+                f'{seconds / grand_total:.1%}' if grand_total else '-',
+            ))
+        stage_rows.append(('total', f'{grand_total:.6f}', f'{grand_total / count * 1000:.3f}' if count else '-', ''))
+
+        template_rows = [('total (ms)', *self.STAGES, 'source', 'template')]
+        for record in self.heaviest(limit):
+            template_rows.append((
+                f'{record.total * 1000:.3f}',
+                *(f'{record.stages[stage] * 1000:.3f}' for stage in self.STAGES),
+                str(record.source_size),
+                record.name or '<template>',
+            ))
+
+        return '\n'.join([
+            f'{count} templates compiled, {source_size} chars of Python generated',
+            '',
+            _format_table(stage_rows, left_columns=1),
+            '',
+            'Heaviest templates (ms):',
+            _format_table(template_rows, left_columns=0),
+        ])
+
+    def dump(self, file: TextIO | None = None, limit: int | None = 10) -> None:
+        """Write `report()` to a file (stdout, by default)"""
+        print(self.report(limit), file=file or sys.stdout)
+
+
+def _format_table(rows: list[tuple[str, ...]], left_columns: int) -> str:
+    """Align rows into columns, left-justifying the first left_columns, and the last"""
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]) - 1)]
+    lines = []
+    for row in rows:
+        cells = [
+            cell.ljust(width) if i < left_columns else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(row, widths))
+        ]
+        lines.append('  '.join([*cells, row[-1]]).rstrip())
+    return '\n'.join(lines)
@@ -1,19 +1,487 @@
 from __future__ import annotations
 
-from typing import Any, AsyncIterable, Awaitable
+import builtins
+import sys
+from collections import Counter
+from collections.abc import AsyncIterator as AsyncIteratorABC, Iterator as IteratorABC
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable
 
-import asyncstdlib
 from jinja2 import Undefined
+from markupsafe import Markup
+
+###
+# Kinds of values, as far as sync-flattening is concerned
+#
+PLAIN = 'plain'
+SYNC = 'sync'
+UNDEFINED = 'undefined'
+ASYNC_ITERABLE = 'async_iterable'
+AWAITABLE = 'awaitable'
+
+_PLAIN_TYPES = (str, int, float, bool, type(None), list, tuple, dict, set, frozenset, Markup)
+
+#: Max number of types whose kind is remembered, before the cache is reset
+_MAX_CACHED_TYPES = 1024
+
+_missing = object()
+
+_kinds_by_type: dict[type, str] = dict.fromkeys(_PLAIN_TYPES, PLAIN)
+_syncify_stats: Counter[str] = Counter()
+
+
+def get_syncify_stats() -> dict[str, int]:
+    """Return the number of values sync-flattened, per kind of value
+
+    Kinds are: `plain` (builtin types taking the fast path), `sync` (other
+    non-async values), `undefined`, `async_iterable`, and `awaitable`.
+    """
+    return dict(_syncify_stats)
+
+
+def reset_syncify_stats() -> None:
+    _syncify_stats.clear()
+
+
+def _classify_type(cls: type) -> str:
+    # NOTE: we only ever inspect the type, never the value itself. Attr access
+    #       on an Undefined (including __class__, as done by isinstance() with
+    #       ABCs) may raise an UndefinedError.
+    if issubclass(cls, Undefined):
+        kind = UNDEFINED
+    elif issubclass(cls, AsyncIterable):
+        kind = ASYNC_ITERABLE
+    elif issubclass(cls, Awaitable):
+        kind = AWAITABLE
+    else:
+        kind = SYNC
+
+    if len(_kinds_by_type) >= _MAX_CACHED_TYPES:
+        _kinds_by_type.clear()
+        _kinds_by_type.update(dict.fromkeys(_PLAIN_TYPES, PLAIN))
+
+    _kinds_by_type[cls] = kind
+    return kind
+
+
+def _kind_of_type(cls: type) -> str:
+    return _kinds_by_type.get(cls) or _classify_type(cls)
+
+
+def _classify(v: Any) -> str:
+    kind = _kind_of_type(type(v))
+    _syncify_stats[kind] += 1
+    return kind
+
+
+async def _alist(iterable: AsyncIterable[Any]) -> list[Any]:
+    # asyncio and asyncstdlib are only imported once something is awaited, so
+    # processes which never render asynchronously don't pay for importing them.
+    import asyncstdlib
+    return await asyncstdlib.list(iterable)
+
+
+async def _syncify(v: Any, kind: str) -> Any:
+    if kind is ASYNC_ITERABLE:
+        return await _alist(v)
+    elif kind is AWAITABLE:
+        return await v
+    else:
+        return v
 
 
 async def syncify_awaitable(v: Any | Awaitable[Any] | AsyncIterable[Any]) -> Any:
-    if isinstance(v, Undefined):
-        # Deliberately avoid calling isinstance() on an Undefined,
-        # as attr access of __class__ may raise an UndefinedError.
-        pass
-    elif isinstance(v, AsyncIterable):
-        v = await asyncstdlib.list(v)
-    elif isinstance(v, Awaitable):
+    kind = _classify(v)
+    if kind is ASYNC_ITERABLE:
+        v = await _alist(v)
+    elif kind is AWAITABLE:
         v = await v
 
     return v
+
+
+async def auto_achunks(iterable: Iterable[Any] | AsyncIterable[Any]) -> AsyncIterator[Iterable[Any]]:
+    """Yield the elements of an iterable in chunks, to be consumed by a sync for-loop
+
+    A sync iterable is yielded whole, as a single chunk, so it may be iterated
+    without any async machinery. An async iterable's elements are each yielded in
+    a chunk of their own, to retain laziness.
+    """
+    if hasattr(iterable, '__aiter__'):
+        async for v in iterable:  # type: ignore
+            yield (v,)
+    else:
+        yield iterable  # type: ignore
+
+
+async def async_contains(item: Any, container: Any) -> bool:
+    """Return whether item is in container, where container may be awaitable or async
+
+    Async iterables are only consumed until a match is found, and are closed afterward.
+    Any other container uses its own `__contains__`.
+    """
+    kind = _classify(container)
+    if kind is AWAITABLE:
+        container = await container
+        kind = _classify(container)
+
+    if kind is not ASYNC_ITERABLE:
+        return item in container
+
+    iterator = container.__aiter__()
+    try:
+        async for value in iterator:
+            if value is item or value == item:
+                return True
+        return False
+    finally:
+        aclose = getattr(iterator, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+
+
+def single_pass_argument(callee: Any, name: str, generator: Iterable[Any]) -> Iterable[Any]:
+    """Return generator if callee is the builtin of the given name, or a list of its elements otherwise
+
+    Demoted list comprehensions are passed through this to consuming builtins
+    (e.g. `any`), whose names may be bound to anything else at render time.
+    """
+    if callee is getattr(builtins, name):
+        return generator
+    return list(generator)
+
+
+class Invariant:
+    """A loop-invariant value within a comprehension, evaluated on first use
+
+    The compiler creates one of these per comprehension evaluation (or per
+    iteration of the outermost loop the value depends on), and emits each use of
+    the value as `(inv.value if inv.ready else inv.set(<expr>))` — so the value
+    is computed at most once, and never if it's never used.
+    """
+    __slots__ = ('ready', 'value')
+
+    def __init__(self) -> None:
+        self.ready = False
+
+    def set(self, value: Any) -> Any:
+        self.value = value
+        self.ready = True
+        return value
+
+
+class HashedMembership(frozenset):
+    """A frozenset standing in for a sequence, in membership tests
+
+    Membership tests for unhashable items fall back to comparing against each
+    element, as they would against the original sequence.
+    """
+    __slots__ = ()
+
+    def __contains__(self, item: Any) -> bool:
+        try:
+            return frozenset.__contains__(self, item)
+        except TypeError:
+            return any(item == element for element in self)
+
+
+def materialize(value: Any) -> Any:
+    """Return the elements of a one-shot iterator as a list, so they may be iterated repeatedly
+
+    Anything else — including lazy, but re-iterable, values like ranges — is
+    returned as-is.
+    """
+    # Only the type is inspected, as with _classify_type()
+    if issubclass(type(value), IteratorABC):
+        return list(value)
+    return value
+
+
+async def materialize_async(value: Any) -> Any:
+    """Like `materialize()`, but also collecting the elements of async iterators"""
+    if issubclass(type(value), AsyncIteratorABC):
+        return await _alist(value)
+    return materialize(value)
+
+
+def hashed_container(container: Any) -> Any:
+    """Return a container equivalent to the given one in membership tests, but O(1) if possible
+
+    One-shot iterators are first collected into a list, so the container may be
+    tested repeatedly. Lists and tuples of hashable elements become a
+    `HashedMembership`. Anything else — including strings, where membership means
+    substring — is returned as-is.
+    """
+    container = materialize(container)
+    if type(container) in (list, tuple):
+        try:
+            return HashedMembership(container)
+        except TypeError:
+            pass
+    return container
+
+
+class HashJoin:
+    """An index over the inner iterable of a comprehension, by the key of an equality condition
+
+    The compiler emits one of these per comprehension evaluation, for clauses like
+    `for c in customers if o.customer_id == c.id`, and iterates over
+    `join.lookup(customers, lambda: o.customer_id)` — only the elements whose key
+    equals the outer key — instead of the whole iterable. The condition itself is
+    still evaluated for each element yielded.
+
+    The index is built on first lookup, and rebuilt if the iterable changes. If
+    the iterable can't be indexed — it's async, a one-shot iterator, or any
+    element's key fails to compute, is unhashable, or is awaitable — or the outer
+    key can't be looked up, the whole iterable is returned, so the clause runs as
+    a nested loop.
+    """
+    __slots__ = ('key', 'source', 'index')
+
+    def __init__(self, key: Callable[[Any], Any]) -> None:
+        self.key = key
+        self.source: Any = _missing
+        self.index: dict[Any, list[Any]] | None = None
+
+    def lookup(self, iterable: Any, outer_key: Callable[[], Any]) -> Any:
+        if iterable is not self.source:
+            self.source = iterable
+            self.index = self._build(iterable)
+
+        index = self.index
+        if index is None:
+            return iterable
+        try:
+            key = outer_key()
+            if _kind_of_type(type(key)) is AWAITABLE:
+                return iterable
+            return index.get(key, ())
+        except Exception:
+            return iterable
+
+    def _build(self, iterable: Any) -> dict[Any, list[Any]] | None:
+        key = self.key
+        index: dict[Any, list[Any]] = {}
+        try:
+            if hasattr(iterable, '__aiter__') or iter(iterable) is iterable:
+                return None
+            for item in iterable:
+                item_key = key(item)
+                if _kind_of_type(type(item_key)) is AWAITABLE:
+                    return None
+                index.setdefault(item_key, []).append(item)
+        except Exception:
+            return None
+        return index
+
+
+#: Kinds of numpy dtypes (bool, signed and unsigned int, and float) comprehensions are vectorized over
+_VECTOR_DTYPE_KINDS = frozenset('biuf')
+
+
+def vectorize_comprehension(
+    factory: type,
+    iterable: Any,
+    variables: tuple[Any, ...],
+    element: Callable[..., Any],
+    cond: Callable[..., Any] | None = None,
+) -> list[Any] | set[Any] | dict[Any, Any] | None:
+    """Evaluate a comprehension over a NumPy array with array operations, if possible
+
+    `element` and `cond` are the comprehension's element and condition, as
+    translated by the compiler to operate on whole arrays: each is passed the
+    numpy module, the array, and the values of `variables`. For dicts, element
+    returns arrays of keys and values.
+
+    None is returned unless iterable is a 1-D array of bools, ints, or floats, and
+    all variables are numeric scalars — in which case the comprehension is to be
+    evaluated as usual. Elements are numpy scalars, just as the loop would produce.
+    """
+    # NumPy is never imported here: if it hasn't been imported, there are no arrays
+    np = sys.modules.get('numpy')
+    if (
+        np is None
+        or type(iterable) is not np.ndarray
+        or iterable.ndim != 1
+        or iterable.dtype.kind not in _VECTOR_DTYPE_KINDS
+    ):
+        return None
+    for value in variables:
+        if type(value) not in (int, float, bool) and not isinstance(value, (np.number, np.bool_)):
+            return None
+
+    if cond is not None:
+        iterable = iterable[np.asarray(cond(np, iterable, *variables), dtype=bool)]
+    values = element(np, iterable, *variables)
+    if factory is dict:
+        keys, values = values
+        return dict(zip(keys, values))
+    return factory(values)
+
+
+async def syncify_awaitables_concurrently(
+    values: AsyncIterable[Any], limit: int | None = None
+) -> list[Any]:
+    """Sync-flatten all values of an async iterable, awaiting them concurrently
+
+    Each awaitable or async iterable value is scheduled as soon as it's produced,
+    with at most `limit` of them being awaited at once. Results are returned in
+    their original order. If any value raises, the exception of the earliest such
+    value is raised, once all others have completed.
+    """
+    import asyncio
+
+    semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def _syncify_limited(v: Any, kind: str) -> Any:
+        if semaphore is None:
+            return await _syncify(v, kind)
+        async with semaphore:
+            return await _syncify(v, kind)
+
+    results: list[Any] = []
+    pending: list[tuple[int, asyncio.Future]] = []
+    try:
+        async for v in values:
+            kind = _classify(v)
+            if kind is ASYNC_ITERABLE or kind is AWAITABLE:
+                pending.append((len(results), asyncio.ensure_future(_syncify_limited(v, kind))))
+                results.append(None)
+            else:
+                results.append(v)
+
+        outcomes = await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
+    except BaseException:
+        for _, task in pending:
+            task.cancel()
+        raise
+
+    for (index, _), outcome in zip(pending, outcomes):
+        if isinstance(outcome, BaseException):
+            raise outcome
+        results[index] = outcome
+
+    return results
+
+
+async def gather_elements(elements: list[Any], limit: int | None = None) -> list[Any]:
+    """Evaluate the elements of a comprehension concurrently, returning their values in order
+
+    Each element is an unstarted generator (usually an async one) which yields the
+    element's value — as emitted by the compiler for comprehensions in environments
+    with `concurrent_comprehensions` enabled. At most `limit` elements are evaluated
+    at once. If any raise, the exception of the earliest such element is raised,
+    once all others have completed.
+    """
+    import asyncio
+
+    semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def _evaluate(element: Any) -> Any:
+        if not hasattr(element, '__anext__'):
+            return next(element)
+        try:
+            return await element.__anext__()
+        finally:
+            await element.aclose()
+
+    async def _evaluate_limited(element: Any) -> Any:
+        if semaphore is None:
+            return await _evaluate(element)
+        async with semaphore:
+            return await _evaluate(element)
+
+    outcomes = await asyncio.gather(
+        *(_evaluate_limited(element) for element in elements),
+        return_exceptions=True,
+    )
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            raise outcome
+    return outcomes
+
+
+async def _resolve_spread_operands(operands: list[Any]) -> list[Any]:
+    """Sync-flatten the awaitable and async iterable operands of spreads, concurrently
+
+    Operands which aren't async are left as-is, without touching asyncio at all. If
+    any raise, the exception of the earliest such operand is raised, once all others
+    have completed.
+    """
+    pending = [
+        (index, kind)
+        for index, kind in enumerate(map(_classify, operands))
+        if kind is ASYNC_ITERABLE or kind is AWAITABLE
+    ]
+    if not pending:
+        return operands
+    if len(pending) == 1:
+        index, kind = pending[0]
+        operands[index] = await _syncify(operands[index], kind)
+        return operands
+
+    import asyncio
+
+    outcomes = await asyncio.gather(
+        *(_syncify(operands[index], kind) for index, kind in pending),
+        return_exceptions=True,
+    )
+    for (index, _), outcome in zip(pending, outcomes):
+        if isinstance(outcome, BaseException):
+            raise outcome
+        operands[index] = outcome
+    return operands
+
+
+async def spread_scalars(
+    factory: Callable[[list[Any]], Any],
+    items: tuple[Any, ...],
+    spreads: tuple[int, ...],
+    wrappers: tuple[Callable[[Any], Any], ...] = (),
+) -> Any:
+    """Build a list, tuple, or set literal containing spreads, in async environments
+
+    `items` holds the literal's elements, in order, where those at the indices in
+    `spreads` are the operands of spreads — which may be awaitable, or async
+    iterables. All such operands are resolved concurrently, then (after passing
+    through their `wrappers`, if any) spread in place, so elements keep the order
+    of the literal.
+    """
+    operands = await _resolve_spread_operands([items[index] for index in spreads])
+    if wrappers:
+        operands = [wrap(operand) for wrap, operand in zip(wrappers, operands)]
+
+    values: list[Any] = []
+    start = 0
+    for index, operand in zip(spreads, operands):
+        values.extend(items[start:index])
+        values.extend(operand)
+        start = index + 1
+    values.extend(items[start:])
+    return values if factory is list else factory(values)
+
+
+async def spread_pairs(
+    items: tuple[Any, ...],
+    spreads: tuple[int, ...],
+    wrappers: tuple[Callable[[Any], Any], ...] = (),
+) -> dict[Any, Any]:
+    """Build a dict literal containing spreads, in async environments
+
+    `items` holds the literal's (key, value) pairs, in order, where those at the
+    indices in `spreads` are instead the mappings being spread — which may be
+    awaitable. All such mappings are resolved concurrently, then merged in order,
+    so later keys override earlier ones just as in the literal.
+    """
+    operands = await _resolve_spread_operands([items[index] for index in spreads])
+    if wrappers:
+        operands = [wrap(operand) for wrap, operand in zip(wrappers, operands)]
+
+    rv: dict[Any, Any] = {}
+    start = 0
+    for index, mapping in zip(spreads, operands):
+        rv.update(items[start:index])
+        # Unpacking non-dicts raises the same TypeError as spreading them would
+        rv.update(mapping if type(mapping) is dict else {**mapping})
+        start = index + 1
+    rv.update(items[start:])
+    return rv
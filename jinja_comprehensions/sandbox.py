@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+from functools import partial
+from typing import Any, Callable
+
+from jinja2 import nodes
+from jinja2.compiler import Frame, optimizeconst
+from jinja2.runtime import Context
+from jinja2.sandbox import SandboxedEnvironment, inspect_format_method, safe_range
+
+from jinja_comprehensions.compiler import AsyncOperandsCodeGenerator, ComprehensionCodeGenerator
+from jinja_comprehensions.environment import ComprehensionEnvironment
+from jinja_comprehensions.nativetypes import (
+    NativeComprehensionCodeGenerator,
+    NoAsyncConcatNativeTemplate,
+    NoLiteralEvalComprehensionNativeEnvironment,
+    NoLiteralEvalNativeCodeGenerator,
+)
+from jinja_comprehensions.util import add_template_class, with_code_generator
+
+__all__ = [
+    'SandboxedComprehensionCodeGenerator',
+    'SandboxedComprehensionEnvironment',
+    'SandboxedNativeComprehensionEnvironment',
+]
+
+_missing = object()
+
+
+class SandboxedComprehensionCodeGenerator(ComprehensionCodeGenerator):
+    """Code generator performing sandbox call checks once per comprehension
+
+    Stock sandboxed templates route every call through `environment.call()`, which
+    inspects the callee on each invocation. Within comprehensions, the same callee
+    is usually called for every element — so calls are instead routed through a
+    checker created once per comprehension, which only re-inspects the callee
+    when it differs from the previous one.
+    """
+
+    @optimizeconst
+    def visit_Call(self, node: nodes.Call, frame: Frame, forward_caller: bool = False) -> None:
+        if not self._hoist_scopes or self._hoist_scopes[-1].max_level < 0:
+            super().visit_Call(node, frame, forward_caller=forward_caller)
+            return
+
+        checker = self._hoist('environment.call_checker(context)')
+
+        if self.environment.is_async:
+            self.write('(await auto_await(')
+        self.write(f'{checker}(')
+        self.visit(node.node, frame)
+
+        extra_kwargs = {'caller': 'caller'} if forward_caller else {}
+        if frame.loop_frame:
+            extra_kwargs['_loop_vars'] = '_loop_vars'
+        if frame.block_frame:
+            extra_kwargs['_block_vars'] = '_block_vars'
+        self.signature(node, frame, extra_kwargs or None)
+
+        self.write(')')
+        if self.environment.is_async:
+            self.write('))')
+
+
+class SandboxedComprehensionEnvironment(ComprehensionEnvironment, SandboxedEnvironment):
+    """Sandboxed environment supporting comprehensions
+
+    Security checks are as strict as `SandboxedEnvironment`'s, but cheaper to run
+    many times over: results of `is_safe_attribute()` are cached per (type, attribute),
+    and calls within comprehensions only check their callee once (see
+    `SandboxedComprehensionCodeGenerator`).
+    """
+    code_generator_class = SandboxedComprehensionCodeGenerator
+
+    const_fold_pure_globals = ComprehensionEnvironment.const_fold_pure_globals | {safe_range}
+
+    #: Maximum number of (type, attribute) pairs whose safety is remembered.
+    #: The cache is emptied once full.
+    safe_attribute_cache_size: int = 4096
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._safe_attributes: dict[tuple[type, str], bool] = {}
+
+    def is_safe_attribute(self, obj: Any, attr: str, value: Any) -> bool:
+        # NOTE: the stock checks depend only on the type of obj and the attribute
+        #       name — never on the value — so their results may be shared by all
+        #       instances of a type.
+        key = (type(obj), attr)
+        try:
+            return self._safe_attributes[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable attribute name
+            return super().is_safe_attribute(obj, attr, value)
+
+        is_safe = super().is_safe_attribute(obj, attr, value)
+        if len(self._safe_attributes) >= self.safe_attribute_cache_size:
+            self._safe_attributes.clear()
+        self._safe_attributes[key] = is_safe
+        return is_safe
+
+    def prepare_call(self, context: Context, obj: Any) -> Callable[..., Any]:
+        """Return a callable which calls obj from sandboxed code
+
+        If obj is safely callable, the returned callable skips any further checks.
+        Otherwise, calls go through `call()`, which performs (and fails) the checks
+        as usual.
+        """
+        if inspect_format_method(obj) is None and self.is_safe_callable(obj):
+            return partial(context.call, obj)
+        return partial(self.call, context, obj)
+
+    def call_checker(self, context: Context) -> Callable[..., Any]:
+        """Return a function which calls its first argument from sandboxed code
+
+        The callee is only checked when it differs from the previous one.
+        """
+        last_obj = _missing
+        prepared: Callable[..., Any] = self.call
+
+        def call(obj: Any, /, *args: Any, **kwargs: Any) -> Any:
+            nonlocal last_obj, prepared
+            if obj is not last_obj:
+                prepared = self.prepare_call(context, obj)
+                last_obj = obj
+            return prepared(*args, **kwargs)
+
+        return call
+
+
+@with_code_generator(
+    NoLiteralEvalNativeCodeGenerator,
+    AsyncOperandsCodeGenerator,
+    SandboxedComprehensionCodeGenerator,
+    NativeComprehensionCodeGenerator,
+)
+@add_template_class
+class SandboxedNativeComprehensionEnvironment(
+    SandboxedComprehensionEnvironment,
+    NoLiteralEvalComprehensionNativeEnvironment,
+):
+    """Sandboxed counterpart of `NoLiteralEvalComprehensionNativeEnvironment`"""
+    template_class = NoAsyncConcatNativeTemplate
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import sys
+import threading
+from collections import OrderedDict
+from types import CodeType, FunctionType
+from typing import Any, Iterator, MutableMapping
+
+from jinja2.environment import Template
+
+__all__ = [
+    'SizedTemplateCache',
+    'estimate_template_size',
+]
+
+
+class SizedTemplateCache(MutableMapping[Any, Template]):
+    """Template cache bounded by the estimated size of its templates, rather than their count
+
+    Assign one to an environment's `cache`, in place of Jinja's count-based LRU
+    cache. Once the templates' total size (see `estimate_template_size()`) exceeds
+    `max_size` bytes, the least-recently used are evicted — except for templates
+    pinned by name, which are never evicted, though they count towards the total.
+
+    >>> env = ComprehensionEnvironment(loader=loader)
+    >>> env.cache = SizedTemplateCache(max_size=32 * 1024 * 1024)
+    >>> env.cache.pin('layout.j2')
+
+    Hits, misses, and evictions are counted, and `sizes()` reports the estimated
+    size of each cached template.
+    """
+
+    def __init__(self, max_size: int = 64 * 1024 * 1024) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        #: Total estimated size of cached templates, in bytes
+        self.size = 0
+        self._entries: OrderedDict[Any, tuple[Template, int]] = OrderedDict()
+        self._pinned: set[str] = set()
+        self._lock = threading.RLock()
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    @property
+    def capacity(self) -> int:
+        # Read by Jinja when copying a cache for an overlay. There's no limit on
+        # the number of templates, which Jinja signals by a negative capacity.
+        return -1
+
+    def __getitem__(self, key: Any) -> Template:
+        with self._lock:
+            try:
+                template, _ = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return template
+
+    def __setitem__(self, key: Any, template: Template) -> None:
+        size = estimate_template_size(template)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (template, size)
+            self.size += size
+            self._evict()
+
+    def __delitem__(self, key: Any) -> None:
+        with self._lock:
+            _, size = self._entries.pop(key)
+            self.size -= size
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        return (
+            f'<{type(self).__name__} {len(self)} templates, {self.size}/{self.max_size} bytes, '
+            f'{self.hits} hits, {self.misses} misses, {self.evictions} evictions>'
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def copy(self) -> SizedTemplateCache:
+        """Return a copy sharing the cached templates, but with its own counters"""
+        with self._lock:
+            rv = type(self)(self.max_size)
+            rv._entries.update(self._entries)
+            rv._pinned.update(self._pinned)
+            rv.size = self.size
+            return rv
+
+    def pin(self, name: str) -> None:
+        """Never evict templates of this name — whether cached already, or later on"""
+        with self._lock:
+            self._pinned.add(name)
+
+    def unpin(self, name: str) -> None:
+        with self._lock:
+            self._pinned.discard(name)
+            self._evict()
+
+    @property
+    def pinned(self) -> frozenset[str]:
+        return frozenset(self._pinned)
+
+    def sizes(self) -> dict[str, int]:
+        """Return the estimated size of each cached template, by name, largest first"""
+        with self._lock:
+            entries = [(_template_name(key), size) for key, (_, size) in self._entries.items()]
+        return dict(sorted(entries, key=lambda entry: entry[1], reverse=True))
+
+    def reset_stats(self) -> None:
+        self.hits = self.misses = self.evictions = 0
+
+    def _evict(self) -> None:
+        if self.size <= self.max_size:
+            return
+
+        for key in list(self._entries):
+            if _template_name(key) in self._pinned:
+                continue
+            _, size = self._entries.pop(key)
+            self.size -= size
+            self.evictions += 1
+            if self.size <= self.max_size:
+                return
+
+
+def _template_name(key: Any) -> str:
+    # Jinja keys its template cache by (weakref to loader, template name)
+    if isinstance(key, tuple) and len(key) == 2:
+        return key[1]
+    return key
+
+
+def estimate_template_size(template: Template) -> int:
+    """Estimate the memory held by a compiled template's code and constants, in bytes
+
+    This covers the code objects of the template's render functions (including
+    those of nested functions, comprehensions, and lambdas), their bytecode, line
+    tables, and constants, along with the template's debug info. Objects shared
+    between templates (e.g. interned names, and globals) aren't counted.
+    """
+    seen: set[int] = set()
+    size = sys.getsizeof(template) + _object_size(getattr(template, '_debug_info', ''), seen)
+
+    funcs = [template.root_render_func, *template.blocks.values()]
+    render_value_func = getattr(template, 'render_value_func', None)
+    if render_value_func is not None:
+        funcs.append(render_value_func)
+
+    for func in funcs:
+        code = getattr(func, '__code__', None)
+        if isinstance(code, CodeType):
+            size += _object_size(code, seen)
+        if isinstance(func, FunctionType) and func.__defaults__:
+            size += _object_size(func.__defaults__, seen)
+    return size
+
+
+def _object_size(obj: Any, seen: set[int]) -> int:
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, CodeType):
+        size += sum(
+            _object_size(part, seen)
+            for part in (obj.co_code, obj.co_consts, _line_table(obj), obj.co_names, obj.co_varnames)
+        )
+    elif isinstance(obj, (tuple, frozenset)):
+        size += sum(_object_size(item, seen) for item in obj)
+    return size
+
+
+def _line_table(code: CodeType) -> bytes:
+    # co_linetable replaced co_lnotab in Python 3.10
+    return getattr(code, 'co_linetable', None) or code.co_lnotab
@@ -1,14 +1,17 @@
 from __future__ import annotations
 
-from typing import Callable, Type, TypeVar, cast
+from collections import ChainMap
+from typing import Any, Callable, Mapping, Type, TypeVar, cast
 
 import jinja2
 import jinja2.compiler
+from jinja2.runtime import Context
 
 __all__ = [
     'create_template_class',
     'add_template_class',
     'with_code_generator',
+    'new_layered_context',
 ]
 
 
@@ -28,7 +31,9 @@ def add_template_class(environment_class: EnvT) -> EnvT:
     """Class decorator to construct and assign a template class to an Environment"""
     base_name = _get_env_base_name(environment_class)
     template_class_name = f'{base_name}Template'
-    environment_class.template_class = create_template_class(template_class_name, environment_class)
+    template_class = create_template_class(template_class_name, environment_class)
+    _make_importable(template_class, environment_class, 'template_class')
+    environment_class.template_class = template_class
     return environment_class
 
 
@@ -42,6 +47,7 @@ def with_code_generator(
             base_name = _get_env_base_name(environment_class)
             code_generator_class_name = f'{base_name}CodeGenerator'
             code_generator_class = type(code_generator_class_name, (base, *other_bases), {})
+            _make_importable(code_generator_class, environment_class, 'code_generator_class')
         else:
             code_generator_class = base
 
@@ -51,5 +57,38 @@ def with_code_generator(
     return _with_code_generator_decorator
 
 
+def new_layered_context(
+    environment: jinja2.Environment,
+    globals: Mapping[str, Any],
+    name: str | None,
+    args: tuple[Any, ...],
+    kwargs: dict[str, Any],
+) -> Context:
+    """Create a render context from the arguments of a render call, layered over globals
+
+    Rather than merging the variables into a copy of the globals, as
+    Environment.new_context() does, they're layered over them — so contexts are
+    only safe to use where nothing assigns to, or exports from them. A single
+    mapping argument is used as-is, not copied; anything else is passed to dict().
+    """
+    if len(args) == 1 and not kwargs and isinstance(args[0], Mapping):
+        variables = args[0]
+    else:
+        variables = dict(*args, **kwargs)
+    parent = ChainMap(variables, globals)  # type: ignore[arg-type]
+    return Context(environment, parent, name, {})  # type: ignore[arg-type]
+
+
+def _make_importable(cls: type, environment_class: Type[jinja2.Environment], attr: str) -> None:
+    """Point a class built for an Environment at its attribute on the Environment class
+
+    Dynamically built classes can't otherwise be found by pickle (e.g. when sending
+    templates to worker processes): their names aren't bound in any module. As long
+    as the Environment class itself is importable, so is the built class.
+    """
+    cls.__module__ = environment_class.__module__
+    cls.__qualname__ = f'{environment_class.__qualname__}.{attr}'
+
+
 def _get_env_base_name(environment_class: Type[jinja2.Environment]) -> str:
     return environment_class.__name__.removesuffix('Environment')
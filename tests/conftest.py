@@ -1,3 +1,4 @@
+import asyncio
 from typing import TypeVar
 
 import asyncstdlib
@@ -74,3 +75,27 @@ def add_env_globals(async_globals, sync_globals):
         env.globals.update(async_globals if env.is_async else sync_globals)
         return env
     return _init_env_globals
+
+
+class Tracker:
+    """Async stand-ins for I/O, recording how many of them are awaited at once"""
+    active = 0
+    max_active = 0
+
+    async def fetch(self, value, delay=0.01):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.active -= 1
+        if value is None:
+            raise ValueError(delay)
+        return value
+
+    async def stream(self, *values):
+        for value in values:
+            yield await self.fetch(value)
+
+
+tracker = lambda_fixture(lambda: Tracker())
@@ -0,0 +1,119 @@
+import jinja2
+import pytest
+from pytest_lambda import lambda_fixture, static_fixture
+
+from jinja_comprehensions import (
+    NativeComprehensionEnvironment,
+    NoLiteralEvalComprehensionNativeEnvironment,
+    SandboxedNativeComprehensionEnvironment,
+    SizedTemplateCache,
+    render_many,
+)
+from jinja_comprehensions.batch import RenderError, picklable_environment
+
+native_env_class = lambda_fixture(params=[
+    pytest.param(NativeComprehensionEnvironment, id='native'),
+    pytest.param(NoLiteralEvalComprehensionNativeEnvironment, id='native-no_literal_eval'),
+    pytest.param(SandboxedNativeComprehensionEnvironment, id='sandboxed-native'),
+])
+
+
+def make_environment():
+    env = NoLiteralEvalComprehensionNativeEnvironment()
+    env.filters['triple'] = lambda value: value * 3
+    return env
+
+
+class DescribeRenderMany:
+    source = static_fixture('{{ [x * n for x in range(k)] | sum }}')
+    is_async = lambda_fixture(params=[
+        pytest.param(False, id='sync'),
+        pytest.param(True, id='async'),
+    ])
+
+    @pytest.fixture
+    def template(self, native_env_class, is_async, source):
+        return native_env_class(enable_async=is_async).from_string(source)
+
+    def it_renders_each_context_in_order(self, template, source):
+        contexts = ({'n': n, 'k': 4} for n in range(10))
+        results = list(render_many(template, contexts, workers=2, source=source, chunk_size=3))
+        assert [result.index for result in results] == list(range(10))
+        assert [result.value for result in results] == [6 * n for n in range(10)]
+        assert all(result.error is None for result in results)
+
+    def it_renders_as_completed(self, template, source):
+        contexts = [{'n': n, 'k': 4} for n in range(10)]
+        results = render_many(template, contexts, workers=2, source=source, chunk_size=3, ordered=False)
+        assert sorted((result.index, result.value) for result in results) == [
+            (n, 6 * n) for n in range(10)
+        ]
+
+    def it_reports_errors_per_context(self, template, source):
+        contexts = [{'n': 1, 'k': 2}, {'n': 1, 'k': 'x'}, {'n': 2, 'k': 2}]
+        results = list(render_many(template, contexts, workers=1, source=source))
+        assert [result.value for result in results] == [1, None, 2]
+        assert isinstance(results[1].error, TypeError)
+        assert 'TypeError' in results[1].traceback
+
+    def it_reports_values_which_cant_be_sent_back(self, template):
+        source = '{{ (x for x in [n]) if n else n }}'
+        template = template.environment.from_string(source)
+        results = list(render_many(template, [{'n': 0}, {'n': 1}], workers=1, source=source))
+        assert results[0].value == 0
+        assert isinstance(results[1].error, RenderError)
+
+    def it_requires_source_of_string_templates(self, template):
+        with pytest.raises(TypeError, match='source'):
+            next(render_many(template, [{}], workers=1))
+
+    def it_reads_source_from_loader(self, native_env_class):
+        env = native_env_class(loader=jinja2.DictLoader({'t': '{{ n + 1 }}'}))
+        results = render_many(env.get_template('t'), [{'n': 1}], workers=1)
+        assert [result.value for result in results] == [2]
+
+
+class DescribeEnvironmentFactory:
+
+    def it_rejects_unpicklable_environments(self):
+        env = make_environment()
+        with pytest.raises(TypeError, match='environment_factory'):
+            next(render_many(env.from_string('{{ 1 }}'), [{}], workers=1, source='{{ 1 }}'))
+
+    def it_creates_environment_in_workers(self):
+        source = '{{ n | triple }}'
+        template = make_environment().from_string(source)
+        results = render_many(
+            template, [{'n': 1}, {'n': 2}], workers=1, source=source,
+            environment_factory=make_environment,
+        )
+        assert [result.value for result in results] == [3, 6]
+
+
+class DescribePicklableEnvironment:
+
+    def it_drops_caches(self, native_env_class):
+        env = native_env_class()
+        env.cache['key'] = object()
+
+        clone = picklable_environment(env)
+        assert len(clone.cache) == 0
+        assert len(env.cache) == 1
+        assert clone.filters is env.filters
+
+    def it_keeps_sized_template_caches(self, native_env_class):
+        env = native_env_class()
+        env.cache = SizedTemplateCache(max_size=4096)
+        env.cache.pin('layout.j2')
+        env.cache['key'] = env.from_string('{{ 1 }}')
+
+        clone = picklable_environment(env)
+        assert len(env.cache) == 1
+        assert isinstance(clone.cache, SizedTemplateCache)
+        assert (clone.cache.max_size, clone.cache.pinned, len(clone.cache)) == (4096, {'layout.j2'}, 0)
+
+    def it_reconstructs_dynamic_classes(self):
+        import pickle
+        env_class = NoLiteralEvalComprehensionNativeEnvironment
+        assert pickle.loads(pickle.dumps(env_class.template_class)) is env_class.template_class
+        assert pickle.loads(pickle.dumps(env_class.code_generator_class)) is env_class.code_generator_class
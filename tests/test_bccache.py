@@ -0,0 +1,131 @@
+import os
+
+import pytest
+from jinja2 import DictLoader
+from pytest_lambda import lambda_fixture
+
+from jinja_comprehensions import (
+    ComprehensionBytecodeCache,
+    ComprehensionEnvironment,
+    NativeComprehensionEnvironment,
+    NoLiteralEvalComprehensionNativeEnvironment,
+)
+
+SOURCE = '{{ [n * 2 for n in items] }}'
+
+
+@pytest.fixture
+def bcc(tmp_path):
+    return ComprehensionBytecodeCache(str(tmp_path))
+
+
+def _cache_files(bcc):
+    return sorted(os.listdir(bcc.directory))
+
+
+class DescribeComprehensionBytecodeCache:
+    env_class = lambda_fixture(params=[
+        pytest.param(ComprehensionEnvironment, id='normal'),
+        pytest.param(NativeComprehensionEnvironment, id='native'),
+        pytest.param(NoLiteralEvalComprehensionNativeEnvironment, id='native-no_literal_eval'),
+    ])
+
+    def it_reuses_bytecode_for_same_environment(self, bcc, env_class):
+        env = env_class(bytecode_cache=bcc)
+        bucket = bcc.get_bucket(env, 'tmpl', None, SOURCE)
+        assert bucket.code is None
+
+        bucket.code = env.compile(SOURCE, 'tmpl')
+        bcc.set_bucket(bucket)
+
+        other_env = env_class(bytecode_cache=bcc)
+        assert bcc.get_bucket(other_env, 'tmpl', None, SOURCE).code is not None
+
+    def it_separates_environment_variants(self, bcc):
+        envs = [
+            ComprehensionEnvironment(),
+            ComprehensionEnvironment(enable_async=True),
+            NativeComprehensionEnvironment(),
+            NoLiteralEvalComprehensionNativeEnvironment(),
+            NoLiteralEvalComprehensionNativeEnvironment(enable_async=True),
+        ]
+        keys = {bcc.get_bucket(env, 'tmpl', None, SOURCE).key for env in envs}
+        assert len(keys) == len(envs)
+
+    def it_separates_lookup_hoisting(self, bcc):
+        env = ComprehensionEnvironment()
+        hoisting_env = ComprehensionEnvironment()
+        hoisting_env.hoist_invariant_lookups = True
+        keys = {bcc.get_bucket(e, 'tmpl', None, SOURCE).key for e in (env, hoisting_env)}
+        assert len(keys) == 2
+
+    @pytest.mark.parametrize('registry', ['filters', 'tests'])
+    def it_separates_replaced_stock_filters_and_tests(self, bcc, registry):
+        env = ComprehensionEnvironment()
+        replaced_env = ComprehensionEnvironment()
+        getattr(replaced_env, registry)['upper' if registry == 'filters' else 'odd'] = lambda v: v
+        keys = {bcc.get_bucket(e, 'tmpl', None, SOURCE).key for e in (env, replaced_env)}
+        assert len(keys) == 2
+
+    def it_renders_correctly_with_shared_cache(self, bcc, monkeypatch):
+        loaded = []
+
+        def load_bytecode(bucket):
+            original_load_bytecode(bucket)
+            loaded.append(bucket.code)
+
+        original_load_bytecode = bcc.load_bytecode
+        monkeypatch.setattr(bcc, 'load_bytecode', load_bytecode)
+
+        loader = DictLoader({'tmpl': SOURCE})
+        for _ in range(2):
+            # Fresh environments, so templates are loaded through the bytecode cache
+            string_env = ComprehensionEnvironment(loader=loader, bytecode_cache=bcc)
+            native_env = NativeComprehensionEnvironment(loader=loader, bytecode_cache=bcc)
+            assert string_env.get_template('tmpl').render(items=[1]) == '[2]'
+            assert native_env.get_template('tmpl').render(items=[1]) == [2]
+
+        assert loaded[:2] == [None, None]
+        assert loaded[2:] == [string_env.compile(SOURCE, 'tmpl'), native_env.compile(SOURCE, 'tmpl')]
+        assert loaded[2] != loaded[3]
+
+    def it_tracks_size_when_overwriting_files(self, bcc):
+        env = ComprehensionEnvironment()
+        bcc.max_size = 1024 * 1024
+        for source in (SOURCE, SOURCE + '!', SOURCE + '!!'):
+            bucket = bcc.get_bucket(env, 'tmpl', None, source)
+            bucket.code = env.compile(source, 'tmpl')
+            bcc.set_bucket(bucket)
+
+        assert len(_cache_files(bcc)) == 1
+        assert bcc._size == os.path.getsize(os.path.join(bcc.directory, _cache_files(bcc)[0]))
+
+    def it_raises_write_errors(self, bcc, monkeypatch):
+        env = ComprehensionEnvironment()
+        bucket = bcc.get_bucket(env, 'tmpl', None, SOURCE)
+        bucket.code = env.compile(SOURCE, 'tmpl')
+
+        def write_bytecode(f):
+            raise OSError(28, 'No space left on device')
+
+        monkeypatch.setattr(bucket, 'write_bytecode', write_bytecode)
+        with pytest.raises(OSError):
+            bcc.dump_bytecode(bucket)
+        assert _cache_files(bcc) == []
+
+    def it_evicts_least_recently_used_files(self, bcc):
+        env = ComprehensionEnvironment(bytecode_cache=bcc)
+        for i in range(3):
+            bucket = bcc.get_bucket(env, f'tmpl{i}', None, SOURCE)
+            bucket.code = env.compile(SOURCE, f'tmpl{i}')
+            bcc.set_bucket(bucket)
+            path = os.path.join(bcc.directory, bcc.pattern % bucket.key)
+            os.utime(path, (i, i))
+
+        sizes = [os.path.getsize(os.path.join(bcc.directory, f)) for f in _cache_files(bcc)]
+        bcc.max_size = sum(sizes) - 1
+        bcc.evict()
+
+        remaining = _cache_files(bcc)
+        assert len(remaining) == 2
+        assert bcc.get_bucket(env, 'tmpl0', None, SOURCE).code is None
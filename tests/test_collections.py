@@ -16,6 +16,8 @@ _SCALAR_COLLECTION_EXPRS = {
         '''1, *range(2, 4), 5''',
     'multiple-spread':
         '''1, *range(2, 4), 5, *range(6, 8), 9''',
+    'leading-spread':
+        '''*range(1, 3), *range(3, 5)''',
 }
 _DICT_COLLECTION_EXPRS = {
     'dict-empty':
@@ -28,6 +30,8 @@ _DICT_COLLECTION_EXPRS = {
         '''{'a': 1, 'b': 2, 'c': 3, 'a': 1, 'b': 2, 'c': 3}''',
     'dict-spread':
         '''{'a': 1, **{'b': 2, 'c': 3}, 'd': 4}''',
+    'dict-leading-spread':
+        '''{**{'a': 1}, **{'a': 2, 'b': 3}}''',
     'dict-multiple-spread':
         '''{'a': 1, **{'b': 2, 'c': 3}, 'd': 4, **{'e': 5, 'f': 6}, 'g': 7}''',
     'dict-spread-dynamic':
@@ -69,3 +73,42 @@ class DescribeCollectionLiterals(BaseJinjaEvaluationTest):
         pytest.param(expr, id=name)
         for name, expr in COLLECTION_LITERAL_EXPRS.items()
     ])
+
+
+class DescribeAsyncSpreads:
+    @pytest.mark.parametrize('expr, expected', [
+        ('[0, *fetch([1, 2], 0.02), 3, *stream(4, 5), *[6]]', [0, 1, 2, 3, 4, 5, 6]),
+        ('(*stream(1), *fetch((2, 3)))', (1, 2, 3)),
+        ('{*stream(1, 2), *fetch([2, 3])}', {1, 2, 3}),
+        ('{**fetch({"a": 1, "b": 1}, 0.02), "b": 2, **fetch({"c": 3}), **({"a": 4} | fetched)}',
+         {'a': 4, 'b': 2, 'c': 3}),
+        ('[[*fetch([x]), *fetch([x * 2])] for x in [1, 2]]', [[1, 2], [2, 4]]),
+    ])
+    @pytest.mark.asyncio
+    async def it_resolves_async_operands_concurrently_in_order(
+        self, async_env, tracker, preprocess_expected, expr, expected
+    ):
+        async_env.filters['fetched'] = tracker.fetch
+        template = async_env.from_string('{{ %s }}' % expr)
+        actual = await template.render_async(fetch=tracker.fetch, stream=tracker.stream)
+        assert actual == preprocess_expected(expected)
+        assert tracker.max_active > 1
+
+    @pytest.mark.asyncio
+    async def it_spreads_plain_values_without_awaiting(self, async_env, preprocess_expected):
+        template = async_env.from_string('{{ [*a, 1, *b] }} {{ {**c, "d": 1} }}')
+        actual = await template.render_async(a=[0], b=(2, 3), c={'d': 0, 'e': 2})
+        assert actual == '[0, 1, 2, 3] {\'d\': 1, \'e\': 2}'
+
+    @pytest.mark.asyncio
+    async def it_raises_exception_of_earliest_operand(self, async_env, tracker):
+        template = async_env.from_string('{{ [*fetch(None, 0.03), *fetch(None, 0.02), *fetch([1])] }}')
+        with pytest.raises(ValueError, match='0.03'):
+            await template.render_async(fetch=tracker.fetch)
+        assert tracker.active == 0
+
+    @pytest.mark.asyncio
+    async def it_rejects_spreading_non_mappings_as_pairs(self, async_env, tracker):
+        template = async_env.from_string('{{ {**fetch([1, 2]), "a": 1} }}')
+        with pytest.raises(TypeError, match='not a mapping'):
+            await template.render_async(fetch=tracker.fetch)
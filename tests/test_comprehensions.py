@@ -1,5 +1,5 @@
 import pytest
-from pytest_lambda import lambda_fixture
+from pytest_lambda import lambda_fixture, static_fixture
 
 from .base import BaseJinjaEvaluationTest
 
@@ -74,3 +74,95 @@ class DescribeComprehensions(BaseJinjaEvaluationTest):
         pytest.param(expr, id=name)
         for name, expr in COMPREHENSION_EXPRS.items()
     ])
+
+
+class DescribeAsyncIterables:
+    source = static_fixture('{{ [a * b for a in outer for b in inner(a) if b] }}')
+
+    @pytest.fixture
+    def arange(self):
+        async def _arange(n):
+            for i in range(n):
+                yield i
+        return _arange
+
+    @pytest.mark.asyncio
+    async def it_iterates_sync_iterables(self, async_env, source):
+        template = async_env.from_string(source)
+        actual = await template.render_async(outer=[1, 2], inner=range)
+        expected = [a * b for a in [1, 2] for b in range(a) if b]
+        assert actual in (expected, str(expected))
+
+    @pytest.mark.asyncio
+    async def it_iterates_mixed_async_and_sync_iterables(self, async_env, source, arange):
+        template = async_env.from_string(source)
+        actual = await template.render_async(outer=arange(4), inner=range)
+        expected = [a * b for a in range(4) for b in range(a) if b]
+        assert actual in (expected, str(expected))
+
+    @pytest.mark.asyncio
+    async def it_iterates_async_iterables_lazily(self, async_env):
+        consumed = []
+
+        async def outer():
+            for i in range(3):
+                consumed.append(i)
+                yield i
+
+        template = async_env.from_string('{{ (a for a in outer) | first }}')
+        actual = await template.render_async(outer=outer())
+        assert actual in (0, '0')
+        assert consumed == [0]
+
+
+class DescribeConcurrentComprehensions:
+    concurrent_comprehension_limit = static_fixture(None)
+
+    @pytest.fixture
+    def concurrent_env(self, async_env, concurrent_comprehension_limit):
+        async_env.concurrent_comprehensions = True
+        async_env.concurrent_comprehension_limit = concurrent_comprehension_limit
+        return async_env
+
+    @pytest.mark.parametrize('expr, expected', [
+        ('[fetch(x * 2, 0.05 - x / 100) for x in ids if x != 3]', [2, 4, 8]),
+        ('{fetch(x // 2) for x in ids}', {0, 1, 2}),
+        ('{x % 2: fetch(x) for x in ids}', {1: 3, 0: 4}),
+        ('[(a, fetch(b)) for a, b in pairs for c in [a] if c]', [(1, 2), (3, 4)]),
+    ])
+    @pytest.mark.asyncio
+    async def it_evaluates_elements_concurrently_in_order(
+        self, concurrent_env, tracker, preprocess_expected, expr, expected
+    ):
+        template = concurrent_env.from_string('{{ %s }}' % expr)
+        actual = await template.render_async(
+            fetch=tracker.fetch, ids=[1, 2, 3, 4], pairs=[(1, 2), (3, 4)],
+        )
+        assert actual == preprocess_expected(expected)
+        assert tracker.max_active > 1
+
+    @pytest.mark.asyncio
+    async def it_raises_exception_of_earliest_element(self, concurrent_env, tracker):
+        template = concurrent_env.from_string('{{ [fetch(x, d) for x, d in items] }}')
+        with pytest.raises(ValueError, match='0.03'):
+            await template.render_async(
+                fetch=tracker.fetch, items=[(1, 0.01), (None, 0.03), (None, 0.02)],
+            )
+        assert tracker.active == 0
+
+    @pytest.mark.asyncio
+    async def it_leaves_generators_lazy(self, concurrent_env, tracker):
+        template = concurrent_env.from_string('{{ (fetch(x) for x in ids) | first }}')
+        actual = await template.render_async(fetch=tracker.fetch, ids=[1, 2, 3])
+        assert actual in (1, '1')
+        assert tracker.max_active == 1
+
+    class ContextLimit:
+        concurrent_comprehension_limit = static_fixture(2)
+
+        @pytest.mark.asyncio
+        async def it_limits_concurrency(self, concurrent_env, tracker, preprocess_expected):
+            template = concurrent_env.from_string('{{ [fetch(x) for x in ids] }}')
+            actual = await template.render_async(fetch=tracker.fetch, ids=[1, 2, 3, 4])
+            assert actual == preprocess_expected([1, 2, 3, 4])
+            assert tracker.max_active == 2
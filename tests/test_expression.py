@@ -0,0 +1,64 @@
+import jinja2
+import pytest
+from pytest_lambda import lambda_fixture
+
+EXPRESSIONS = {
+    'list-comp':
+        ('[n * 2 for n in items if n != skip]', [2, 6]),
+    'set-comp':
+        ('{n % 2 for n in items}', {0, 1}),
+    'dict-comp':
+        ('{n: n * n for n in items}', {1: 1, 2: 4, 3: 9}),
+    'spread':
+        ('[*items, *items]', [1, 2, 3, 1, 2, 3]),
+    'set-literal':
+        ('{skip, 4}', {2, 4}),
+    'filter':
+        ('items | sum', 6),
+    'string':
+        ('"123"', '123'),
+}
+
+
+class DescribeCompileExpression:
+    case = lambda_fixture(params=[
+        pytest.param(case, id=name)
+        for name, case in EXPRESSIONS.items()
+    ])
+    source = lambda_fixture(lambda case: case[0])
+    expected = lambda_fixture(lambda case: case[1])
+    variables = lambda_fixture(lambda: {'items': [1, 2, 3], 'skip': 2})
+
+    def it_evaluates_to_native_value(self, sync_env, source, expected, variables):
+        assert sync_env.compile_expression(source)(variables) == expected
+
+    def it_accepts_keyword_arguments(self, sync_env, source, expected, variables):
+        assert sync_env.compile_expression(source)(**variables) == expected
+
+    def it_accepts_variables_as_pairs(self, sync_env, source, expected, variables):
+        assert sync_env.compile_expression(source)(list(variables.items())) == expected
+
+    @pytest.mark.asyncio
+    async def it_evaluates_async(self, async_env, source, expected, variables):
+        assert await async_env.compile_expression(source).call_async(variables) == expected
+
+    def it_caches_compiled_expressions_by_source(self, sync_env, source):
+        assert sync_env.compile_expression(source) is sync_env.compile_expression(source)
+
+    def it_converts_undefined_to_none(self, sync_env):
+        assert sync_env.compile_expression('missing_var')() is None
+
+    def it_leaves_undefined_if_requested(self, env_class):
+        env = env_class()
+        rv = env.compile_expression('missing_var', undefined_to_none=False)()
+        assert isinstance(rv, jinja2.Undefined)
+
+    def it_rejects_trailing_chunks(self, sync_env):
+        with pytest.raises(jinja2.TemplateSyntaxError):
+            sync_env.compile_expression('a b')
+
+    def it_does_not_cache_when_disabled(self, env_class):
+        env = env_class()
+        env.expression_cache_size = 0
+        env = env.overlay()
+        assert env.compile_expression('1') is not env.compile_expression('1')
@@ -0,0 +1,78 @@
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+import jinja_comprehensions
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+def run_python(code: str, *args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args, '-c', textwrap.dedent(code)],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def loaded_modules(code: str) -> set[str]:
+    """Return the modules loaded after running code in a fresh interpreter"""
+    result = run_python(textwrap.dedent(code) + '\nimport sys; print(*sys.modules)')
+    return set(result.stdout.split())
+
+
+class DescribeLazyImports:
+    def it_imports_no_submodules_upfront(self):
+        modules = loaded_modules('import jinja_comprehensions')
+        assert {m for m in modules if m.startswith('jinja_comprehensions.')} == set()
+        assert 'jinja2' not in modules
+
+    def it_skips_native_sandbox_and_async_machinery_for_sync_environments(self):
+        modules = loaded_modules('''
+            from jinja_comprehensions import ComprehensionEnvironment
+            ComprehensionEnvironment().from_string('{{ [x for x in y] }}').render(y=[1])
+        ''')
+        assert 'jinja_comprehensions.environment' in modules
+        unwanted = {
+            'asyncio',
+            'asyncstdlib',
+            'concurrent.futures',
+            'jinja2.nativetypes',
+            'jinja2.sandbox',
+            'jinja_comprehensions.batch',
+            'jinja_comprehensions.bccache',
+            'jinja_comprehensions.nativetypes',
+            'jinja_comprehensions.sandbox',
+        }
+        assert modules & unwanted == set()
+
+    def it_loads_asyncstdlib_once_async_iterables_are_flattened(self):
+        result = run_python('''
+            import asyncio
+            import sys
+            from jinja_comprehensions import NativeComprehensionEnvironment
+
+            async def items():
+                yield 1
+
+            env = NativeComprehensionEnvironment(enable_async=True)
+            assert asyncio.run(env.from_string('{{ [x for x in y] }}').render_async(y=[1])) == [1]
+            print('asyncstdlib' in sys.modules)
+            assert asyncio.run(env.from_string('{{ y }}').render_async(y=items())) == [1]
+            print('asyncstdlib' in sys.modules)
+        ''')
+        assert result.stdout.split() == ['False', 'True']
+
+    @pytest.mark.parametrize('name', jinja_comprehensions.__all__)
+    def it_resolves_public_names(self, name):
+        assert getattr(jinja_comprehensions, name) is not None
+        assert name in dir(jinja_comprehensions)
+
+    def it_raises_attribute_error_for_unknown_names(self):
+        with pytest.raises(AttributeError):
+            jinja_comprehensions.NoSuchThing
@@ -0,0 +1,263 @@
+import asyncio
+
+import pytest
+from pytest_lambda import lambda_fixture, static_fixture
+
+from jinja_comprehensions import (
+    NativeComprehensionEnvironment,
+    NoLiteralEvalComprehensionNativeEnvironment,
+    NoLiteralEvalNativeEnvironment,
+)
+
+native_env_class = lambda_fixture(params=[
+    pytest.param(NativeComprehensionEnvironment, id='native'),
+    pytest.param(NoLiteralEvalNativeEnvironment, id='no_literal_eval'),
+    pytest.param(NoLiteralEvalComprehensionNativeEnvironment, id='native-no_literal_eval'),
+])
+
+
+class DescribeNativeRenderOptions:
+    def it_declares_defaults(self, native_env_class):
+        env = native_env_class()
+        assert env.concurrent_await is False
+        assert env.concurrent_await_limit is None
+        assert env.render_timeout is None
+        assert env.render_batch_size == 8192
+
+
+class DescribeConcurrentAwait:
+    concurrent_await_limit = static_fixture(None)
+    render_timeout = static_fixture(None)
+
+    @pytest.fixture
+    def async_env(self, native_env_class, concurrent_await_limit, render_timeout):
+        env = native_env_class(enable_async=True)
+        env.concurrent_await = True
+        env.concurrent_await_limit = concurrent_await_limit
+        env.render_timeout = render_timeout
+        return env
+
+    @pytest.mark.asyncio
+    async def it_awaits_output_values_concurrently_in_order(self, async_env, tracker):
+        template = async_env.from_string('{{ a }}-{{ b }}-{{ c }}')
+        actual = await template.render_async(
+            a=tracker.fetch('x', 0.03), b=tracker.fetch('y', 0.02), c=tracker.fetch('z', 0.01),
+        )
+        assert actual == 'x-y-z'
+        assert tracker.max_active == 3
+
+    @pytest.mark.asyncio
+    async def it_passes_through_single_native_value(self, async_env, tracker):
+        template = async_env.from_string('{{ a }}')
+        actual = await template.render_async(a=tracker.fetch([1, 2, 3]))
+        assert actual == [1, 2, 3]
+
+    @pytest.mark.asyncio
+    async def it_awaits_output_calls_concurrently(self, async_env, tracker):
+        template = async_env.from_string(
+            "{{ fetch('w', 0.1) }}{{ fetch('x', 0.1) }}{{ fetch('y', 0.1) }}{{ fetch('z', 0.1) }}"
+        )
+        actual = await template.render_async(fetch=tracker.fetch)
+        assert actual == 'wxyz'
+        assert tracker.max_active == 4
+
+    @pytest.mark.asyncio
+    async def it_awaits_output_filters_concurrently(self, async_env, tracker):
+        async_env.filters['fetch'] = tracker.fetch
+        template = async_env.from_string("{{ 'x' | fetch }}-{{ 'y' | fetch }}")
+        actual = await template.render_async()
+        assert actual == 'x-y'
+        assert tracker.max_active == 2
+
+    @pytest.mark.asyncio
+    async def it_passes_through_single_native_call_result(self, async_env, tracker):
+        template = async_env.from_string('{{ fetch([1, 2, 3]) }}')
+        assert await template.render_async(fetch=tracker.fetch) == [1, 2, 3]
+
+    class ContextLimit:
+        concurrent_await_limit = static_fixture(2)
+
+        @pytest.mark.asyncio
+        async def it_limits_concurrency_of_calls(self, async_env, tracker):
+            template = async_env.from_string(
+                "{{ fetch('w') }}{{ fetch('x') }}{{ fetch('y') }}{{ fetch('z') }}"
+            )
+            actual = await template.render_async(fetch=tracker.fetch)
+            assert actual == 'wxyz'
+            assert tracker.max_active == 2
+
+        @pytest.mark.asyncio
+        async def it_limits_concurrency(self, async_env, tracker):
+            template = async_env.from_string('{{ a }}{{ b }}{{ c }}{{ d }}')
+            actual = await template.render_async(
+                a=tracker.fetch('w'), b=tracker.fetch('x'), c=tracker.fetch('y'), d=tracker.fetch('z'),
+            )
+            assert actual == 'wxyz'
+            assert tracker.max_active == 2
+
+    class ContextTimeout:
+        render_timeout = static_fixture(0.01)
+
+        @pytest.mark.asyncio
+        async def it_cancels_render_on_timeout(self, async_env, tracker):
+            template = async_env.from_string('{{ a }}{{ b }}')
+            with pytest.raises(asyncio.TimeoutError):
+                await template.render_async(a=tracker.fetch(1, 1), b=tracker.fetch(2, 1))
+            await asyncio.sleep(0)
+            assert tracker.active == 0
+
+
+class DescribeRenderTo:
+    # Only output which isn't literal_eval'd is streamed
+    native_env_class = lambda_fixture(params=[
+        pytest.param(NoLiteralEvalNativeEnvironment, id='no_literal_eval'),
+        pytest.param(NoLiteralEvalComprehensionNativeEnvironment, id='native-no_literal_eval'),
+    ])
+    source = static_fixture('{% for i in range(5) %}{{ i }},{% endfor %}')
+    is_async = lambda_fixture(params=[
+        pytest.param(False, id='sync'),
+        pytest.param(True, id='async'),
+    ])
+
+    @pytest.fixture
+    def env(self, native_env_class, is_async):
+        env = native_env_class(enable_async=is_async)
+        env.render_batch_size = 4
+        return env
+
+    @pytest.fixture
+    def writes(self):
+        return []
+
+    def it_writes_output_in_batches(self, env, source, writes):
+        sink = type('Sink', (), {'write': staticmethod(writes.append)})
+        assert env.from_string(source).render_to(sink) is None
+        assert writes == ['0,1,', '2,3,', '4,']
+
+    def it_passes_through_single_native_value(self, env, writes):
+        sink = type('Sink', (), {'write': staticmethod(writes.append)})
+        assert env.from_string('{{ items }}').render_to(sink, items=[1, 2]) == [1, 2]
+        assert writes == []
+
+    is_async_only = lambda_fixture(lambda is_async: is_async or pytest.skip('async-only'))
+
+    @pytest.mark.asyncio
+    async def it_writes_output_in_batches_async(self, env, source, writes, is_async_only):
+        class Sink:
+            async def write(self, text):
+                writes.append(text)
+
+        assert await env.from_string(source).render_to_async(Sink()) is None
+        assert writes == ['0,1,', '2,3,', '4,']
+
+    @pytest.mark.asyncio
+    async def it_drains_writer_async(self, env, source, writes, is_async_only):
+        class Sink:
+            drains = 0
+
+            def write(self, text):
+                writes.append(text)
+
+            async def drain(self):
+                self.drains += 1
+
+        sink = Sink()
+        await env.from_string(source).render_to_async(sink)
+        assert sink.drains == len(writes) == 3
+
+
+class DescribeRenderToConcat:
+    is_async = lambda_fixture(params=[
+        pytest.param(False, id='sync'),
+        pytest.param(True, id='async'),
+    ])
+
+    @pytest.mark.parametrize('source', [
+        pytest.param('{% for i in range(5) %}{{ i }},{% endfor %}', id='literal-output'),
+        pytest.param('''{{ "'a'" }}''', id='quoted-string'),
+        pytest.param('{{ "123" }}', id='numeric-string'),
+        pytest.param('{% for i in range(3) %}{{ i }};{% endfor %}', id='plain-output'),
+        pytest.param('{{ items }}', id='single-value'),
+        pytest.param('', id='empty'),
+    ])
+    def it_renders_same_as_render(self, native_env_class, is_async, source):
+        writes = []
+        sink = type('Sink', (), {'write': staticmethod(writes.append)})
+        template = native_env_class(enable_async=is_async).from_string(source)
+
+        result = template.render_to(sink, items=[1, 2])
+        if writes:
+            assert result is None
+            result = ''.join(writes)
+        if is_async:
+            assert result == asyncio.run(template.render_async(items=[1, 2]))
+        else:
+            assert result == template.render(items=[1, 2])
+
+
+class DescribeSingleOutputFastPath:
+    is_async = lambda_fixture(params=[
+        pytest.param(False, id='sync'),
+        pytest.param(True, id='async'),
+    ])
+
+    @pytest.fixture
+    def env(self, native_env_class, is_async):
+        return native_env_class(enable_async=is_async)
+
+    @pytest.fixture
+    def render(self, is_async):
+        def _render(template, *args, **kwargs):
+            if is_async:
+                return asyncio.run(template.render_async(*args, **kwargs))
+            return template.render(*args, **kwargs)
+        return _render
+
+    @pytest.mark.parametrize('source', [
+        '{{ items }}',
+        '{{ items[0] }}',
+        '{{ "12" }}',
+        "{{ \"'12'\" }}",
+        '{{ 12 }}',
+        '{{ items | join(",") }}',
+    ])
+    def it_renders_same_as_root_render_func(self, env, render, source):
+        template = env.from_string(source)
+        assert template.render_value_func is not None
+
+        slow_template = env.from_string(source)
+        slow_template.render_value_func = None
+        expected = render(slow_template, items=[1, 2])
+        assert render(template, items=[1, 2]) == expected
+
+    @pytest.mark.parametrize('source', [
+        'a{{ items }}',
+        '{{ items }}{{ items }}',
+        '{% set x = 1 %}{{ x }}',
+        '{{ self }}',
+    ])
+    def it_skips_other_templates(self, env, source):
+        assert env.from_string(source).render_value_func is None
+
+    def it_resolves_globals_and_variables(self, env, render):
+        env.globals['g'] = 1
+        template = env.from_string('{{ (g, a, b) }}', globals={'a': 2})
+        assert render(template, {'b': 3}) == (1, 2, 3)
+        assert render(template, b=3, a=4) == (1, 4, 3)
+
+    def it_accepts_variables_as_pairs(self, env, render):
+        template = env.from_string('{{ a }}')
+        assert render(template, [('a', 1)]) == 1
+        assert render(template, [('a', 1)], b=2) == 1
+
+    def it_finalizes_value(self, native_env_class, is_async, render):
+        env = native_env_class(enable_async=is_async, finalize=lambda v: 'none' if v is None else v)
+        assert render(env.from_string('{{ items }}'), items=None) == 'none'
+
+    @pytest.mark.asyncio
+    async def it_awaits_value_async(self, native_env_class):
+        async def fetch():
+            return [1, 2]
+
+        template = native_env_class(enable_async=True).from_string('{{ fetch() }}')
+        assert await template.render_async(fetch=fetch) == [1, 2]
@@ -0,0 +1,92 @@
+import copy
+import gc
+import pickle
+import weakref
+
+import pytest
+from jinja2 import nodes as jinja_nodes
+from pytest_lambda import lambda_fixture
+
+from jinja_comprehensions import nodes
+from jinja_comprehensions.nodes import CustomNodeType
+
+#: Exercises every custom node type produced by the parser
+SOURCE = '''
+{%- set pairs = {'a': 1, **extra} -%}
+{{ [*items, (1, *items)] }}
+{{ {1, *items} }}
+{{ [x * y for x in items if x for y in items] }}
+{{ {k: v for k, v in pairs.items() if k in ['a', 'b']} }}
+{{ {x for x in items} }}
+{{ (x for x in items) | list }}
+'''
+
+
+@pytest.fixture
+def env(env_class):
+    return env_class()
+
+
+def custom_nodes(tree):
+    return [node for node in tree.find_all(jinja_nodes.Node) if isinstance(type(node), CustomNodeType)]
+
+
+class DescribeCustomNodeType:
+    def it_stores_fields_and_attributes_in_slots(self, env):
+        tree = env.parse(SOURCE)
+        found = custom_nodes(tree)
+        assert {type(node) for node in found} >= {
+            nodes.Tuple, nodes.List, nodes.Set, nodes.Dict, nodes.SpreadScalars, nodes.SpreadPairs,
+            nodes.ComprehensionComponent, nodes.ListComprehension, nodes.DictComprehension,
+            nodes.SetComprehension, nodes.Generator,
+        }
+        for node in found:
+            assert vars(node) == {}, type(node).__name__
+
+    def it_declares_each_slot_once(self):
+        slots = nodes.ListComprehension.__mro__
+        declared = [name for cls in slots for name in cls.__dict__.get('__slots__', ())]
+        assert sorted(declared) == sorted(set(declared))
+        assert set(declared) == {*nodes.ListComprehension.fields, *nodes.ListComprehension.attributes}
+
+    def it_copies_and_pickles_nodes(self, env):
+        for node in custom_nodes(env.parse(SOURCE)):
+            clone = copy.copy(node)
+            assert clone == node
+            assert clone.lineno == node.lineno
+
+            node.environment = None
+            for child in node.find_all(jinja_nodes.Node):
+                child.environment = None
+            assert pickle.loads(pickle.dumps(node)) == node
+
+
+class DescribeParseTreeRelease:
+    is_async = lambda_fixture(params=[
+        pytest.param(False, id='sync'),
+        pytest.param(True, id='async'),
+    ])
+
+    @pytest.fixture
+    def env(self, env_class, is_async):
+        return env_class(enable_async=is_async)
+
+    @pytest.fixture
+    def no_gc(self):
+        gc.disable()
+        try:
+            yield
+        finally:
+            gc.enable()
+
+    def it_releases_parse_tree_after_codegen(self, env, no_gc):
+        tree = env.parse(SOURCE)
+        refs = [weakref.ref(node) for node in tree.find_all(jinja_nodes.Node)]
+        refs.append(weakref.ref(tree))
+
+        template = env.template_class.from_code(env, env.compile(tree), env.make_globals(None))
+        del tree
+
+        # Without the garbage collector, so trees mustn't even be held in cycles
+        assert [ref() for ref in refs if ref() is not None] == []
+        assert template.root_render_func is not None
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+from pytest_lambda import lambda_fixture
+
+from jinja_comprehensions import runtime
+
+np = pytest.importorskip('numpy')
+
+AMOUNTS = [-1.5, 0.0, 1.0, 2.0, 3.5, float('nan')]
+
+
+class DescribeNumpyComprehensions:
+    is_async = lambda_fixture(params=[
+        pytest.param(False, id='sync'),
+        pytest.param(True, id='async'),
+    ])
+
+    @pytest.fixture
+    def make_env(self, env_class, is_async):
+        def make_env(numpy_comprehensions):
+            env = env_class(enable_async=is_async)
+            env.numpy_comprehensions = numpy_comprehensions
+            return env
+        return make_env
+
+    @pytest.fixture
+    def render(self, is_async):
+        def _render(env, expr, **context):
+            template = env.from_string('{{ %s }}' % expr)
+            if is_async:
+                return asyncio.run(template.render_async(**context))
+            return template.render(**context)
+        return _render
+
+    @pytest.fixture
+    def vectorized(self, monkeypatch):
+        calls = []
+
+        def spy(*args, **kwargs):
+            result = vectorize_comprehension(*args, **kwargs)
+            calls.append(result is not None)
+            return result
+
+        vectorize_comprehension = runtime.vectorize_comprehension
+        monkeypatch.setattr(runtime, 'vectorize_comprehension', spy)
+        return calls
+
+    @pytest.mark.parametrize('expr', [
+        '[x * rate for x in amounts if x > 0]',
+        '[-x // 2 + x ** 2 % 3 for x in amounts if x == x]',
+        '[0 < x <= limit for x in amounts]',
+        '[x for x in amounts if not x or x > limit and x != 2]',
+        '{x / total for x in amounts if x >= 0}',
+        '{x: x - rate for x in amounts if x < limit}',
+    ])
+    def it_evaluates_arrays_with_array_operations(self, make_env, render, vectorized, expr):
+        context = dict(amounts=np.array(AMOUNTS), rate=2, limit=np.float64(1.5), total=4.0)
+        expected = render(make_env(False), expr, **context)
+        assert vectorized == []
+
+        actual = render(make_env(True), expr, **context)
+        assert vectorized == [True]
+        assert str(actual) == str(expected)
+
+    @pytest.mark.parametrize('amounts, rate', [
+        pytest.param(AMOUNTS, 2, id='list'),
+        pytest.param(np.array([AMOUNTS, AMOUNTS]), 2, id='2d-array'),
+        pytest.param(np.array(['a', 'b']), 2, id='str-array'),
+        pytest.param(np.array(AMOUNTS), 'x', id='str-variable'),
+        pytest.param(np.array(AMOUNTS), [1], id='list-variable'),
+    ])
+    def it_falls_back_to_loop(self, make_env, render, vectorized, amounts, rate):
+        expr = '[x * rate for x in amounts]'
+        try:
+            expected = render(make_env(False), expr, amounts=amounts, rate=rate)
+        except Exception as e:
+            with pytest.raises(type(e)):
+                render(make_env(True), expr, amounts=amounts, rate=rate)
+        else:
+            assert str(render(make_env(True), expr, amounts=amounts, rate=rate)) == str(expected)
+        assert vectorized == [False]
+
+    @pytest.mark.parametrize('expr', [
+        '[x * 2 for x in amounts for y in [1]]',
+        '[x and 1 for x in amounts]',
+        '[not x for x in amounts]',
+        '[x ~ "" for x in amounts]',
+        '[x | abs for x in amounts]',
+        '[rate for x in amounts]',
+        '[x for x in amounts if rate]',
+        '{k: v for k, v in pairs}',
+    ])
+    def it_leaves_other_comprehensions_alone(self, make_env, render, vectorized, expr):
+        context = dict(amounts=np.array([1, 2]), rate=2, pairs=[(1, 2)])
+        expected = render(make_env(False), expr, **context)
+        assert str(render(make_env(True), expr, **context)) == str(expected)
+        assert vectorized == []
+
+    def it_vectorizes_nested_comprehensions(self, make_env, render, vectorized):
+        expr = '[[x * y for x in amounts if x > y] for y in [1, 2]]'
+        actual = render(make_env(True), expr, amounts=np.array([1, 2, 3]))
+        assert str(actual) == str(render(make_env(False), expr, amounts=np.array([1, 2, 3])))
+        assert vectorized == [True, True]
+
+    def it_vectorizes_comprehensions_within_iterables(self, make_env, vectorized):
+        env = make_env(True)
+        source = '{% for y in {x: x * 2 for x in amounts}.values() %}{{ y }};{% endfor %}'
+        template = env.from_string(source)
+        if env.is_async:
+            actual = asyncio.run(template.render_async(amounts=np.array([1, 2])))
+        else:
+            actual = template.render(amounts=np.array([1, 2]))
+        assert actual == '2;4;'
+        assert vectorized == [True]
@@ -0,0 +1,505 @@
+import itertools
+
+import jinja2
+import pytest
+from pytest_lambda import lambda_fixture
+
+from jinja_comprehensions import NativeComprehensionEnvironment, SandboxedComprehensionEnvironment
+
+from .base import BaseJinjaEvaluationTest
+
+FOLDABLE_EXPRS = {
+    'list-comp':
+        '''[n // 2 for n in range(10)]''',
+    'set-comp':
+        '''{n // 2 for n in range(10)}''',
+    'dict-comp':
+        '''{'k%s' % n: n * 2 for n in range(10) if n % 3}''',
+    'dict-comp-tuple-iter':
+        '''{k: v for k, v in [('a', 1), ('b', 2)]}''',
+    'list-comp-nested':
+        '''[[m for m in range(n)] for n in range(4)]''',
+    'list-comp-shadowed-target':
+        '''[n for n in range(4) for n in range(n)]''',
+    'gen-call':
+        '''list(n // 2 for n in range(10))''',
+}
+
+UNFOLDABLE_EXPRS = {
+    'undeclared-name':
+        '''[n for n in range(count)]''',
+    'method-call':
+        '''[n for n in {'a': 1}.keys()]''',
+    'too-many-iterations':
+        '''[n for n in range(100000) if n < 0]''',
+    'raises-at-runtime':
+        '''[1 // n for n in range(3)]''',
+    'oversized-call-result':
+        '''[x for x in [1] if (range(10 ** 8) | list | length)]''',
+    'oversized-call-results':
+        '''[x for x in range(2000) if (range(9999) | list | length)]''',
+    'unsized-call-result':
+        '''[x for x in [1] if range(10 ** 20)]''',
+    'oversized-filter-result':
+        '''[(x | center(20000)) | length for x in 'ab']''',
+}
+
+
+def _root_source(env: jinja2.Environment, source: str) -> str:
+    return env.compile(source, raw=True).split('def root', 1)[1]
+
+
+class DescribeConstantFolding(BaseJinjaEvaluationTest):
+    expr = lambda_fixture(params=[
+        pytest.param(expr, id=name)
+        for name, expr in FOLDABLE_EXPRS.items()
+    ])
+
+    def it_emits_comprehension_as_literal(self, sync_env, source):
+        root = _root_source(sync_env, source)
+        # Folded calls to globals are guarded: the comprehension is only evaluated
+        # if the global turns out to be shadowed at render time
+        assert ' for ' not in root or "is environment.globals.get('range')) else " in root
+
+    def it_evaluates_comprehension_if_context_shadows_global(
+        self, env_class, env_kwargs, add_env_globals, source
+    ):
+        context = {'range': lambda n: [7] * n}
+        optimized = add_env_globals(env_class(**env_kwargs)).from_string(source)
+        unoptimized = add_env_globals(env_class(**env_kwargs, optimized=False)).from_string(source)
+        assert optimized.render(context) == unoptimized.render(context)
+
+    def it_does_not_fold_shadowed_globals(self, sync_env):
+        sync_env.globals['custom'] = lambda n: 'x' * n
+        source = '{% set range = custom %}{{ [n for n in range(3)] }}'
+        assert ' for ' in _root_source(sync_env, source)
+        assert str(sync_env.from_string(source).render()) == "['x', 'x', 'x']"
+
+    def it_does_not_fold_when_optimizer_disabled(self, env_class, env_kwargs, source):
+        env = env_class(**env_kwargs, optimized=False)
+        assert ' for ' in _root_source(env, source)
+
+
+class DescribeUnfoldableComprehensions:
+    source = lambda_fixture(params=[
+        pytest.param('{{ %s }}' % expr, id=name)
+        for name, expr in UNFOLDABLE_EXPRS.items()
+    ])
+
+    def it_leaves_comprehension_to_runtime(self, sync_env, source):
+        root = _root_source(sync_env, source)
+        assert ' for ' in root
+        assert 'environment.globals.get(' not in root
+
+    def it_leaves_comprehension_to_runtime_in_sandbox(self, source):
+        env = SandboxedComprehensionEnvironment()
+        assert 'environment.globals.get(' not in _root_source(env, source)
+
+
+FUSABLE_FILTER_EXPRS = {
+    'select-map-list':
+        '''[n * 3 for n in items if n != 4] | select('odd') | map('string') | list''',
+    'reject-sum':
+        '''[n for n in items] | reject('gt', 5) | sum''',
+    'selectattr-join':
+        '''[{'a': n, 'b': n % 2} for n in items] | selectattr('b') | map(attribute='a') | join(',')''',
+    'rejectattr-list':
+        '''[{'a': n, 'b': n % 2} for n in items] | rejectattr('b', 'equalto', 1) | list''',
+    'select-truthy-first':
+        '''[n - 3 for n in items] | select | first''',
+    'length':
+        '''[n for n in items if n % 3] | length''',
+    'generator-select-list':
+        '''(n * n for n in items) | select('divisibleby', 3) | list''',
+    'unfusable-map-list':
+        '''[n for n in items] | select('gt', 100) | map('unknown_filter_never_called') | reject | list''',
+}
+
+
+class DescribeFilterFusion:
+    source = lambda_fixture(params=[
+        pytest.param('{{ %s }}' % expr, id=name)
+        for name, expr in FUSABLE_FILTER_EXPRS.items()
+    ])
+    context = lambda_fixture(lambda: {'items': list(range(10))})
+
+    def it_renders_same_as_unoptimized(self, env_class, env_kwargs, source, context):
+        optimized = env_class(**env_kwargs).from_string(source)
+        unoptimized = env_class(**env_kwargs, optimized=False).from_string(source)
+        assert optimized.render(context) == unoptimized.render(context)
+
+    @pytest.mark.asyncio
+    async def it_renders_same_as_unoptimized_async(self, env_class, env_kwargs, source, context):
+        optimized = env_class(**env_kwargs, enable_async=True).from_string(source)
+        unoptimized = env_class(**env_kwargs, enable_async=True, optimized=False).from_string(source)
+        assert await optimized.render_async(context) == await unoptimized.render_async(context)
+
+    def it_fuses_filters_into_comprehension(self, sync_env):
+        source = '''{{ [n for n in items] | select('odd') | map('string') | list }}'''
+        root_source = _root_source(sync_env, source)
+        for filter_name in ('select', 'map', 'list'):
+            assert f"filters['{filter_name}']" not in root_source
+
+    @pytest.mark.parametrize('source', [
+        pytest.param('''{{ [log(n) for n in items] | select | first }}''', id='call-in-element'),
+        pytest.param('''{{ [n for n in items if log(n)] | select | first }}''', id='call-in-condition'),
+        pytest.param('''{{ [n for n in items] | map('log') | select | first }}''', id='custom-mapped-filter'),
+        pytest.param('''{{ [n for n in items] | select('logged') | first }}''', id='custom-selected-test'),
+    ])
+    def it_does_not_fuse_filters_with_side_effects(self, env_class, env_kwargs, source):
+        def render(**options):
+            calls = []
+
+            def log(value):
+                calls.append(value)
+                return value + 1
+
+            env = env_class(**env_kwargs, **options)
+            env.filters['log'] = log
+            env.tests['logged'] = log
+            return env.from_string(source).render(items=[1, 2, 3], log=log), calls
+
+        assert render() == render(optimized=False)
+
+    def it_does_not_fuse_overridden_filters(self, sync_env):
+        sync_env.filters['select'] = lambda seq, *args: [1337]
+        source = '''{{ [n for n in items] | select('odd') | list }}'''
+        assert str(sync_env.from_string(source).render(items=[1, 2, 3])) == '[1337]'
+
+
+class DescribeListDemotion:
+    @pytest.fixture
+    def env(self, env_class, env_kwargs):
+        env = env_class(**env_kwargs, extensions=['jinja2.ext.loopcontrols'])
+        env.globals.update(any=any, all=all, max=max)
+        return env
+
+    # NOTE: the comprehensions below iterate over an endless iterator, so they
+    #       only complete if they're emitted as generators.
+    DEMOTED_SOURCES = {
+        'first-filter':
+            '''{{ [n for n in numbers if n > 5] | first }}''',
+        'any-global':
+            '''{{ any([n > 5 for n in numbers]) }}''',
+        'comprehension-iterable':
+            '''{{ [m * 2 for m in [n for n in numbers] if m > 5] | first }}''',
+        'for-loop':
+            '''{% for n in [n * 2 for n in numbers] %}{% if n > 5 %}{{ n }}{% break %}{% endif %}{% endfor %}''',
+    }
+
+    @pytest.mark.parametrize('source', [
+        pytest.param(source, id=name)
+        for name, source in DEMOTED_SOURCES.items()
+    ])
+    def it_emits_generator_for_single_pass_consumers(self, env, source):
+        actual = env.from_string(source).render(numbers=itertools.count())
+        assert str(actual) in ('6', '12', 'True')
+
+    def it_keeps_list_when_loop_body_may_have_side_effects(self, env):
+        source = '''{% for n in [x for x in items] %}{{ items.append(n) }}{% endfor %}{{ items | length }}'''
+        actual = env.from_string(source).render(items=[1, 2])
+        assert str(actual).endswith('4')
+
+    @pytest.mark.parametrize('source', [
+        pytest.param('''{{ [log(n) for n in items] | first }}''', id='first'),
+        pytest.param('''{{ [log(n) for n in items] | unique | first }}''', id='unique-first'),
+        pytest.param('''{{ [n for n in items if log(n)] | join(',') }}''', id='join'),
+    ])
+    def it_keeps_list_for_consuming_filters_with_side_effects(self, env, source):
+        calls = []
+
+        def log(value):
+            calls.append(value)
+            return value
+
+        env.from_string(source).render(items=[1, 2, 3], log=log)
+        assert calls == [1, 2, 3]
+
+    def it_raises_errors_of_later_elements_for_consuming_filters(self, env):
+        source = '''{{ [inverse(n) for n in items] | first }}'''
+        with pytest.raises(ZeroDivisionError):
+            env.from_string(source).render(items=[1, 0], inverse=lambda n: 1 // n)
+
+    def it_keeps_list_for_shadowed_globals(self, env):
+        source = '''{% set any = length %}{{ any([n for n in items]) }}'''
+        env.globals['length'] = len
+        assert str(env.from_string(source).render(items=[1, 2])) == '2'
+
+    def it_keeps_list_for_globals_overridden_by_context(self, env):
+        source = '''{{ any([n for n in items]) }}'''
+        assert str(env.from_string(source).render(items=[1, 2], any=len)) == '2'
+
+    def it_emits_generator_for_builtins_passed_in_context(self, env_class, env_kwargs):
+        env = env_class(**env_kwargs)
+        source = '''{{ any([n > 5 for n in numbers]) }}'''
+        assert str(env.from_string(source).render(numbers=itertools.count(), any=any)) == 'True'
+
+
+INVARIANT_EXPRS = {
+    'literal-membership':
+        '''[n for n in items if n in [1, 3, 5]]''',
+    'literal-non-membership':
+        '''[n for n in items if n not in (1, 3, 5)]''',
+    'unhashable-literal-membership':
+        '''[n for n in items if [n] in [[1], [3]]]''',
+    'attribute-membership':
+        '''[n for n in items if n in config.allowed]''',
+    'unhashable-membership':
+        '''[n for n in items if n in config.unhashable]''',
+    'string-membership':
+        '''[n for n in ['a', 'x', 'ab'] if n in config.text]''',
+    'invariant-element':
+        '''[config.allowed | length for n in items]''',
+    'invariant-iterable':
+        '''[(n, m) for n in items for m in config.allowed]''',
+    'outer-invariant':
+        '''[[m for m in config.allowed if m in n.pair] for n in pairs]''',
+    'nested-comprehension':
+        '''[n for n in items if n in [m * 2 for m in config.allowed]]''',
+    'iterator-iterable':
+        '''[(n, m) for n in items for m in items | select('odd')]''',
+    'iterator-membership':
+        '''[n for n in items if n in items | reverse]''',
+    'iterator-mapped-iterable':
+        '''[(n, m) for n in items for m in config.allowed | map('abs')]''',
+    'iterator-unique-membership':
+        '''[n for n in items if n in config.allowed | unique]''',
+}
+
+
+class DescribeInvariantHoisting:
+    source = lambda_fixture(params=[
+        pytest.param('{{ %s }}' % expr, id=name)
+        for name, expr in INVARIANT_EXPRS.items()
+    ])
+
+    @pytest.fixture
+    def config(self):
+        class Config:
+            reads = 0
+            unhashable = [[1], 2, {3: 4}]
+            text = 'abc'
+
+            @property
+            def allowed(self):
+                self.reads += 1
+                return [1, 2, 5]
+
+        return Config()
+
+    @pytest.fixture
+    def context(self, config):
+        return {
+            'items': list(range(8)),
+            'pairs': [{'pair': (1, 2)}, {'pair': (5, 7)}],
+            'config': config,
+        }
+
+    hoist_lookups = lambda_fixture(params=[
+        pytest.param(False, id='lookups-per-element'),
+        pytest.param(True, id='lookups-hoisted'),
+    ])
+
+    def it_renders_same_as_unoptimized(self, env_class, env_kwargs, source, context, hoist_lookups):
+        env = env_class(**env_kwargs)
+        env.hoist_invariant_lookups = hoist_lookups
+        optimized = env.from_string(source)
+        unoptimized = env_class(**env_kwargs, optimized=False).from_string(source)
+        assert optimized.render(context) == unoptimized.render(context)
+
+    @pytest.mark.asyncio
+    async def it_renders_same_as_unoptimized_async(self, env_class, env_kwargs, source, context, hoist_lookups):
+        env = env_class(**env_kwargs, enable_async=True)
+        env.hoist_invariant_lookups = hoist_lookups
+        optimized = env.from_string(source)
+        unoptimized = env_class(**env_kwargs, enable_async=True, optimized=False).from_string(source)
+        assert await optimized.render_async(context) == await unoptimized.render_async(context)
+
+    def it_evaluates_invariant_once(self, sync_env, context, config):
+        sync_env.hoist_invariant_lookups = True
+        sync_env.from_string('{{ [n for n in items if n in config.allowed] }}').render(context)
+        assert config.reads == 1
+
+    def it_hoists_invariant_out_of_enclosing_comprehensions(self, sync_env, context, config):
+        sync_env.hoist_invariant_lookups = True
+        source = '{{ [[m for m in items if m in config.allowed] for n in pairs] }}'
+        sync_env.from_string(source).render(context)
+        assert config.reads == 1
+
+    @pytest.mark.parametrize('source', [
+        pytest.param('{{ [config.allowed for n in items] }}', id='attribute'),
+        pytest.param("{{ [n for n in items if n in config['allowed']] }}", id='item'),
+        pytest.param("{{ [n for n in items if n in configs | map(attribute='allowed') | first] }}", id='filter'),
+    ])
+    def it_looks_up_invariants_per_element_by_default(self, sync_env, source):
+        assert 'Invariant()' not in _root_source(sync_env, source)
+
+    def it_reads_properties_per_element_by_default(self, sync_env):
+        class Counter:
+            count = 0
+
+            @property
+            def tick(self):
+                self.count += 1
+                return self.count
+
+        source = '{{ [c.tick for _ in xs] }}'
+        assert str(sync_env.from_string(source).render(c=Counter(), xs=range(5))) == '[1, 2, 3, 4, 5]'
+
+    def it_does_not_hoist_nondeterministic_filters(self, sync_env):
+        source = '{{ [items | random for _ in xs] }}'
+        assert 'Invariant()' not in _root_source(sync_env, source)
+
+    def it_does_not_evaluate_invariant_without_iterations(self, sync_env, context):
+        sync_env.undefined = jinja2.StrictUndefined
+        source = '{{ [n for n in items if n in missing.attribute] }}'
+        assert str(sync_env.from_string(source).render(context, items=[])) == '[]'
+
+    def it_hashes_literal_containers(self, sync_env):
+        source = '''{{ [n for n in items if n in [1, 3, 5]] }}'''
+        assert 'HashedMembership((1, 3, 5))' in _root_source(sync_env, source)
+
+    @pytest.mark.parametrize('source, expected', [
+        ('''{{ [(x, y) for x in ys for y in ys | select('odd')] }}''', '[(2, 3), (3, 3)]'),
+        ('''{{ [x for x in xs if x in ys | reverse] }}''', '[3, 2, 2]'),
+        ('''{{ [x for x in xs if x in ys | map('abs')] }}''', '[3, 2, 2]'),
+        ('''{{ [x for x in xs if x in ys | unique] }}''', '[3, 2, 2]'),
+        ('''{{ [(ys | select('odd') | list, x) for x in xs] }}''', '[([3], 3), ([3], 2), ([3], 2)]'),
+    ])
+    def it_reuses_one_shot_iterators(self, env_class, env_kwargs, source, expected):
+        env = env_class(**env_kwargs)
+        assert str(env.from_string(source).render(xs=[3, 2, 2], ys=[2, 3])) == expected
+
+    def it_collects_hoisted_iterators_once(self, sync_env):
+        source = '''{{ [(x, y) for x in ys for y in ys | select('odd')] }}'''
+        assert 'materialize(' in _root_source(sync_env, source)
+
+    def it_does_not_hoist_iterators_used_as_values(self, sync_env):
+        source = '''{{ [(ys | select('odd'), x) for x in xs] }}'''
+        assert 'Invariant()' not in _root_source(sync_env, source)
+
+    @pytest.mark.parametrize('expr', [
+        pytest.param('''[{'a': y} for x in xs]''', id='dict-literal'),
+        pytest.param('''[[y, 1] for x in xs]''', id='list-literal'),
+        pytest.param('''[{y} for x in xs]''', id='set-literal'),
+        pytest.param('''[[y for y in ys] for x in xs]''', id='list-comp'),
+        pytest.param('''[{y: 1 for y in ys} for x in xs]''', id='dict-comp'),
+        pytest.param('''[d | dictsort for x in xs]''', id='filter'),
+        pytest.param('''[(ys | list, 1) for x in xs]''', id='tuple-of-list'),
+        pytest.param('''[y for x in xs for y in [[1], [2]]]''', id='iterable-of-lists'),
+    ])
+    def it_does_not_share_mutable_elements(self, sync_env, expr):
+        source = '{{ %s }}' % expr
+        assert 'Invariant()' not in _root_source(sync_env, source)
+
+        env = NativeComprehensionEnvironment()
+        result = env.from_string(source).render(xs=[1, 2], ys=[1, 2], y=1, d={'a': 1})
+        assert result[0] is not result[1]
+
+    @pytest.mark.parametrize('expr', [
+        pytest.param('''[(y, 1) for x in xs]''', id='tuple-literal'),
+        pytest.param('''[ys | join(',') for x in xs]''', id='scalar-filter'),
+        pytest.param('''[ys | first for x in xs]''', id='existing-element'),
+        pytest.param('''[(x, y) for x in xs for y in ys | map('string')]''', id='iterable-of-scalars'),
+    ])
+    def it_hoists_immutable_elements(self, sync_env, expr):
+        assert 'Invariant()' in _root_source(sync_env, '{{ %s }}' % expr)
+
+    def it_does_not_hoist_from_impure_comprehensions(self, sync_env, context, config):
+        source = '''{{ [(n, n in config.allowed) for n in items if log.append(n) is none] }}'''
+        sync_env.from_string(source).render(context, log=[])
+        assert config.reads == len(context['items'])
+
+
+HASH_JOIN_EXPRS = {
+    'attribute-join':
+        '''[(o.n, c.name) for o in orders for c in customers if o.cid == c.id]''',
+    'reversed-sides':
+        '''[(o.n, c.name) for o in orders for c in customers if c.id == o.cid]''',
+    'join-with-other-conds':
+        '''[(o.n, c.name) for o in orders if o.n for c in customers if c.name and o.cid == c.id]''',
+    'tuple-target':
+        '''[(o.n, k) for o in orders for k, v in pairs if v == o.cid]''',
+    'tuple-keys':
+        '''[(o.n, c.name) for o in orders for c in customers if (o.cid, 1) == (c.id, 1)]''',
+    'dict-comp':
+        '''{o.n: c.name for o in orders for c in customers if o.cid == c.id}''',
+    'unhashable-keys':
+        '''[(o.n, c.name) for o in orders for c in customers if o.tags == c.tags]''',
+    'one-shot-iterator':
+        '''[(o.n, c) for o in orders for c in once if o.cid == c]''',
+    'missing-keys':
+        '''[(o.n, c.name) for o in orders for c in customers if o.missing == c.missing]''',
+}
+
+
+class DescribeHashJoin:
+    source = lambda_fixture(params=[
+        pytest.param('{{ %s }}' % expr, id=name)
+        for name, expr in HASH_JOIN_EXPRS.items()
+    ])
+
+    @pytest.fixture
+    def context(self):
+        customers = [
+            {'id': i % 4, 'name': f'c{i}', 'tags': [i % 4]}
+            for i in range(6)
+        ]
+        return {
+            'orders': [{'n': n, 'cid': n % 5, 'tags': [n % 5]} for n in range(8)],
+            'customers': customers,
+            'pairs': [(c['name'], c['id']) for c in customers],
+            'once': iter(range(4)),
+        }
+
+    @pytest.fixture
+    def env_kwargs(self):
+        return {}
+
+    def it_renders_same_as_unoptimized(self, env_class, env_kwargs, source, context):
+        optimized = env_class(**env_kwargs).from_string(source)
+        unoptimized = env_class(**env_kwargs, optimized=False).from_string(source)
+        expected = unoptimized.render(context)
+        context['once'] = iter(range(4))
+        assert optimized.render(context) == expected
+
+    @pytest.mark.asyncio
+    async def it_renders_same_as_unoptimized_async(self, env_class, env_kwargs, source, context):
+        optimized = env_class(**env_kwargs, enable_async=True).from_string(source)
+        unoptimized = env_class(**env_kwargs, enable_async=True, optimized=False).from_string(source)
+        expected = await unoptimized.render_async(context)
+        context['once'] = iter(range(4))
+        assert await optimized.render_async(context) == expected
+
+    def it_indexes_inner_iterable(self, sync_env):
+        source = '{{ [(o, c) for o in orders for c in customers if o.cid == c.id] }}'
+        assert 'HashJoin(' in _root_source(sync_env, source)
+
+    @pytest.mark.parametrize('iterable', ['o.items', 'o'])
+    def it_does_not_index_iterables_depending_on_outer_targets(self, sync_env, iterable):
+        source = '{{ [(o, c) for o in orders for c in %s if o.cid == c.id] }}' % iterable
+        assert 'HashJoin(' not in _root_source(sync_env, source)
+
+    def it_does_not_index_impure_comprehensions(self, sync_env):
+        source = '{{ [(o, c) for o in orders for c in customers if o.cid == c.id and f(c)] }}'
+        assert 'HashJoin(' not in _root_source(sync_env, source)
+
+    def it_does_not_evaluate_keys_without_inner_iterations(self, sync_env):
+        sync_env.undefined = jinja2.StrictUndefined
+        source = '{{ [(o, c) for o in orders for c in customers if o.missing.key == c.id] }}'
+        rendered = sync_env.from_string(source).render(orders=[{}], customers=[])
+        assert str(rendered) == '[]'
+
+
+class DescribeRuntimeImports:
+    def it_imports_no_helpers_when_unused(self, sync_env):
+        assert 'jinja_comprehensions.runtime' not in sync_env.compile('{{ [n for n in items] }}', raw=True)
+
+    def it_imports_only_helpers_used(self, sync_env):
+        source = sync_env.compile('{{ [n for n in items if n in allowed] }}', raw=True)
+        imports = [line for line in source.splitlines() if 'jinja_comprehensions.runtime' in line]
+        assert imports == ['from jinja_comprehensions.runtime import Invariant, hashed_container']
+
+    def it_renders_with_helpers_imported_after_use(self, sync_env):
+        source = '{{ [n for n in items if n in allowed] }}'
+        assert str(sync_env.from_string(source).render(items=[1, 2], allowed=[2])) == '[2]'
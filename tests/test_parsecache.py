@@ -0,0 +1,59 @@
+import pytest
+from pytest_lambda import lambda_fixture
+
+from jinja_comprehensions import (
+    ComprehensionEnvironment,
+    NativeComprehensionEnvironment,
+    NoLiteralEvalComprehensionNativeEnvironment,
+)
+from jinja_comprehensions.parsecache import ParseTreeCache
+
+SOURCE = '{{ [n * 2 for n in range(count) if n % 3] }}{% for x in [1, 2] %}{{ x }}{% endfor %}'
+
+
+class DescribeParseTreeCache:
+    cache = lambda_fixture(lambda: ParseTreeCache(capacity=8))
+
+    @pytest.fixture
+    def make_env(self, cache):
+        def make_env(env_class, **kwargs):
+            env = env_class(**kwargs)
+            env.parse_tree_cache = cache
+            return env
+        return make_env
+
+    def it_shares_parses_between_environment_variants(self, make_env, cache):
+        envs = [
+            make_env(env_class, enable_async=is_async)
+            for env_class in (
+                ComprehensionEnvironment,
+                NativeComprehensionEnvironment,
+                NoLiteralEvalComprehensionNativeEnvironment,
+            )
+            for is_async in (False, True)
+        ]
+        for env in envs:
+            env.from_string(SOURCE)
+
+        assert (cache.misses, cache.hits) == (1, 5)
+        assert str(envs[0].from_string(SOURCE).render(count=6)) == '[2, 4, 8, 10]12'
+
+    def it_gives_each_environment_its_own_tree(self, make_env):
+        env = make_env(ComprehensionEnvironment)
+        first = env.parse(SOURCE)
+        second = env.parse(SOURCE)
+        assert first == second
+        assert first is not second
+        assert first.body[0] is not second.body[0]
+        assert all(node.environment is env for node in second.find_all(object))
+
+    def it_keys_by_lexer_config(self, make_env, cache):
+        make_env(ComprehensionEnvironment).parse(SOURCE)
+        make_env(ComprehensionEnvironment, trim_blocks=True).parse(SOURCE)
+        assert cache.misses == 2
+
+    def it_is_bounded(self, make_env, cache):
+        env = make_env(ComprehensionEnvironment)
+        for i in range(20):
+            env.parse(f'{{{{ {i} }}}}')
+        assert len(cache) == 8
@@ -0,0 +1,192 @@
+import asyncio
+
+import pytest
+from jinja2 import DictLoader
+from pytest_lambda import lambda_fixture
+
+from jinja_comprehensions import ComprehensionEnvironment, profile
+from jinja_comprehensions.bccache import get_environment_fingerprint
+from jinja_comprehensions.profiling import CompileProfiler, ComprehensionProfiler
+
+SOURCE = '''\
+{{ [x * y for x in range(k) if x % 2 for y in range(3)] }}
+{{ (n for n in items) | join(',') }}
+{{ [*items, *items] }} {{ {**mapping} }}'''
+
+
+class DescribeComprehensionProfiler:
+    is_async = lambda_fixture(params=[
+        pytest.param(False, id='sync'),
+        pytest.param(True, id='async'),
+    ])
+
+    @pytest.fixture
+    def profiler(self):
+        return ComprehensionProfiler()
+
+    @pytest.fixture
+    def env(self, env_class, is_async, profiler):
+        env = env_class(enable_async=is_async, loader=DictLoader({
+            'a.j2': '{{ [x for x in items] }}',
+            'b.j2': '\n{{ [x for x in items] }}',
+        }))
+        env.comprehension_profiler = profiler
+        return env
+
+    @pytest.fixture
+    def render(self, env, is_async):
+        def _render(source, **context):
+            if source in env.loader.mapping:
+                template = env.get_template(source)
+            else:
+                template = env.from_string(source)
+            if is_async:
+                return asyncio.run(template.render_async(**context))
+            return template.render(**context)
+        return _render
+
+    @pytest.fixture
+    def stats(self, profiler):
+        def _stats():
+            return {(site.lineno, site.kind): site for site in profiler.get_stats()}
+        return _stats
+
+    def it_renders_same_as_uninstrumented(self, env_class, is_async, render):
+        context = dict(k=6, items=[1, 2], mapping={'a': 1})
+        expected = env_class(enable_async=is_async).from_string(SOURCE)
+        if is_async:
+            expected = asyncio.run(expected.render_async(**context))
+        else:
+            expected = expected.render(**context)
+        assert render(SOURCE, **context) == expected
+
+    def it_counts_calls_iterations_and_rejections(self, render, stats):
+        for _ in range(2):
+            render(SOURCE, k=6, items=[1, 2], mapping={'a': 1})
+
+        sites = stats()
+        comprehension = sites[1, 'list']
+        assert comprehension.calls == 2
+        assert comprehension.iterated == [12, 18]
+        assert comprehension.filtered == [6, 0]
+        assert comprehension.time > 0
+
+        generator = sites[2, 'generator']
+        assert generator.calls == 2
+        assert generator.iterated == [4]
+
+        spread = sites[3, 'spread']
+        assert spread.calls == 2
+        assert spread.iterated == [4]
+        assert sites[3, 'spread-pairs'].iterated == [2]
+
+    def it_identifies_sites_by_template_and_line(self, render, profiler):
+        render('a.j2', items=[1])
+        render('b.j2', items=[1])
+        assert sorted(site.location for site in profiler.get_stats()) == ['a.j2:1', 'b.j2:2']
+
+    def it_resets_stats(self, render, profiler):
+        render('{{ [x for x in items] }}', items=[1])
+        profiler.reset()
+        assert profiler.get_stats() == []
+
+    def it_reports_sites_sorted(self, render, profiler):
+        render('{{ [x for x in items] }}\n{{ [x for x in items for y in items] }}', items=[1, 2, 3])
+        lines = profiler.report(sort='iterated').splitlines()
+        assert lines[0].split() == ['calls', 'time', '(s)', 'iterated', 'filtered', 'site']
+        assert lines[1].endswith('<template>:2 list')
+        assert lines[2].endswith('<template>:1 list')
+        assert len(profiler.report(limit=1).splitlines()) == 2
+
+    def it_rejects_unknown_sort_keys(self, profiler):
+        with pytest.raises(ValueError):
+            profiler.report(sort='name')
+
+
+class DescribeDisabledProfiling:
+    def it_compiles_no_instrumentation(self):
+        env = ComprehensionEnvironment()
+        source = env.compile(SOURCE, raw=True)
+        assert 'comprehension_profiler' not in source
+
+    def it_changes_environment_fingerprint(self):
+        env = ComprehensionEnvironment()
+        profiled_env = ComprehensionEnvironment()
+        profiled_env.comprehension_profiler = ComprehensionProfiler()
+        assert get_environment_fingerprint(env) != get_environment_fingerprint(profiled_env)
+
+
+class DescribeCompileProfiler:
+    @pytest.fixture
+    def profiler(self):
+        return CompileProfiler()
+
+    @pytest.fixture
+    def env(self, env_class, profiler):
+        env = env_class(loader=DictLoader({'a.j2': SOURCE}))
+        env.compile_profiler = profiler
+        return env
+
+    def it_times_each_stage_per_template(self, env, profiler):
+        env.get_template('a.j2')
+        env.from_string('{{ 1 }}')
+
+        assert [record.name for record in profiler.records] == ['a.j2', None]
+        record = profiler.records[0]
+        assert set(record.stages) == set(CompileProfiler.STAGES)
+        assert all(seconds > 0 for seconds in record.stages.values())
+        assert record.source_size == len(env.compile(SOURCE, 'a.j2', raw=True))
+
+    def it_compiles_same_code_as_unprofiled(self, env_class, env):
+        expected = env_class().compile(SOURCE, 'a.j2', raw=True)
+        assert env.compile(SOURCE, 'a.j2', raw=True) == expected
+
+    def it_aggregates_stats(self, env, profiler):
+        for source in ('{{ 1 }}', SOURCE):
+            env.from_string(source)
+
+        totals = profiler.totals()
+        assert totals['codegen'] == sum(record.stages['codegen'] for record in profiler.records)
+        assert profiler.heaviest(1)[0].total == max(record.total for record in profiler.records)
+
+        report = profiler.report(limit=1)
+        assert report.startswith('2 templates compiled')
+        assert report.splitlines()[-2].split()[0] == 'total'
+
+    def it_skips_expressions(self, env, profiler):
+        env.compile_expression('[x for x in items]')
+        assert profiler.records == []
+
+
+class DescribeProfileCommand:
+    @pytest.fixture
+    def templates(self, tmp_path):
+        directory = tmp_path / 'templates'
+        (directory / 'sub').mkdir(parents=True)
+        (directory / 'a.j2').write_text(SOURCE)
+        (directory / 'sub' / 'b.j2').write_text('{{ {k: v for k, v in items} }}')
+        (directory / 'notes.txt').write_text('{{ [x for }}')
+        return directory
+
+    def it_prints_stage_timings_and_heaviest_templates(self, templates, capsys):
+        assert profile.main(['-e', 'native', '--glob', '*.j2', str(templates)]) == 0
+        out = capsys.readouterr().out
+        assert 'NativeComprehensionEnvironment' in out
+        assert '2 templates compiled' in out
+        assert all(stage in out for stage in CompileProfiler.STAGES)
+        assert 'sub/b.j2' in out
+
+    def it_reports_failures(self, templates, capsys):
+        assert profile.main([str(templates)]) == 1
+        assert 'notes.txt: TemplateSyntaxError' in capsys.readouterr().err
+
+    def it_emits_generated_source(self, templates, tmp_path):
+        out_dir = tmp_path / 'out'
+        profile.main(['--async', '--glob', '*.j2', '--emit-source', str(out_dir), str(templates)])
+        code = (out_dir / 'sub' / 'b.j2.py').read_text()
+        assert 'async def root' in code
+
+    def it_accepts_env_class_import_paths(self, templates, capsys):
+        env_path = 'jinja_comprehensions.sandbox:SandboxedComprehensionEnvironment'
+        assert profile.main(['-e', env_path, str(templates / 'a.j2')]) == 0
+        assert 'SandboxedComprehensionEnvironment' in capsys.readouterr().out
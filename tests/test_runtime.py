@@ -0,0 +1,93 @@
+import jinja2
+import pytest
+from markupsafe import Markup
+
+from jinja_comprehensions import NoLiteralEvalComprehensionNativeEnvironment, runtime
+
+
+class DescribeSyncifyAwaitable:
+
+    @pytest.fixture(autouse=True)
+    def reset_stats(self):
+        runtime.reset_syncify_stats()
+        yield
+        runtime.reset_syncify_stats()
+
+    @pytest.mark.asyncio
+    async def it_passes_through_plain_values(self):
+        for value in ('abc', 123, [1, 2], {'a': 1}, Markup('<b>')):
+            assert await runtime.syncify_awaitable(value) is value
+        assert runtime.get_syncify_stats() == {'plain': 5}
+
+    @pytest.mark.asyncio
+    async def it_awaits_awaitables(self):
+        async def coro():
+            return 1337
+
+        assert await runtime.syncify_awaitable(coro()) == 1337
+        assert runtime.get_syncify_stats() == {'awaitable': 1}
+
+    @pytest.mark.asyncio
+    async def it_collects_async_iterables(self):
+        async def agen():
+            yield 1
+            yield 2
+
+        assert await runtime.syncify_awaitable(agen()) == [1, 2]
+        assert runtime.get_syncify_stats() == {'async_iterable': 1}
+
+    @pytest.mark.asyncio
+    async def it_passes_through_undefined_without_touching_it(self):
+        undefined = jinja2.StrictUndefined(name='missing')
+        assert await runtime.syncify_awaitable(undefined) is undefined
+        assert runtime.get_syncify_stats() == {'undefined': 1}
+
+    @pytest.mark.asyncio
+    async def it_passes_through_other_sync_values(self):
+        value = object()
+        assert await runtime.syncify_awaitable(value) is value
+        assert runtime.get_syncify_stats() == {'sync': 1}
+
+
+class DescribeAsyncContains:
+
+    @pytest.fixture
+    def consumed(self):
+        return []
+
+    @pytest.fixture
+    def stream(self, consumed):
+        async def _stream():
+            for i in range(5):
+                consumed.append(i)
+                yield i
+        return _stream()
+
+    @pytest.mark.asyncio
+    async def it_stops_consuming_at_first_match(self, stream, consumed):
+        assert await runtime.async_contains(1, stream) is True
+        assert consumed == [0, 1]
+        assert stream.ag_frame is None  # the generator was closed
+
+    @pytest.mark.asyncio
+    async def it_consumes_everything_when_missing(self, stream, consumed):
+        assert await runtime.async_contains(1337, stream) is False
+        assert consumed == [0, 1, 2, 3, 4]
+
+    @pytest.mark.asyncio
+    async def it_uses_native_contains_of_awaited_collections(self):
+        class Container:
+            def __contains__(self, item):
+                return item == 'magic'
+
+        async def coro():
+            return Container()
+
+        assert await runtime.async_contains('magic', coro()) is True
+
+    @pytest.mark.asyncio
+    async def it_is_used_for_membership_tests_in_templates(self, stream, consumed):
+        env = NoLiteralEvalComprehensionNativeEnvironment(enable_async=True)
+        template = env.from_string('{{ 1 in stream }} {{ 1 not in [2] }}')
+        assert await template.render_async(stream=stream) == 'True True'
+        assert consumed == [0, 1]
@@ -0,0 +1,98 @@
+import jinja2
+import pytest
+from jinja2.sandbox import SecurityError
+from pytest_lambda import lambda_fixture, static_fixture
+
+from jinja_comprehensions import (
+    SandboxedComprehensionEnvironment,
+    SandboxedNativeComprehensionEnvironment,
+)
+
+from .base import BaseJinjaEvaluationTest
+
+SANDBOXED_EXPRS = {
+    'list-comp':
+        '''[n * 2 for n in range(10) if n % 3]''',
+    'set-comp':
+        '''{n // 2 for n in range(10)}''',
+    'dict-comp':
+        '''{n: m for n in range(3) for m in range(n)}''',
+    'comp-call':
+        '''[max((n, 4)) for n in range(10)]''',
+    'comp-nested-call':
+        '''[[min((n, m)) for m in range(n)] for n in range(4)]''',
+    'gen-call':
+        '''list(n * 2 for n in range(10))''',
+}
+
+
+class DescribeSandboxedComprehensionEnvironment(BaseJinjaEvaluationTest):
+    env_class = lambda_fixture(params=[
+        pytest.param(SandboxedComprehensionEnvironment, id='sandboxed'),
+        pytest.param(SandboxedNativeComprehensionEnvironment, id='sandboxed-native'),
+    ])
+    expr = lambda_fixture(params=[
+        pytest.param(expr, id=name)
+        for name, expr in SANDBOXED_EXPRS.items()
+    ])
+
+    def it_rejects_unsafe_attributes_in_comprehensions(self, sync_env):
+        template = sync_env.from_string('{{ [f.__globals__.keys() for f in funcs] }}')
+        with pytest.raises(SecurityError):
+            template.render(funcs=[lambda: None])
+
+    def it_rejects_unsafe_callables_in_comprehensions(self, sync_env):
+        def unsafe():
+            pass
+        unsafe.unsafe_callable = True
+
+        template = sync_env.from_string('{{ [f() for n in range(3)] }}')
+        with pytest.raises(SecurityError):
+            template.render(f=unsafe)
+
+    def it_checks_each_callee(self, sync_env):
+        def unsafe():
+            pass
+        unsafe.unsafe_callable = True
+
+        template = sync_env.from_string('{{ [f() for f in funcs] }}')
+        with pytest.raises(SecurityError):
+            template.render(funcs=[lambda: None, unsafe])
+
+    def it_does_not_call_unsafe_callables_never_reached(self, sync_env):
+        def unsafe():
+            pass
+        unsafe.unsafe_callable = True
+
+        template = sync_env.from_string('{{ [f() for n in range(3) if n < 0] }}')
+        assert template.render(f=unsafe) in ('[]', [])
+
+
+class DescribeCallChecks:
+    env_class = static_fixture(SandboxedComprehensionEnvironment)
+
+    @pytest.fixture
+    def checked(self, env, monkeypatch):
+        checked = []
+        is_safe_callable = env.is_safe_callable
+
+        def counting_is_safe_callable(obj):
+            checked.append(obj)
+            return is_safe_callable(obj)
+
+        monkeypatch.setattr(env, 'is_safe_callable', counting_is_safe_callable)
+        return checked
+
+    @pytest.fixture
+    def env(self, env_class):
+        return env_class(undefined=jinja2.StrictUndefined)
+
+    def it_checks_loop_invariant_callee_once(self, env, checked):
+        template = env.from_string('{{ [double(n) for n in items] }}')
+        assert template.render(double=lambda n: n * 2, items=range(100)) == str(list(range(0, 200, 2)))
+        assert len(checked) == 1
+
+    def it_caches_attribute_checks_per_type(self, env):
+        template = env.from_string('{{ [n.real for n in items] }}')
+        template.render(items=range(10))
+        assert env._safe_attributes == {(int, 'real'): True}
@@ -0,0 +1,133 @@
+import pickle
+
+import pytest
+from jinja2 import DictLoader
+from pytest_lambda import lambda_fixture
+
+from jinja_comprehensions import ComprehensionEnvironment, SizedTemplateCache
+from jinja_comprehensions.templatecache import estimate_template_size
+
+TEMPLATES = {
+    'tiny.j2': '{{ x }}',
+    'small.j2': '{{ [n for n in items] }}',
+    'big.j2': '\n'.join(
+        f'{{{{ {{k: [v * {i} for v in vs if v != {i}] for k, vs in groups.items()}} }}}}'
+        for i in range(40)
+    ),
+}
+
+
+class DescribeEstimateTemplateSize:
+    def it_grows_with_compiled_code(self, env_class):
+        env = env_class(loader=DictLoader(TEMPLATES))
+        sizes = [estimate_template_size(env.get_template(name)) for name in TEMPLATES]
+        assert 0 < sizes[0] < sizes[1] < sizes[2]
+
+    def it_counts_constants(self, env_class):
+        env = env_class()
+        short = estimate_template_size(env.from_string('{{ "a" }}'))
+        long = estimate_template_size(env.from_string('{{ "%s" }}' % ('a' * 10_000)))
+        assert long - short >= 10_000
+
+
+class DescribeSizedTemplateCache:
+    max_size = lambda_fixture(lambda sizes: sizes['big.j2'] + sizes['small.j2'])
+    cache = lambda_fixture(lambda max_size: SizedTemplateCache(max_size=max_size))
+
+    @pytest.fixture
+    def sizes(self, env_class):
+        env = env_class(loader=DictLoader(TEMPLATES))
+        return {name: estimate_template_size(env.get_template(name)) for name in TEMPLATES}
+
+    @pytest.fixture
+    def env(self, env_class, cache):
+        env = env_class(loader=DictLoader(TEMPLATES))
+        env.cache = cache
+        return env
+
+    def it_counts_hits_and_misses(self, env, cache):
+        env.get_template('tiny.j2')
+        env.get_template('tiny.j2')
+        env.get_template('small.j2')
+        assert (cache.hits, cache.misses, cache.evictions) == (1, 2, 0)
+
+        cache.reset_stats()
+        assert (cache.hits, cache.misses, cache.evictions) == (0, 0, 0)
+
+    def it_reports_template_sizes(self, env, cache, sizes):
+        env.get_template('small.j2')
+        env.get_template('big.j2')
+        assert cache.sizes() == {'big.j2': sizes['big.j2'], 'small.j2': sizes['small.j2']}
+        assert list(cache.sizes()) == ['big.j2', 'small.j2']
+        assert cache.size == sizes['big.j2'] + sizes['small.j2']
+
+    def it_evicts_least_recently_used_once_too_large(self, env, cache):
+        env.get_template('small.j2')
+        env.get_template('tiny.j2')
+        env.get_template('small.j2')
+        env.get_template('big.j2')
+        assert list(cache.sizes()) == ['big.j2', 'small.j2']
+        assert cache.evictions == 1
+        assert cache.size <= cache.max_size
+
+    def it_never_evicts_pinned_templates(self, env, cache):
+        cache.pin('tiny.j2')
+        env.get_template('tiny.j2')
+        env.get_template('small.j2')
+        env.get_template('big.j2')
+        assert set(cache.sizes()) == {'tiny.j2', 'big.j2'}
+        assert cache.pinned == {'tiny.j2'}
+
+    def it_evicts_once_unpinned(self, env, cache):
+        cache.max_size = 1
+        cache.pin('tiny.j2')
+        env.get_template('tiny.j2')
+        assert list(cache.sizes()) == ['tiny.j2']
+
+        cache.unpin('tiny.j2')
+        assert len(cache) == 0
+        assert cache.size == 0
+
+    def it_renders_cached_templates(self, env):
+        assert str(env.get_template('small.j2').render(items=[1, 2])) == '[1, 2]'
+        assert str(env.get_template('small.j2').render(items=[3])) == '[3]'
+
+    def it_gives_overlays_an_empty_cache_of_the_same_size(self, env, cache):
+        cache.pin('tiny.j2')
+        env.get_template('tiny.j2')
+
+        overlay = env.overlay(trim_blocks=True)
+        assert isinstance(overlay.cache, SizedTemplateCache)
+        assert overlay.cache is not cache
+        assert len(overlay.cache) == 0
+        assert (overlay.cache.max_size, overlay.cache.pinned) == (cache.max_size, cache.pinned)
+
+    def it_pickles_when_empty(self, env, cache):
+        # As when environments are sent to render_many()'s worker processes
+        cache.pin('tiny.j2')
+        env.get_template('small.j2')
+        cache.clear()
+
+        clone = pickle.loads(pickle.dumps(cache))
+        assert (clone.max_size, clone.pinned, clone.misses) == (cache.max_size, {'tiny.j2'}, 1)
+        env.cache = clone
+        assert str(env.get_template('small.j2').render(items=[1])) == '[1]'
+        assert len(clone) == 1
+
+
+class DescribeTemplateCacheMaxSize:
+    @pytest.fixture
+    def env(self, env_class):
+        class Env(env_class):
+            template_cache_max_size = 1024 * 1024
+        return Env(loader=DictLoader(TEMPLATES))
+
+    def it_uses_a_sized_cache(self, env):
+        assert isinstance(env.cache, SizedTemplateCache)
+        assert env.cache.max_size == 1024 * 1024
+
+        env.get_template('small.j2')
+        assert list(env.cache.sizes()) == ['small.j2']
+
+    def it_defaults_to_jinjas_cache(self):
+        assert not isinstance(ComprehensionEnvironment().cache, SizedTemplateCache)